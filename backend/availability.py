@@ -0,0 +1,233 @@
+"""
+Free-slot computation for trainer calendars.
+
+A trainer's ``availability`` is a weekly template in the trainer's own time
+zone (UTC when ``timezone`` is omitted)::
+
+    {"timezone": "America/New_York",
+     "monday": [{"start": "09:00", "end": "17:00"}],
+     "saturday": [{"start": "08:00", "end": "12:00"}]}
+
+Each day is a bitmap of ``BUCKETS_PER_DAY`` 15-minute buckets held in a plain
+int: bit ``i`` covers minutes ``[15*i, 15*(i+1))`` after local midnight. The
+template becomes seven weekday masks; a ``Calendar`` is one mask per date with
+the trainer's active sessions (and series occurrences not booked yet) cleared
+out of it; and a session of ``n`` buckets
+can start wherever ``mask & mask >> 1 & ... & mask >> (n - 1)`` has a bit set.
+Buckets are wall-clock time, so templates follow daylight saving changes.
+
+For search, the seven weekday masks are also stored on the profile as
+``availabilityMask`` (``MASK_BYTES`` little-endian bytes per weekday) next to
+``availabilityTimezone``. ``filter_available`` decodes them, ANDs every
+candidate against the buckets a requested time needs (computed once per time
+zone), and checks the survivors' bookings in a single sessions query (plus
+one for their unbooked series occurrences).
+"""
+import math
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from scheduling import SLOT_MINUTES, find_busy_trainers, find_conflicts
+from series import pending_occurrences
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+BUCKETS_PER_DAY = 24 * 60 // SLOT_MINUTES
+MASK_BYTES = BUCKETS_PER_DAY // 8
+
+
+class InvalidTemplate(ValueError):
+    pass
+
+
+def range_mask(first: int, last: int) -> int:
+    """Bits ``first`` up to but excluding ``last``"""
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def _parse_time(value, round_up: bool) -> int:
+    """Bucket index of an "HH:MM" time, rounded inwards so a window never grows"""
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except ValueError:
+        raise InvalidTemplate(f'Invalid time {value!r}, expected "HH:MM"')
+    total = hours * 60 + minutes
+    if not 0 <= minutes < 60 or not 0 <= total <= 24 * 60:
+        raise InvalidTemplate(f'Invalid time {value!r}, expected "HH:MM"')
+    return math.ceil(total / SLOT_MINUTES) if round_up else total // SLOT_MINUTES
+
+
+def template_timezone(availability: Optional[dict]) -> ZoneInfo:
+    name = (availability or {}).get('timezone') or 'UTC'
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise InvalidTemplate(f'Unknown time zone {name!r}')
+
+
+def weekly_masks(availability: Optional[dict]) -> List[int]:
+    """One bucket mask per weekday, Monday first; raises InvalidTemplate for malformed templates"""
+    availability = availability or {}
+    unknown = set(availability) - set(WEEKDAYS) - {'timezone'}
+    if unknown:
+        raise InvalidTemplate(f'Unknown availability keys: {", ".join(sorted(unknown))}')
+    masks = []
+    for weekday in WEEKDAYS:
+        mask = 0
+        windows = availability.get(weekday) or []
+        if not isinstance(windows, list):
+            raise InvalidTemplate(f'{weekday} must be a list of {{"start", "end"}} windows')
+        for window in windows:
+            if not isinstance(window, dict) or 'start' not in window or 'end' not in window:
+                raise InvalidTemplate(f'{weekday} must be a list of {{"start", "end"}} windows')
+            mask |= range_mask(_parse_time(window['start'], True), _parse_time(window['end'], False))
+        masks.append(mask)
+    return masks
+
+
+def validate_template(availability: Optional[dict]):
+    template_timezone(availability)
+    weekly_masks(availability)
+
+
+def local_midnight_utc(day: date, tz: ZoneInfo) -> datetime:
+    """Naive UTC datetime of ``day``'s local midnight, the form sessions are stored in"""
+    return datetime.combine(day, time(), tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class Calendar(NamedTuple):
+    timezone: str
+    first_day: date
+    # Free buckets per day, starting at first_day
+    masks: List[int]
+
+    @property
+    def last_day(self) -> date:
+        return self.first_day + timedelta(days=len(self.masks) - 1)
+
+    def window(self, start_day: date, end_day: date) -> Optional['Calendar']:
+        """The days ``start_day``..``end_day`` (inclusive), or None if they are not all covered"""
+        if start_day < self.first_day or end_day > self.last_day:
+            return None
+        offset = (start_day - self.first_day).days
+        return self._replace(first_day=start_day, masks=self.masks[offset:offset + (end_day - start_day).days + 1])
+
+
+async def build_calendar(sessions, trainer_id: str, availability: Optional[dict], first_day: date,
+                         days: int, session_series=None) -> Calendar:
+    """The trainer's template for ``days`` dates from ``first_day``, minus their active sessions.
+
+    Pass ``session_series`` to also remove the occurrences their series hold but have not booked yet.
+    """
+    tz = template_timezone(availability)
+    weekly = weekly_masks(availability)
+    masks = [weekly[(first_day + timedelta(days=offset)).weekday()] for offset in range(days)]
+
+    window = (local_midnight_utc(first_day, tz), local_midnight_utc(first_day + timedelta(days=days), tz))
+    booked = await find_conflicts(sessions, trainer_id, [window])
+    if session_series is not None:
+        booked += await pending_occurrences(session_series, [trainer_id], *window)
+    for session in booked:
+        _clear(masks, first_day, tz, session['sessionDateTimeStart'], session['sessionDateTimeEnd'])
+    return Calendar(tz.key, first_day, masks)
+
+
+def _clear(masks: List[int], first_day: date, tz: ZoneInfo, start: datetime, end: datetime):
+    """Remove every bucket that ``[start, end)`` (naive UTC) touches"""
+    local_start = start.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+    local_end = end.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+    day = max(local_start.date(), first_day)
+    while day <= local_end.date() and (day - first_day).days < len(masks):
+        midnight = datetime.combine(day, time())
+        first = max(0, (local_start - midnight) // timedelta(minutes=SLOT_MINUTES))
+        last = min(BUCKETS_PER_DAY, -(-(local_end - midnight) // timedelta(minutes=SLOT_MINUTES)))
+        masks[(day - first_day).days] &= ~range_mask(first, last)
+        day += timedelta(days=1)
+
+
+def free_slots(calendar: Calendar, durations: Iterable[int],
+               not_before: datetime) -> Dict[int, List[Tuple[datetime, datetime]]]:
+    """Bookable ``(start, end)`` pairs (naive UTC) for each duration, starting at or after ``not_before``"""
+    tz = ZoneInfo(calendar.timezone)
+    slots = {}
+    for duration in sorted(set(durations)):
+        buckets = math.ceil(duration / SLOT_MINUTES)
+        found = []
+        for offset, mask in enumerate(calendar.masks):
+            fits = mask
+            for shift in range(1, buckets):
+                fits &= mask >> shift
+            midnight = datetime.combine(calendar.first_day + timedelta(days=offset), time())
+            while fits:
+                lowest = fits & -fits
+                fits ^= lowest
+                local_start = midnight + timedelta(minutes=(lowest.bit_length() - 1) * SLOT_MINUTES)
+                start = local_start.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+                if start >= not_before:
+                    found.append((start, start + timedelta(minutes=duration)))
+        slots[duration] = found
+    return slots
+
+
+# ============================================================================
+# SEARCH
+# ============================================================================
+
+def encode_masks(masks: List[int]) -> bytes:
+    return b''.join(mask.to_bytes(MASK_BYTES, 'little') for mask in masks)
+
+
+def decode_masks(data: bytes) -> List[int]:
+    return [int.from_bytes(data[i * MASK_BYTES:(i + 1) * MASK_BYTES], 'little') for i in range(len(WEEKDAYS))]
+
+
+def availability_fields(availability: Optional[dict]) -> dict:
+    """Profile fields precomputed from the template for availability search"""
+    return {
+        'availabilityMask': encode_masks(weekly_masks(availability)),
+        'availabilityTimezone': template_timezone(availability).key,
+    }
+
+
+def required_buckets(start: datetime, end: datetime, tz: ZoneInfo) -> Dict[int, int]:
+    """Weekday -> buckets that must be free for ``[start, end)`` (naive UTC) in ``tz``"""
+    local_start = start.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+    local_end = end.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+    required = {}
+    day = local_start.date()
+    while datetime.combine(day, time()) < local_end:
+        midnight = datetime.combine(day, time())
+        first = max(0, (local_start - midnight) // timedelta(minutes=SLOT_MINUTES))
+        last = min(BUCKETS_PER_DAY, -(-(local_end - midnight) // timedelta(minutes=SLOT_MINUTES)))
+        required[day.weekday()] = required.get(day.weekday(), 0) | range_mask(first, last)
+        day += timedelta(days=1)
+    return required
+
+
+def _profile_masks(profile: dict) -> Tuple[str, List[int]]:
+    if profile.get('availabilityMask') is not None:
+        return profile.get('availabilityTimezone') or 'UTC', decode_masks(bytes(profile['availabilityMask']))
+    # Profiles saved before the mask was precomputed
+    try:
+        return template_timezone(profile.get('availability')).key, weekly_masks(profile.get('availability'))
+    except InvalidTemplate:
+        return 'UTC', [0] * len(WEEKDAYS)
+
+
+async def filter_available(sessions, profiles: List[dict], start: datetime, end: datetime,
+                           session_series=None) -> List[dict]:
+    """The trainer profiles whose template covers ``[start, end)`` and who have no booking then"""
+    required_by_tz: Dict[str, Dict[int, int]] = {}
+    candidates = []
+    for profile in profiles:
+        tz_name, masks = _profile_masks(profile)
+        if tz_name not in required_by_tz:
+            required_by_tz[tz_name] = required_buckets(start, end, ZoneInfo(tz_name))
+        if all(masks[weekday] & needed == needed for weekday, needed in required_by_tz[tz_name].items()):
+            candidates.append(profile)
+
+    trainer_ids = [profile['userId'] for profile in candidates]
+    busy = await find_busy_trainers(sessions, trainer_ids, start, end)
+    if session_series is not None:
+        busy.update(o['trainerId'] for o in await pending_occurrences(session_series, trainer_ids, start, end))
+    return [profile for profile in candidates if profile['userId'] not in busy]
@@ -0,0 +1,122 @@
+"""
+In-process caching for the RapidReps API.
+
+``TTLCache`` is a read-through cache bounded by both age and size: entries
+expire ``ttl`` seconds after they were stored and the least recently used
+entry is evicted when the cache is full. Hit and miss counts are exported
+through ``metrics.register_cache``.
+
+Writers call ``invalidate(key)``, which goes through an invalidation bus so
+that every worker drops the entry, not just the one that handled the write.
+``LocalInvalidationBus`` is the in-process stand-in used when the API runs as
+a single worker; a multi-worker deployment swaps in a bus backed by a shared
+channel (Redis pub/sub, a MongoDB change stream) with the same two methods.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import register_cache
+
+
+class LocalInvalidationBus:
+    """Delivers invalidations to subscribers in this process only"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+
+    def subscribe(self, channel: str, callback: Callable[[Any], None]):
+        self._subscribers[channel].append(callback)
+
+    def publish(self, channel: str, key):
+        for callback in self._subscribers[channel]:
+            callback(key)
+
+
+invalidation_bus = LocalInvalidationBus()
+
+_caches: List['TTLCache'] = []
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int, ttl: float, bus=invalidation_bus,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bus = bus
+        self.clock = clock
+        # key -> (expires_at, value), least recently used first
+        self._entries: 'OrderedDict[Any, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a fill that raced with a write can be discarded
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        bus.subscribe(name, self._drop)
+        register_cache(name, self.stats)
+        _caches.append(self)
+
+    def get(self, key) -> Optional[Any]:
+        """Cached value for ``key``, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, version: Optional[int] = None):
+        """Store ``value``; skipped if ``version`` was read before an invalidation that has since happened"""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop ``key`` in every worker"""
+        self.bus.publish(self.name, key)
+
+    def _drop(self, key):
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+def clear_all():
+    """Empty every cache (used when the underlying database is swapped out, e.g. in tests)"""
+    for cache in _caches:
+        cache.clear()
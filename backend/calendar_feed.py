@@ -0,0 +1,182 @@
+"""
+Trainer calendar feeds (iCalendar, RFC 5545) for the RapidReps API.
+
+A trainer creates a private feed URL, ``/api/calendar/<token>.ics``, and
+subscribes to it from their phone calendar. The token is
+``<trainerId>.<secret>``. Only a hash of the secret is stored, in the
+trainer's ``calendar_feeds`` document, and creating a new URL invalidates the
+old one.
+
+Calendar apps poll subscriptions often, so polls are meant to cost nothing:
+
+- Every change to one of the trainer's sessions bumps ``sessionsChangedAt`` on
+  the feed document. The ETag and Last-Modified come from that stamp and the
+  current day (the feed's window moves daily), so they change exactly when
+  the feed would.
+- The feed document is cached in-process by trainer id and invalidated with
+  every bump. Each poll first books the series occurrences the horizon has
+  reached (one indexed ``session_series`` query, see series.py), which bumps
+  the stamp when it books anything. A conditional poll that finds nothing
+  new is then answered with 304.
+- When the feed did change, the events stream straight from the
+  ``(trainerId, sessionDateTimeStart)`` range query and are never built in
+  memory as a whole. Declined, cancelled and no-show sessions are skipped as
+  they stream, so the query stays on the ``trainerId_start_id`` index. Series
+  occurrences beyond the booking horizon follow, under the session ids they
+  will be booked with, so a series shows in full from the day it is created.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Iterable, Optional, Tuple
+
+from responses import make_etag
+from session_state import SessionStatus
+
+CALENDAR_FEED_PAST_DAYS = int(os.environ.get('CALENDAR_FEED_PAST_DAYS', '30'))
+CALENDAR_FEED_FUTURE_DAYS = int(os.environ.get('CALENDAR_FEED_FUTURE_DAYS', '180'))
+CALENDAR_MEDIA_TYPE = 'text/calendar; charset=utf-8'
+EVENT_FIELDS = {
+    'status': 1, 'sessionDateTimeStart': 1, 'sessionDateTimeEnd': 1, 'locationType': 1,
+    'locationNameOrAddress': 1, 'notes': 1, 'updatedAt': 1,
+}
+
+# Sessions shown in the feed and their iCalendar STATUS; the rest drop out of the trainer's calendar
+EVENT_STATUSES = {
+    SessionStatus.REQUESTED: 'TENTATIVE',
+    SessionStatus.CONFIRMED: 'CONFIRMED',
+    SessionStatus.COMPLETED: 'CONFIRMED',
+}
+
+
+# ============================================================================
+# TOKENS
+# ============================================================================
+
+def _hash_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def new_token(trainer_id: str) -> Tuple[str, str]:
+    """A fresh feed token and the hash to store for it"""
+    secret = secrets.token_urlsafe(24)
+    return f'{trainer_id}.{secret}', _hash_secret(secret)
+
+
+def parse_token(token: str) -> Optional[Tuple[str, str]]:
+    """``(trainerId, secret hash)`` of a feed token, or None if it is malformed"""
+    trainer_id, _, secret = token.partition('.')
+    if not trainer_id or not secret:
+        return None
+    return trainer_id, _hash_secret(secret)
+
+
+def token_matches(feed: dict, secret_hash: str) -> bool:
+    return hmac.compare_digest(feed.get('tokenHash', ''), secret_hash)
+
+
+# ============================================================================
+# CONDITIONAL GET
+# ============================================================================
+
+def feed_window(today: date) -> Tuple[datetime, datetime]:
+    """Naive UTC bounds on the start of the sessions the feed lists"""
+    midnight = datetime.combine(today, time())
+    return midnight - timedelta(days=CALENDAR_FEED_PAST_DAYS), midnight + timedelta(days=CALENDAR_FEED_FUTURE_DAYS)
+
+
+def feed_validators(feed: dict, today: date) -> Tuple[str, datetime]:
+    """ETag and Last-Modified (naive UTC, whole seconds) of a feed's current contents"""
+    changed_at = feed.get('sessionsChangedAt') or feed['createdAt']
+    last_modified = max(changed_at, datetime.combine(today, time())).replace(microsecond=0)
+    return make_etag(feed['_id'], changed_at.isoformat(), today.isoformat()), last_modified
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(moment.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def modified_since(if_modified_since: Optional[str], last_modified: datetime) -> bool:
+    """False when If-Modified-Since shows the client already has ``last_modified``"""
+    if not if_modified_since:
+        return True
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return last_modified > since
+
+
+# ============================================================================
+# ICALENDAR
+# ============================================================================
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _line(name: str, value: str) -> bytes:
+    """One content line, folded to 75 octets as RFC 5545 requires"""
+    data = f'{name}:{value}'.encode()
+    folded = []
+    while len(data) > 75:
+        cut = 75 if not folded else 74
+        # Never split a multi-byte character
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        folded.append(data[:cut])
+        data = data[cut:]
+    folded.append(data)
+    return b'\r\n '.join(folded) + b'\r\n'
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y%m%dT%H%M%SZ')
+
+
+def event(session: dict, now: datetime) -> bytes:
+    location_type = session.get('locationType') or 'session'
+    lines = [
+        _line('BEGIN', 'VEVENT'),
+        _line('UID', f"{session['_id']}@rapidreps"),
+        _line('DTSTAMP', _timestamp(now)),
+        _line('DTSTART', _timestamp(session['sessionDateTimeStart'])),
+        _line('DTEND', _timestamp(session['sessionDateTimeEnd'])),
+        _line('SUMMARY', _escape(f'RapidReps {location_type} session')),
+        _line('STATUS', EVENT_STATUSES.get(session.get('status'), 'CONFIRMED')),
+    ]
+    if session.get('updatedAt'):
+        lines.append(_line('LAST-MODIFIED', _timestamp(session['updatedAt'])))
+    if session.get('locationNameOrAddress'):
+        lines.append(_line('LOCATION', _escape(session['locationNameOrAddress'])))
+    if session.get('notes'):
+        lines.append(_line('DESCRIPTION', _escape(session['notes'])))
+    lines.append(_line('END', 'VEVENT'))
+    return b''.join(lines)
+
+
+async def feed_body(sessions, now: datetime, pending: Iterable[dict] = ()) -> AsyncIterator[bytes]:
+    """The calendar, one chunk per event, as ``sessions`` (an async cursor) yields them.
+
+    ``pending`` are series occurrences without a session document yet.
+    """
+    yield b''.join([
+        _line('BEGIN', 'VCALENDAR'),
+        _line('VERSION', '2.0'),
+        _line('PRODID', '-//RapidReps//Trainer Sessions//EN'),
+        _line('CALSCALE', 'GREGORIAN'),
+        _line('METHOD', 'PUBLISH'),
+        _line('X-WR-CALNAME', 'RapidReps sessions'),
+    ])
+    async for session in sessions:
+        if session.get('status') in EVENT_STATUSES:
+            yield event(session, now)
+    for occurrence in pending:
+        yield event(occurrence, now)
+    yield _line('END', 'VCALENDAR')
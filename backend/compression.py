@@ -0,0 +1,191 @@
+"""
+Response compression for the RapidReps API.
+
+``CompressionMiddleware`` is a pure ASGI middleware that negotiates brotli or
+gzip from ``Accept-Encoding`` and compresses JSON and text responses above a
+minimum size. Single-message responses are compressed in one go; streaming
+responses are compressed chunk by chunk and flushed after every chunk, so the
+client keeps receiving data as it is produced.
+
+brotli is optional: without the ``brotli`` package only gzip is offered.
+
+Bytes in, bytes out and CPU time spent compressing are recorded per encoding
+in ``metrics``, so the level and threshold can be tuned against real traffic.
+"""
+import os
+import time
+import zlib
+from typing import Optional
+
+from metrics import COMPRESSION_BYTES_IN, COMPRESSION_BYTES_OUT, COMPRESSION_CPU_SECONDS, COMPRESSION_SKIPPED
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+# Brotli quality 4 compresses better than gzip 6 at a similar CPU cost; 11 is for static assets only
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'application/xml')
+# Statuses whose responses carry no body to compress
+BODYLESS_STATUSES = {204, 304}
+
+
+def negotiate_encoding(accept_encoding: str, brotli_available: bool = brotli is not None) -> Optional[str]:
+    """Pick ``br`` or ``gzip`` from an Accept-Encoding header, honouring q-values; None if neither"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    candidates = (['br'] if brotli_available else []) + ['gzip']
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor for one response that keeps its own metrics"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        if self.encoding == 'br':
+            out = self._brotli.process(data) + (self._brotli.finish() if final else self._brotli.flush())
+        else:
+            out = self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        COMPRESSION_CPU_SECONDS.inc(self.encoding, amount=time.thread_time() - started)
+        COMPRESSION_BYTES_IN.inc(self.encoding, amount=len(data))
+        COMPRESSION_BYTES_OUT.inc(self.encoding, amount=len(out))
+        return out
+
+
+def _header(headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESSION_BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accept_encoding = _header(scope['headers'], b'accept-encoding')
+        encoding = negotiate_encoding(accept_encoding.decode('latin-1')) if accept_encoding else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await _CompressedResponse(self, encoding, send)(scope, receive)
+
+
+class _CompressedResponse:
+    """Send wrapper that decides, on the first body chunk, whether to compress"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.compressor: Optional[_Compressor] = None
+        # Set once the response is being passed through untouched
+        self.passthrough = False
+
+    async def __call__(self, scope, receive):
+        await self.middleware.app(scope, receive, self.on_send)
+
+    async def on_send(self, message):
+        if message['type'] == 'http.response.start':
+            self.start_message = message
+            reason = self._skip_reason(message)
+            if reason:
+                COMPRESSION_SKIPPED.inc(reason)
+                self.passthrough = True
+                await self.send(message)
+            return
+
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            content_length = _header(self.start_message.get('headers', []), b'content-length')
+            known_small = content_length is not None and int(content_length) < self.middleware.minimum_size
+            if known_small or (not more_body and len(body) < self.middleware.minimum_size):
+                COMPRESSION_SKIPPED.inc('too_small')
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            compressed = self.compressor.compress(body, final=not more_body)
+            await self.send(self._compressed_start(None if more_body else len(compressed)))
+            await self.send({'type': 'http.response.body', 'body': compressed, 'more_body': more_body})
+            return
+
+        await self.send({'type': 'http.response.body', 'body': self.compressor.compress(body, final=not more_body),
+                         'more_body': more_body})
+
+    def _skip_reason(self, message) -> Optional[str]:
+        if message['status'] in BODYLESS_STATUSES:
+            return 'no_body'
+        headers = message.get('headers', [])
+        if _header(headers, b'content-encoding') is not None:
+            return 'already_encoded'
+        content_type = (_header(headers, b'content-type') or b'').decode('latin-1').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return 'not_compressible'
+        return None
+
+    def _compressed_start(self, content_length: Optional[int]) -> dict:
+        headers = []
+        vary = None
+        for key, value in self.start_message.get('headers', []):
+            name = key.lower()
+            if name == b'content-length':
+                continue
+            if name == b'vary':
+                vary = value
+                continue
+            if name == b'etag' and not value.startswith(b'W/'):
+                # The compressed bytes differ from the identity representation, so a strong
+                # validator no longer applies to them byte-for-byte
+                value = b'W/' + value
+            headers.append((key, value))
+        headers.append((b'content-encoding', self.encoding.encode()))
+        headers.append((b'vary', vary + b', Accept-Encoding' if vary else b'Accept-Encoding'))
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+        return {**self.start_message, 'headers': headers}
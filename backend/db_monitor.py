@@ -0,0 +1,237 @@
+"""
+MongoDB command monitoring for the RapidReps API.
+
+``CommandRecorder`` is a PyMongo ``CommandListener`` that keeps a record of
+every command issued by a client while recording is enabled. It is used by the
+query-plan regression suite to capture the queries each route makes.
+
+``RequestStatsListener`` attributes round-trips, DB time and documents returned
+to the HTTP request that issued them, and flags requests that repeat the same
+query shape many times (N+1 patterns).
+
+``PoolStatsListener`` keeps the connection pool gauges in ``metrics`` current.
+"""
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import MONGO_POOL_CHECKED_OUT, MONGO_POOL_CHECKOUT_FAILURES, MONGO_POOL_CONNECTIONS
+
+# Commands that are plumbing rather than queries issued by route handlers
+PLUMBING_COMMANDS = {
+    'hello', 'isMaster', 'ismaster', 'ping', 'buildInfo', 'saslStart', 'saslContinue', 'endSessions',
+}
+
+# Commands the query-plan suite does not record: plumbing plus cursor and index management
+IGNORED_COMMANDS = PLUMBING_COMMANDS | {'killCursors', 'getMore', 'listIndexes', 'createIndexes', 'explain'}
+
+# Keys PyMongo adds to every command that are not part of the query itself
+SESSION_KEYS = ('lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'autocommit', 'startTransaction')
+
+
+def command_collection(command_name: str, command: dict) -> Optional[str]:
+    """Name of the collection a command targets, if any"""
+    target = command.get(command_name)
+    return target if isinstance(target, str) else None
+
+
+def documents_returned(command_name: str, reply: dict) -> int:
+    """Number of documents a command reply carried back to the client"""
+    if 'cursor' in reply:
+        cursor = reply['cursor']
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') else 0
+    return 0
+
+
+def strip_session_keys(command: dict) -> dict:
+    """Copy of a command without driver session bookkeeping, ready to re-issue or explain"""
+    return {k: v for k, v in command.items() if k not in SESSION_KEYS}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Records commands issued while ``recording`` is set.
+
+    Motor runs PyMongo on a thread pool, so callbacks can arrive from several
+    threads at once; all shared state is guarded by a lock.
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.commands: List[dict] = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.commands = []
+            self._pending = {}
+            self.recording = True
+
+    def stop(self) -> List[dict]:
+        with self._lock:
+            self.recording = False
+            commands, self.commands = self.commands, []
+            return commands
+
+    def started(self, event):
+        if not self.recording or event.command_name in IGNORED_COMMANDS:
+            return
+        with self._lock:
+            self._pending[event.request_id] = {
+                'command': event.command_name,
+                'collection': command_collection(event.command_name, event.command),
+                'database': event.database_name,
+                'body': strip_session_keys(event.command),
+            }
+
+    def succeeded(self, event):
+        with self._lock:
+            entry = self._pending.pop(event.request_id, None)
+            if entry is None:
+                return
+            entry['durationMs'] = event.duration_micros / 1000
+            entry['docsReturned'] = documents_returned(event.command_name, event.reply)
+            self.commands.append(entry)
+
+    def failed(self, event):
+        with self._lock:
+            entry = self._pending.pop(event.request_id, None)
+            if entry is None:
+                return
+            entry['durationMs'] = event.duration_micros / 1000
+            entry['docsReturned'] = 0
+            entry['failure'] = str(event.failure)
+            self.commands.append(entry)
+
+
+# ============================================================================
+# PER-REQUEST STATS
+# ============================================================================
+
+def query_shape(command_name: str, command: dict) -> Tuple:
+    """Shape of a command: its name, collection and the filter keys it uses (not the values)"""
+    if command_name == 'getMore':
+        return (command_name, command.get('collection'))
+    query = command.get('filter') or command.get('query') or {}
+    if command_name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or [{}]
+        query = statements[0].get('q', {})
+    return (command_name, command_collection(command_name, command), tuple(sorted(query)))
+
+
+class RequestQueryStats:
+    """DB usage of a single HTTP request"""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.total_ms = 0.0
+        self.docs_returned = 0
+        self.shapes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, shape: Tuple, duration_ms: float, docs: int):
+        with self._lock:
+            self.round_trips += 1
+            self.total_ms += duration_ms
+            self.docs_returned += docs
+            self.shapes[shape] += 1
+
+    def repeated_shapes(self, threshold: int) -> List[Tuple[Tuple, int]]:
+        """Query shapes issued more than ``threshold`` times, most repeated first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+_request_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar('request_query_stats', default=None)
+
+
+def start_request_stats() -> RequestQueryStats:
+    """Begin attributing DB commands issued from the current context to a fresh stats object"""
+    stats = RequestQueryStats()
+    _request_stats.set(stats)
+    return stats
+
+
+class RequestStatsListener(monitoring.CommandListener):
+    """Adds every command to the ``RequestQueryStats`` of the request that issued it.
+
+    Motor copies the caller's context into the executor thread that runs
+    PyMongo, so the request's stats object is visible from these callbacks.
+    Commands issued outside a request (startup, background tasks) are ignored.
+    """
+
+    def __init__(self):
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if _request_stats.get() is None or event.command_name in PLUMBING_COMMANDS:
+            return
+        with self._lock:
+            self._shapes[event.request_id] = query_shape(event.command_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, documents_returned(event.command_name, event.reply))
+
+    def failed(self, event):
+        self._finish(event, 0)
+
+    def _finish(self, event, docs: int):
+        with self._lock:
+            shape = self._shapes.pop(event.request_id, None)
+        stats = _request_stats.get()
+        if shape is None or stats is None:
+            return
+        stats.record(shape, event.duration_micros / 1000, docs)
+
+
+# ============================================================================
+# CONNECTION POOL
+# ============================================================================
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Feeds MongoDB connection pool events into the metrics registry"""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = _address(event)
+        MONGO_POOL_CONNECTIONS.set(address, value=0)
+        MONGO_POOL_CHECKED_OUT.set(address, value=0)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(_address(event))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.inc(_address(event), event.reason)
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc(_address(event))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(_address(event))
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f'{host}:{port}'
@@ -0,0 +1,210 @@
+"""
+Idempotency keys for the RapidReps API.
+
+Mobile clients retry POSTs on flaky networks. A retry that carries the same
+``Idempotency-Key`` header as the original gets the original response back,
+and the business collections are never touched a second time.
+
+``IdempotencyMiddleware`` is a pure ASGI middleware that only looks at POSTs
+to ``IDEMPOTENT_PATHS`` that carry the header. A key is scoped to the caller:
+the record id is a hash of the Authorization header, method, path and key, so
+two users cannot collide and no token or key is stored in clear. The request
+body is fingerprinted, and reusing a key for a different body is refused with
+422.
+
+The first request with a key claims an ``idempotency_keys`` record by
+inserting it as ``pending``. It then runs the route, and stores the status,
+headers and body of any response below 500. A 5xx or an exception deletes
+the record, so the client can retry. A concurrent retry that finds the
+record still pending gets 409. A pending record whose worker died is taken
+over once ``lockedUntil`` passes. Records expire after
+``IDEMPOTENCY_KEY_TTL_HOURS`` through a TTL index.
+
+Stored responses never change, so each worker also keeps recent ones in a
+``TTLCache``. Replays then skip MongoDB entirely.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from cache import TTLCache
+from metrics import IDEMPOTENCY_REQUESTS
+
+IDEMPOTENCY_HEADER = b'idempotency-key'
+REPLAYED_HEADER = b'idempotent-replayed'
+IDEMPOTENT_PATHS = frozenset({
+    '/api/sessions',
+    '/api/session-series',
+    '/api/virtual-sessions/request',
+    '/api/messages',
+})
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# How long a pending request holds its key before another request may take it over
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_CACHE_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_CACHE_TTL_SECONDS', '300'))
+
+response_cache = TTLCache('idempotency', IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL_SECONDS)
+
+
+def _header(headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def scoped_key(headers, method: str, path: str, key: bytes) -> str:
+    authorization = _header(headers, b'authorization') or b''
+    digest = hashlib.sha256()
+    for part in (authorization, method.encode(), path.encode(), key):
+        digest.update(len(part).to_bytes(4, 'big') + part)
+    return digest.hexdigest()
+
+
+def _error(status: int, detail: str) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    body = json.dumps({'detail': detail}).encode()
+    return status, [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())], body
+
+
+class IdempotencyMiddleware:
+    """``collection`` returns the ``idempotency_keys`` collection, looked up per request"""
+
+    def __init__(self, app, collection: Callable[[], object], paths=IDEMPOTENT_PATHS):
+        self.app = app
+        self.collection = collection
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            return await self.app(scope, receive, send)
+        key = _header(scope['headers'], IDEMPOTENCY_HEADER)
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            IDEMPOTENCY_REQUESTS.inc('invalid')
+            return await self._send(send, *_error(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"))
+
+        body = await self._read_body(receive)
+        record_id = scoped_key(scope['headers'], scope['method'], scope['path'], key)
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        stored = response_cache.get(record_id)
+        if stored is None:
+            stored = await self._claim(record_id, fingerprint)
+        if stored is not None:
+            return await self._answer(send, stored, fingerprint)
+
+        await self._run(scope, receive, body, send, record_id, fingerprint)
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def _claim(self, record_id: str, fingerprint: str) -> Optional[dict]:
+        """Claim the key for this request (returns None) or return the record that holds it"""
+        collection = self.collection()
+        now = datetime.utcnow()
+        record = {
+            'state': 'pending',
+            'fingerprint': fingerprint,
+            'lockedUntil': now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            'createdAt': now,
+            'expiresAt': now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+        }
+        # Twice, in case the record expires or is released between the insert and the lookup
+        for _ in range(2):
+            try:
+                await collection.insert_one({'_id': record_id, **record})
+                return None
+            except DuplicateKeyError:
+                pass
+            # Expired records the TTL monitor has not removed yet, and pending ones whose worker died
+            taken = await collection.update_one(
+                {'_id': record_id, '$or': [
+                    {'expiresAt': {'$lt': now}},
+                    {'state': 'pending', 'lockedUntil': {'$lt': now}},
+                ]},
+                {'$set': record, '$unset': {'status': '', 'headers': '', 'body': ''}}
+            )
+            if taken.modified_count:
+                return None
+            existing = await collection.find_one({'_id': record_id})
+            if existing is not None:
+                if existing['state'] == 'completed':
+                    response_cache.set(record_id, existing)
+                return existing
+        return None
+
+    async def _answer(self, send, stored: dict, fingerprint: str):
+        if stored['fingerprint'] != fingerprint:
+            IDEMPOTENCY_REQUESTS.inc('mismatch')
+            return await self._send(send, *_error(422, "Idempotency-Key was already used with a different request"))
+        if stored['state'] != 'completed':
+            IDEMPOTENCY_REQUESTS.inc('in_progress')
+            return await self._send(send, *_error(409, "A request with this Idempotency-Key is still in progress"))
+        IDEMPOTENCY_REQUESTS.inc('replayed')
+        headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in stored['headers']]
+        await self._send(send, stored['status'], headers + [(REPLAYED_HEADER, b'true')], bytes(stored['body']))
+
+    async def _run(self, scope, receive, body: bytes, send, record_id: str, fingerprint: str):
+        """Run the route once, keeping its response for replays"""
+        sent_body = False
+
+        async def replay_receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Only the disconnect is left to wait for
+            return await receive()
+
+        start = {}
+        chunks = []
+
+        async def capture_send(message):
+            if message['type'] == 'http.response.start':
+                start.update(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+            await send(message)
+
+        collection = self.collection()
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await collection.delete_one({'_id': record_id, 'state': 'pending'})
+            raise
+
+        if not start or start['status'] >= 500:
+            await collection.delete_one({'_id': record_id, 'state': 'pending'})
+            IDEMPOTENCY_REQUESTS.inc('released')
+            return
+        stored = {
+            'state': 'completed',
+            'fingerprint': fingerprint,
+            'status': start['status'],
+            'headers': [[name.decode('latin-1'), value.decode('latin-1')] for name, value in start.get('headers', [])],
+            'body': b''.join(chunks),
+            'completedAt': datetime.utcnow(),
+        }
+        await collection.update_one({'_id': record_id, 'fingerprint': fingerprint}, {'$set': stored})
+        response_cache.set(record_id, stored)
+        IDEMPOTENCY_REQUESTS.inc('stored')
+
+    async def _send(self, send, status: int, headers, body: bytes):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,333 @@
+"""
+MongoDB index registry for the RapidReps API.
+
+Every index the API relies on is declared once in ``INDEXES``. The registry is
+ensured on startup (see ``server.py``) and can be inspected or applied from the
+command line:
+
+    python indexes.py             # diff the registry against the live database
+    python indexes.py --apply     # create missing indexes
+    python indexes.py --explain   # check that the expected query shapes use an index
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Index options that are compared when diffing the registry against the live DB
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds', 'collation')
+
+# ============================================================================
+# INDEX REGISTRY
+# ============================================================================
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        # signup relies on this to reject duplicate emails; emails are stored lowercased,
+        # so uniqueness is case-insensitive
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'trainer_profiles': [
+        # one trainer profile per user
+        IndexModel([('userId', ASCENDING)], name='userId_unique', unique=True),
+        IndexModel([('isAvailable', ASCENDING), ('ratePerMinuteCents', ASCENDING)], name='isAvailable_rate'),
+        IndexModel(
+            [('isVirtualTrainingAvailable', ASCENDING), ('offersVirtual', ASCENDING), ('isAvailable', ASCENDING)],
+            name='virtual_available',
+        ),
+    ],
+    'trainee_profiles': [
+        # one trainee profile per user
+        IndexModel([('userId', ASCENDING)], name='userId_unique', unique=True),
+    ],
+    'sessions': [
+        # session lists: keyset pages ordered by (sessionDateTimeStart, _id), optionally by status
+        IndexModel(
+            [('trainerId', ASCENDING), ('status', ASCENDING), ('sessionDateTimeStart', DESCENDING),
+             ('_id', DESCENDING)],
+            name='trainerId_status_start_id',
+        ),
+        IndexModel(
+            [('traineeId', ASCENDING), ('status', ASCENDING), ('sessionDateTimeStart', DESCENDING),
+             ('_id', DESCENDING)],
+            name='traineeId_status_start_id',
+        ),
+        IndexModel([('createdAt', DESCENDING)], name='createdAt_desc'),
+        # unfiltered session lists, calendar feeds, and the double-booking check: the trainer's sessions
+        # in a bounded window
+        IndexModel([('trainerId', ASCENDING), ('sessionDateTimeStart', ASCENDING), ('_id', ASCENDING)],
+                   name='trainerId_start_id'),
+        IndexModel([('traineeId', ASCENDING), ('sessionDateTimeStart', ASCENDING), ('_id', ASCENDING)],
+                   name='traineeId_start_id'),
+        IndexModel([('seriesId', ASCENDING)], name='seriesId', sparse=True),
+        # the sweeper's overdue scan, oldest first (see sweeper.py), and its per-run lookup
+        IndexModel([('status', ASCENDING), ('sessionDateTimeEnd', ASCENDING)], name='status_end'),
+        IndexModel([('sweepRunId', ASCENDING)], name='sweepRunId', sparse=True),
+    ],
+    'session_series': [
+        # series with occurrences still to book, looked up before listing a user's sessions and when
+        # checking a trainer's free time (see series.py)
+        IndexModel([('trainerId', ASCENDING), ('nextOccurrenceStart', ASCENDING)], name='trainerId_nextOccurrence'),
+        IndexModel([('traineeId', ASCENDING), ('nextOccurrenceStart', ASCENDING)], name='traineeId_nextOccurrence'),
+    ],
+    'session_slots': [
+        # one active session per trainer per 15-minute bucket, see scheduling.py
+        IndexModel([('trainerId', ASCENDING), ('slotStart', ASCENDING)], name='trainerId_slotStart_unique',
+                   unique=True),
+        IndexModel([('sessionId', ASCENDING)], name='sessionId'),
+    ],
+    'pair_counters': [
+        # looked up by _id when pricing; these serve account deletion
+        IndexModel([('traineeId', ASCENDING)], name='traineeId'),
+        IndexModel([('trainerId', ASCENDING)], name='trainerId'),
+    ],
+    'idempotency_keys': [
+        # records are looked up by _id; this removes them once they expire (see idempotency.py)
+        IndexModel([('expiresAt', ASCENDING)], name='expiresAt_ttl', expireAfterSeconds=0),
+    ],
+    'ratings': [
+        IndexModel([('trainerId', ASCENDING), ('createdAt', DESCENDING)], name='trainerId_createdAt'),
+        IndexModel([('traineeId', ASCENDING)], name='traineeId'),
+        # a session can only be rated once
+        IndexModel([('sessionId', ASCENDING)], name='sessionId_unique', unique=True),
+    ],
+    'messages': [
+        IndexModel([('conversationId', ASCENDING), ('createdAt', ASCENDING)], name='conversationId_createdAt'),
+    ],
+    'conversations': [
+        IndexModel([('participants', ASCENDING), ('updatedAt', DESCENDING)], name='participants_updatedAt'),
+    ],
+    'blocks': [
+        IndexModel(
+            [('blockerUserId', ASCENDING), ('blockedUserId', ASCENDING)],
+            name='blocker_blocked_unique',
+            unique=True,
+        ),
+        IndexModel([('blockedUserId', ASCENDING)], name='blockedUserId'),
+    ],
+    'reports': [
+        IndexModel([('reporterUserId', ASCENDING)], name='reporterUserId'),
+        IndexModel([('reportedUserId', ASCENDING)], name='reportedUserId'),
+    ],
+    'trainer_achievements': [
+        IndexModel([('trainerId', ASCENDING)], name='trainerId_unique', unique=True),
+    ],
+    'trainee_achievements': [
+        IndexModel([('traineeId', ASCENDING)], name='traineeId_unique', unique=True),
+    ],
+}
+
+# Query shapes the API issues, paired with the index that should serve them.
+# Values are placeholders - only the shape matters to the query planner.
+EXPECTED_QUERY_SHAPES = [
+    ('users', {'email': 'user@example.com'}, None, 'email_unique'),
+    ('trainer_profiles', {'userId': 'u'}, None, 'userId_unique'),
+    ('trainee_profiles', {'userId': 'u'}, None, 'userId_unique'),
+    ('sessions', {'trainerId': 'u', 'status': 'completed'}, [('sessionDateTimeStart', -1), ('_id', -1)],
+     'trainerId_status_start_id'),
+    ('sessions', {'traineeId': 'u', 'status': 'completed'}, [('sessionDateTimeStart', -1), ('_id', -1)],
+     'traineeId_status_start_id'),
+    ('sessions', {'trainerId': 'u'}, [('sessionDateTimeStart', -1), ('_id', -1)], 'trainerId_start_id'),
+    ('sessions', {'traineeId': 'u', 'sessionDateTimeStart': {'$gte': '2024-01-01', '$lte': '2024-01-08'},
+                  '$or': [{'sessionDateTimeStart': {'$lt': '2024-01-08'}}, {'_id': {'$lt': 's'}}]},
+     [('sessionDateTimeStart', -1), ('_id', -1)], 'traineeId_start_id'),
+    ('sessions', {'trainerId': 'u', 'sessionDateTimeStart': {'$gt': '2024-01-01', '$lt': '2024-01-02'}}, None,
+     'trainerId_start_id'),
+    ('sessions', {'trainerId': 'u', 'sessionDateTimeStart': {'$gte': '2024-01-01', '$lt': '2024-07-01'}},
+     [('sessionDateTimeStart', 1), ('_id', 1)], 'trainerId_start_id'),
+    ('sessions', {'seriesId': 's'}, None, 'seriesId'),
+    ('sessions', {'status': 'confirmed', 'sessionDateTimeEnd': {'$lt': '2024-01-01'}}, [('sessionDateTimeEnd', 1)],
+     'status_end'),
+    ('sessions', {'sweepRunId': 'r'}, None, 'sweepRunId'),
+    ('session_series', {'trainerId': 'u', 'nextOccurrenceStart': {'$lt': '2024-01-01'}}, None,
+     'trainerId_nextOccurrence'),
+    ('session_series', {'traineeId': 'u', 'nextOccurrenceStart': {'$lt': '2024-01-01'}}, None,
+     'traineeId_nextOccurrence'),
+    ('session_series', {'trainerId': {'$in': ['u', 'v']}, 'nextOccurrenceStart': {'$lt': '2024-01-01'}}, None,
+     'trainerId_nextOccurrence'),
+    ('session_slots', {'sessionId': 's'}, None, 'sessionId'),
+    ('ratings', {'trainerId': 'u'}, [('createdAt', -1)], 'trainerId_createdAt'),
+    ('ratings', {'sessionId': 's'}, None, 'sessionId_unique'),
+    ('messages', {'conversationId': 'c'}, [('createdAt', 1)], 'conversationId_createdAt'),
+    ('conversations', {'participants': 'u'}, [('updatedAt', -1)], 'participants_updatedAt'),
+    ('blocks', {'blockerUserId': 'u', 'blockedUserId': 'v'}, None, 'blocker_blocked_unique'),
+]
+
+
+# ============================================================================
+# DIFF / ENSURE
+# ============================================================================
+
+def _index_options(info: dict) -> dict:
+    """Pick the options we manage out of an index spec or index_information() entry"""
+    options = {}
+    for option in COMPARED_OPTIONS:
+        if option in info:
+            options[option] = info[option]
+    if 'collation' in options:
+        # The server expands collations with every default; compare only what was declared
+        options['collation'] = {k: options['collation'][k] for k in ('locale', 'strength') if k in options['collation']}
+    if options.get('unique') is False:
+        del options['unique']
+    return options
+
+
+def _same_index(declared: IndexModel, live: dict) -> bool:
+    doc = declared.document
+    declared_keys = [(k, int(v)) if isinstance(v, (int, float)) else (k, v) for k, v in doc['key'].items()]
+    live_keys = [(k, int(v)) if isinstance(v, (int, float)) else (k, v) for k, v in live['key']]
+    return declared_keys == live_keys and _index_options(doc) == _index_options(live)
+
+
+async def diff_indexes(db) -> dict:
+    """Compare the registry with the live database.
+
+    Returns a dict of ``missing``, ``changed`` and ``extra`` lists of
+    ``"collection.index_name"`` strings. ``_id_`` indexes are ignored.
+    """
+    diff = {'missing': [], 'changed': [], 'extra': []}
+    for collection_name, models in INDEXES.items():
+        live = await db[collection_name].index_information()
+        declared_names = set()
+        for model in models:
+            name = model.document['name']
+            declared_names.add(name)
+            if name not in live:
+                diff['missing'].append(f'{collection_name}.{name}')
+            elif not _same_index(model, live[name]):
+                diff['changed'].append(f'{collection_name}.{name}')
+        for name in live:
+            if name != '_id_' and name not in declared_names:
+                diff['extra'].append(f'{collection_name}.{name}')
+    return diff
+
+
+async def ensure_indexes(db, rebuild_changed: bool = False) -> dict:
+    """Create every missing index in the registry.
+
+    Indexes whose definition drifted are only dropped and rebuilt when
+    ``rebuild_changed`` is set. Extra indexes are reported but never dropped.
+    A failure on one index (e.g. duplicates blocking a unique index) is logged
+    and does not stop the others from being created.
+    """
+    diff = await diff_indexes(db)
+    diff['created'] = []
+    diff['failed'] = []
+
+    to_create = set(diff['missing'])
+    if rebuild_changed:
+        to_create.update(diff['changed'])
+
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            qualified = f"{collection_name}.{model.document['name']}"
+            if qualified not in to_create:
+                continue
+            try:
+                if qualified in diff['changed']:
+                    await db[collection_name].drop_index(model.document['name'])
+                await db[collection_name].create_indexes([model])
+                diff['created'].append(qualified)
+            except OperationFailure as e:
+                logger.error(f"Failed to create index {qualified}: {e}")
+                diff['failed'].append(qualified)
+
+    if diff['created']:
+        logger.info(f"Created indexes: {', '.join(diff['created'])}")
+    if diff['changed'] and not rebuild_changed:
+        logger.warning(f"Index definitions differ from registry: {', '.join(diff['changed'])}")
+    return diff
+
+
+# ============================================================================
+# QUERY PLAN VERIFICATION
+# ============================================================================
+
+def winning_plan_stages(explain: dict) -> List[dict]:
+    """Flatten the winning plan of an explain() result into a list of stages"""
+    plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    # Slot-based execution nests the classic plan under queryPlan
+    plan = plan.get('queryPlan', plan)
+
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop()
+        if not stage:
+            continue
+        stages.append(stage)
+        if 'inputStage' in stage:
+            pending.append(stage['inputStage'])
+        pending.extend(stage.get('inputStages', []))
+    return stages
+
+
+async def verify_query_shapes(db) -> List[dict]:
+    """Explain every expected query shape and report the index it actually used"""
+    results = []
+    for collection_name, query, sort, expected_index in EXPECTED_QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = winning_plan_stages(explain)
+        used = [s['indexName'] for s in stages if s.get('stage') == 'IXSCAN']
+        results.append({
+            'collection': collection_name,
+            'query': query,
+            'expectedIndex': expected_index,
+            'usedIndexes': used,
+            'collectionScan': any(s.get('stage') == 'COLLSCAN' for s in stages),
+            'ok': expected_index in used,
+        })
+    return results
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+async def _main(args) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'rapidreps_db')]
+
+    try:
+        if args.apply:
+            result = await ensure_indexes(db, rebuild_changed=args.rebuild)
+            for key in ('created', 'failed', 'changed', 'extra'):
+                print(f"{key}: {', '.join(result[key]) or '-'}")
+            return 1 if result['failed'] else 0
+
+        if args.explain:
+            failures = 0
+            for result in await verify_query_shapes(db):
+                status = 'OK  ' if result['ok'] else 'FAIL'
+                failures += not result['ok']
+                print(f"{status} {result['collection']} {result['query']} -> {result['usedIndexes'] or 'COLLSCAN'}")
+            return 1 if failures else 0
+
+        result = await diff_indexes(db)
+        for key in ('missing', 'changed', 'extra'):
+            print(f"{key}: {', '.join(result[key]) or '-'}")
+        return 1 if result['missing'] or result['changed'] else 0
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage RapidReps MongoDB indexes')
+    parser.add_argument('--apply', action='store_true', help='create missing indexes')
+    parser.add_argument('--rebuild', action='store_true', help='with --apply, drop and rebuild indexes that drifted')
+    parser.add_argument('--explain', action='store_true', help='verify expected query shapes use their index')
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,367 @@
+"""
+Async load generator for the RapidReps API.
+
+Creates a small synthetic marketplace (trainers and trainees around one city)
+through the public API, then replays a realistic mix of traffic against it:
+trainees searching, booking and chatting, trainers polling their sessions and
+conversations and accepting requests.
+
+Two load models are supported:
+
+    # closed loop: 50 virtual users issuing requests back to back for 60s
+    python loadtest.py --concurrency 50 --duration 60
+
+    # open loop: Poisson arrivals at 200 req/s, at most 500 in flight
+    python loadtest.py --rate 200 --concurrency 500 --duration 60
+
+    # step the arrival rate up until latency or errors break, report saturation
+    python loadtest.py --saturation --rate 50 --step 50 --duration 20
+
+The report gives p50/p95/p99 latency per route and the achieved throughput.
+Run it against a local server, never against production.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_BASE_URL = 'http://localhost:8001/api'
+
+# Laurel, MD - same area the seed scripts use
+CENTER_LAT, CENTER_LON = 39.0993, -76.8483
+
+# Relative weight of each scenario in the traffic mix
+DEFAULT_MIX = {
+    'trainee_search': 35,
+    'trainee_book': 10,
+    'trainee_chat': 15,
+    'trainee_sessions': 10,
+    'trainer_poll_sessions': 15,
+    'trainer_poll_conversations': 10,
+    'trainer_accept': 5,
+}
+
+
+class Stats:
+    """Latency samples and outcomes per route"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, route: str, seconds: float, ok: bool):
+        self.latencies[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+    @property
+    def total_requests(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+    @property
+    def total_errors(self) -> int:
+        return sum(self.errors.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def throughput(self) -> float:
+        return self.total_requests / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> dict:
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            routes[route] = {
+                'requests': len(ordered),
+                'errors': self.errors.get(route, 0),
+                'p50Ms': round(percentile(ordered, 50) * 1000, 2),
+                'p95Ms': round(percentile(ordered, 95) * 1000, 2),
+                'p99Ms': round(percentile(ordered, 99) * 1000, 2),
+                'maxMs': round(ordered[-1] * 1000, 2),
+            }
+        every = sorted(s for samples in self.latencies.values() for s in samples)
+        return {
+            'durationSeconds': round(self.elapsed, 2),
+            'requests': self.total_requests,
+            'errors': self.total_errors,
+            'errorRate': round(self.total_errors / self.total_requests, 4) if self.total_requests else 0.0,
+            'throughputRps': round(self.throughput(), 2),
+            'p99Ms': round(percentile(every, 99) * 1000, 2) if every else 0.0,
+            'routes': routes,
+        }
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# ============================================================================
+# MARKETPLACE SETUP
+# ============================================================================
+
+class Actor:
+    def __init__(self, user_id: str, token: str):
+        self.user_id = user_id
+        self.token = token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+
+async def create_actor(client: httpx.AsyncClient, run_id: str, role: str, index: int) -> Actor:
+    response = await client.post('/auth/signup', json={
+        'fullName': f'Load {role.title()} {index}',
+        'email': f'load-{run_id}-{role}-{index}@example.com',
+        'phone': '555-0100',
+        'password': 'loadtest-password',
+        'roles': [role],
+    })
+    response.raise_for_status()
+    body = response.json()
+    actor = Actor(body['user']['id'], body['access_token'])
+
+    lat = CENTER_LAT + random.uniform(-0.1, 0.1)
+    lon = CENTER_LON + random.uniform(-0.1, 0.1)
+    if role == 'trainer':
+        profile = await client.post('/trainer-profiles', headers=actor.headers, json={
+            'userId': actor.user_id,
+            'bio': 'Load test trainer',
+            'trainingStyles': random.sample(['strength', 'yoga', 'hiit', 'boxing', 'mobility'], 2),
+            'ratePerMinuteCents': random.randint(60, 200),
+            'latitude': lat,
+            'longitude': lon,
+            'isAvailable': True,
+        })
+    else:
+        profile = await client.post('/trainee-profiles', headers=actor.headers, json={
+            'userId': actor.user_id, 'latitude': lat, 'longitude': lon,
+        })
+    profile.raise_for_status()
+    return actor
+
+
+async def setup_marketplace(client: httpx.AsyncClient, trainers: int, trainees: int):
+    run_id = uuid.uuid4().hex[:8]
+    trainer_actors = await asyncio.gather(*(create_actor(client, run_id, 'trainer', i) for i in range(trainers)))
+    trainee_actors = await asyncio.gather(*(create_actor(client, run_id, 'trainee', i) for i in range(trainees)))
+    return list(trainer_actors), list(trainee_actors)
+
+
+# ============================================================================
+# SCENARIOS
+# ============================================================================
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, trainers: List[Actor], trainees: List[Actor], stats: Stats):
+        self.client = client
+        self.trainers = trainers
+        self.trainees = trainees
+        self.stats = stats
+
+    async def request(self, route: str, method: str, url: str, actor: Actor, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=actor.headers, **kwargs)
+        except httpx.HTTPError:
+            self.stats.record(route, time.perf_counter() - started, ok=False)
+            return None
+        self.stats.record(route, time.perf_counter() - started, ok=response.status_code < 500)
+        return response
+
+    async def trainee_search(self):
+        await self.request('GET /trainers/search', 'GET', '/trainers/search', random.choice(self.trainees), params={
+            'latitude': CENTER_LAT + random.uniform(-0.05, 0.05),
+            'longitude': CENTER_LON + random.uniform(-0.05, 0.05),
+            'wantsVirtual': random.random() < 0.3,
+        })
+
+    async def trainee_book(self):
+        trainee, trainer = random.choice(self.trainees), random.choice(self.trainers)
+        start = datetime.utcnow() + timedelta(days=random.randint(1, 30), hours=random.randint(0, 12))
+        await self.request('POST /sessions', 'POST', '/sessions', trainee, json={
+            'traineeId': trainee.user_id,
+            'trainerId': trainer.user_id,
+            'sessionDateTimeStart': start.replace(minute=0, second=0, microsecond=0).isoformat(),
+            'durationMinutes': random.choice([30, 45, 60]),
+            'locationType': 'gym',
+        })
+
+    async def trainee_chat(self):
+        trainee, trainer = random.choice(self.trainees), random.choice(self.trainers)
+        response = await self.request('POST /messages', 'POST', '/messages', trainee, json={
+            'receiverId': trainer.user_id, 'content': 'Are you free this week?',
+        })
+        if response is not None and response.status_code == 200:
+            conversation_id = response.json()['conversationId']
+            await self.request('GET /conversations/{id}/messages', 'GET',
+                               f'/conversations/{conversation_id}/messages', trainee)
+
+    async def trainee_sessions(self):
+        await self.request('GET /trainee/sessions', 'GET', '/trainee/sessions', random.choice(self.trainees))
+
+    async def trainer_poll_sessions(self):
+        await self.request('GET /trainer/sessions', 'GET', '/trainer/sessions', random.choice(self.trainers))
+
+    async def trainer_poll_conversations(self):
+        await self.request('GET /conversations', 'GET', '/conversations', random.choice(self.trainers))
+
+    async def trainer_accept(self):
+        trainer = random.choice(self.trainers)
+        response = await self.request('GET /trainer/sessions', 'GET', '/trainer/sessions', trainer,
+                                      params={'status': 'requested'})
+        if response is not None and response.status_code == 200 and response.json():
+            session_id = response.json()[0]['id']
+            await self.request('PATCH /sessions/{id}/accept', 'PATCH', f'/sessions/{session_id}/accept', trainer)
+
+    async def run_one(self, scenario: str):
+        await getattr(self, scenario)()
+
+
+def pick_scenario(mix: Dict[str, int]) -> str:
+    return random.choices(list(mix), weights=list(mix.values()))[0]
+
+
+async def run_closed(workload: Workload, mix: Dict[str, int], concurrency: int, duration: float):
+    """``concurrency`` virtual users issuing scenarios back to back"""
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await workload.run_one(pick_scenario(mix))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+
+async def run_open(workload: Workload, mix: Dict[str, int], rate: float, concurrency: int, duration: float):
+    """Poisson arrivals at ``rate`` scenarios/s; arrivals beyond ``concurrency`` in flight wait for a slot"""
+    deadline = time.perf_counter() + duration
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def arrival(scenario):
+        async with slots:
+            await workload.run_one(scenario)
+
+    while time.perf_counter() < deadline:
+        task = asyncio.create_task(arrival(pick_scenario(mix)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        await asyncio.sleep(random.expovariate(rate))
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def run_load(args, client, trainers, trainees, rate: Optional[float]) -> dict:
+    stats = Stats()
+    workload = Workload(client, trainers, trainees, stats)
+    if rate:
+        await run_open(workload, args.mix, rate, args.concurrency, args.duration)
+    else:
+        await run_closed(workload, args.mix, args.concurrency, args.duration)
+    stats.finished = time.perf_counter()
+    result = stats.summary()
+    result['offeredRps'] = rate
+    return result
+
+
+async def find_saturation(args, client, trainers, trainees) -> dict:
+    """Raise the arrival rate step by step until the error rate or p99 breaks the limits"""
+    steps = []
+    rate = args.rate or args.step
+    best = None
+    while rate <= args.max_rate:
+        result = await run_load(args, client, trainers, trainees, rate)
+        steps.append(result)
+        print_step(result)
+        healthy = result['errorRate'] <= args.max_error_rate and result['p99Ms'] <= args.slo_p99_ms
+        if not healthy:
+            break
+        if best is None or result['throughputRps'] > best['throughputRps']:
+            best = result
+        rate += args.step
+    return {
+        'saturationThroughputRps': best['throughputRps'] if best else 0.0,
+        'limits': {'maxErrorRate': args.max_error_rate, 'sloP99Ms': args.slo_p99_ms},
+        'steps': steps,
+    }
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def print_step(result: dict):
+    print(f"offered {result['offeredRps']} rps -> {result['throughputRps']} rps, "
+          f"p99 {result['p99Ms']} ms, errors {result['errorRate']:.2%}")
+
+
+def print_report(result: dict):
+    print(f"\n{result['requests']} requests in {result['durationSeconds']}s "
+          f"= {result['throughputRps']} rps, error rate {result['errorRate']:.2%}\n")
+    print(f"{'route':40} {'count':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, row in result['routes'].items():
+        print(f"{route:40} {row['requests']:>7} {row['errors']:>5} "
+              f"{row['p50Ms']:>9} {row['p95Ms']:>9} {row['p99Ms']:>9}")
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Parse ``scenario=weight,scenario=weight`` into a mix dict"""
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}')
+        mix[name] = int(weight)
+    return mix
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        print(f'Creating {args.trainers} trainers and {args.trainees} trainees...')
+        trainers, trainees = await setup_marketplace(client, args.trainers, args.trainees)
+
+        if args.saturation:
+            result = await find_saturation(args, client, trainers, trainees)
+            print(f"\nSaturation throughput: {result['saturationThroughputRps']} rps")
+        else:
+            result = await run_load(args, client, trainers, trainees, args.rate)
+            print_report(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'\nReport written to {args.json}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the RapidReps API with a synthetic marketplace workload')
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL)
+    parser.add_argument('--trainers', type=int, default=20)
+    parser.add_argument('--trainees', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20, help='virtual users (closed) or max in flight (open)')
+    parser.add_argument('--rate', type=float, default=0, help='arrivals per second; 0 runs a closed loop')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per run (per step with --saturation)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='e.g. trainee_search=5,trainee_book=1')
+    parser.add_argument('--saturation', action='store_true', help='step the arrival rate up to find saturation')
+    parser.add_argument('--step', type=float, default=25, help='arrival rate increment for --saturation')
+    parser.add_argument('--max-rate', type=float, default=2000)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--slo-p99-ms', type=float, default=1000)
+    parser.add_argument('--json', help='write the report as JSON to this path')
+    asyncio.run(main(parser.parse_args()))
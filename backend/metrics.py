@@ -0,0 +1,261 @@
+"""
+In-process metrics for the RapidReps API, exposed in the Prometheus text format.
+
+Counters, gauges and histograms are plain Python objects updated in place, so
+recording a sample costs a dict lookup and an addition. Values that are cheaper
+to read at scrape time than to track (pool sizes, cache statistics) are exposed
+through collectors registered with ``REGISTRY.register_collector``.
+"""
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, tuned for API calls that should finish well under a second
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets for per-request counts (queries, documents)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, *labels) -> dict:
+        """Bucket counts, sum and count for one label set (used by tests and reports)"""
+        counts, total, count = self._series.get(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        return {'buckets': dict(zip(self.buckets + (float('inf'),), counts)), 'sum': total, 'count': count}
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[_Metric]]):
+        """Register a callable that builds metrics at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = MetricsRegistry()
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'rapidreps_http_requests_total', 'HTTP requests handled', ('method', 'route', 'status'))
+HTTP_ERRORS = REGISTRY.counter(
+    'rapidreps_http_request_errors_total', 'HTTP requests that failed with a 5xx or an exception', ('method', 'route'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'rapidreps_http_request_duration_seconds', 'HTTP request latency', ('method', 'route'))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'rapidreps_http_requests_in_flight', 'HTTP requests currently being handled')
+
+# ============================================================================
+# DATABASE
+# ============================================================================
+
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    'rapidreps_db_queries_per_request', 'MongoDB round-trips per HTTP request', ('route',), COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = REGISTRY.histogram(
+    'rapidreps_db_time_per_request_seconds', 'Time spent in MongoDB per HTTP request', ('route',))
+DB_DOCS_PER_REQUEST = REGISTRY.histogram(
+    'rapidreps_db_docs_returned_per_request', 'MongoDB documents returned per HTTP request', ('route',), COUNT_BUCKETS)
+
+MONGO_POOL_CONNECTIONS = REGISTRY.gauge(
+    'rapidreps_mongo_pool_connections', 'Open connections in the MongoDB pool', ('address',))
+MONGO_POOL_CHECKED_OUT = REGISTRY.gauge(
+    'rapidreps_mongo_pool_checked_out', 'MongoDB connections currently checked out', ('address',))
+MONGO_POOL_CHECKOUT_FAILURES = REGISTRY.counter(
+    'rapidreps_mongo_pool_checkout_failures_total', 'Failed MongoDB connection checkouts', ('address', 'reason'))
+
+# ============================================================================
+# PASSWORD HASHING
+# ============================================================================
+
+BCRYPT_QUEUE_DEPTH = REGISTRY.gauge(
+    'rapidreps_bcrypt_pool_queue_depth', 'bcrypt jobs waiting for a worker')
+BCRYPT_ACTIVE = REGISTRY.gauge(
+    'rapidreps_bcrypt_pool_active', 'bcrypt jobs currently running')
+
+# ============================================================================
+# COMPRESSION
+# ============================================================================
+
+COMPRESSION_BYTES_IN = REGISTRY.counter(
+    'rapidreps_compression_bytes_in_total', 'Response bytes before compression', ('encoding',))
+COMPRESSION_BYTES_OUT = REGISTRY.counter(
+    'rapidreps_compression_bytes_out_total', 'Response bytes after compression', ('encoding',))
+COMPRESSION_CPU_SECONDS = REGISTRY.counter(
+    'rapidreps_compression_cpu_seconds_total', 'CPU time spent compressing responses', ('encoding',))
+COMPRESSION_SKIPPED = REGISTRY.counter(
+    'rapidreps_compression_skipped_total', 'Responses to clients accepting compression sent uncompressed', ('reason',))
+
+
+def _collect_compression_savings():
+    saved = Counter('rapidreps_compression_bytes_saved_total', 'Response bytes saved by compression', ('encoding',))
+    for labels, bytes_in in list(COMPRESSION_BYTES_IN._values.items()):
+        saved.inc(*labels, amount=bytes_in - COMPRESSION_BYTES_OUT.value(*labels))
+    return [saved]
+
+
+REGISTRY.register_collector(_collect_compression_savings)
+
+# ============================================================================
+# IDEMPOTENCY
+# ============================================================================
+
+IDEMPOTENCY_REQUESTS = REGISTRY.counter(
+    'rapidreps_idempotency_requests_total', 'Requests carrying an Idempotency-Key, by outcome', ('outcome',))
+
+# ============================================================================
+# SESSION SWEEPER
+# ============================================================================
+
+SWEEPER_BATCH_SIZES = REGISTRY.histogram(
+    'rapidreps_sweeper_batch_size', 'Sessions moved per sweeper batch', ('target',), COUNT_BUCKETS)
+SWEEPER_SESSIONS = REGISTRY.counter(
+    'rapidreps_sweeper_sessions_total', 'Sessions moved by the sweeper', ('target',))
+SWEEPER_LAG = REGISTRY.gauge(
+    'rapidreps_sweeper_lag_seconds', 'How long the oldest overdue session has waited after its last sweep',
+    ('target',))
+SWEEPER_IS_LEADER = REGISTRY.gauge(
+    'rapidreps_sweeper_leader', 'Whether this worker holds the sweeper lease')
+
+# ============================================================================
+# CACHES
+# ============================================================================
+
+_cache_stats: Dict[str, Callable[[], dict]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Expose a cache's hit/miss counts; ``stats`` returns a dict with ``hits`` and ``misses``"""
+    _cache_stats[name] = stats
+
+
+def _collect_cache_metrics():
+    hits = Counter('rapidreps_cache_hits_total', 'Cache hits', ('cache',))
+    misses = Counter('rapidreps_cache_misses_total', 'Cache misses', ('cache',))
+    ratio = Gauge('rapidreps_cache_hit_ratio', 'Cache hit ratio since startup', ('cache',))
+    for name, stats in _cache_stats.items():
+        values = stats()
+        hits.inc(name, amount=values['hits'])
+        misses.inc(name, amount=values['misses'])
+        lookups = values['hits'] + values['misses']
+        ratio.set(name, value=values['hits'] / lookups if lookups else 0)
+    return [hits, misses, ratio] if _cache_stats else []
+
+
+REGISTRY.register_collector(_collect_cache_metrics)
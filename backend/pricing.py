@@ -0,0 +1,172 @@
+"""
+Session pricing for the RapidReps API.
+
+``quote`` turns a base price into the price fields stored on every session:
+the multi-session discount, the platform fee and the trainer's earnings. It
+is shared by single bookings, series and virtual sessions.
+
+A trainee's third booking with the same trainer within
+``MULTI_SESSION_WINDOW_DAYS`` is discounted. Sessions are not counted at
+booking time. Instead, each (trainee, trainer) pair has a ``pair_counters``
+document with one bucket per UTC day: ``record_sessions`` increments today's
+bucket when sessions are created, and ``forget_session`` decrements the
+bucket of a declined session's creation day. Pricing then needs a single
+``_id`` lookup (``load_pair_counter``), summing the buckets inside the
+window. The window starts at midnight UTC of its first day, so it can be up
+to a day longer than a strict rolling window. Buckets that have aged out are
+removed the next time the pair books.
+
+Counters for sessions created before this module existed can be rebuilt with:
+
+    python pricing.py --backfill
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from session_state import SessionStatus
+
+PLATFORM_FEE_PERCENT = 10
+MULTI_SESSION_WINDOW_DAYS = 30
+# Sessions already booked in the window for the next one to be discounted
+MULTI_SESSION_MIN_RECENT = 2
+MULTI_SESSION_DISCOUNT_RATE = 0.05
+
+# Virtual sessions have a flat price for now ($18 for 30 minutes)
+VIRTUAL_SESSION_PRICE_CENTS = 1800
+VIRTUAL_RATE_PER_MINUTE_CENTS = 60
+
+
+def quote(base_rate: int, base_price: int, discounted: bool = False) -> dict:
+    """Price fields of a session costing ``base_price`` cents before discount"""
+    discount_amount = int(base_price * MULTI_SESSION_DISCOUNT_RATE) if discounted else 0
+    final_price = base_price - discount_amount
+    platform_fee = int(final_price * PLATFORM_FEE_PERCENT / 100)
+    return {
+        'basePricePerMinuteCents': base_rate,
+        'baseSessionPriceCents': base_price,
+        'discountType': "multi_session" if discounted else None,
+        'discountAmountCents': discount_amount,
+        'finalSessionPriceCents': final_price,
+        'platformFeePercent': PLATFORM_FEE_PERCENT,
+        'platformFeeCents': platform_fee,
+        'trainerEarningsCents': final_price - platform_fee,
+    }
+
+
+def virtual_quote() -> dict:
+    return quote(VIRTUAL_RATE_PER_MINUTE_CENTS, VIRTUAL_SESSION_PRICE_CENTS)
+
+
+# ============================================================================
+# PAIR COUNTERS
+# ============================================================================
+
+def pair_key(trainee_id: str, trainer_id: str) -> str:
+    return f'{trainee_id}:{trainer_id}'
+
+
+def _bucket(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%d')
+
+
+def _window_start(now: datetime) -> str:
+    return _bucket(now - timedelta(days=MULTI_SESSION_WINDOW_DAYS))
+
+
+class PairCounter(NamedTuple):
+    trainee_id: str
+    trainer_id: str
+    # Sessions created per UTC day, "YYYY-MM-DD" -> count
+    days: Dict[str, int]
+
+    def recent(self, now: datetime) -> int:
+        """Sessions booked within the discount window"""
+        first = _window_start(now)
+        return sum(count for day, count in self.days.items() if day >= first)
+
+    def discounted(self, now: datetime, booked_before: int = 0) -> bool:
+        """Whether a session booked now, after ``booked_before`` others in the same request, is discounted"""
+        return self.recent(now) + booked_before >= MULTI_SESSION_MIN_RECENT
+
+
+async def load_pair_counter(counters, trainee_id: str, trainer_id: str) -> PairCounter:
+    counter = await counters.find_one({'_id': pair_key(trainee_id, trainer_id)}, {'days': 1})
+    return PairCounter(trainee_id, trainer_id, (counter or {}).get('days', {}))
+
+
+async def record_sessions(counters, counter: PairCounter, count: int = 1, now: Optional[datetime] = None):
+    """Count ``count`` sessions created now, dropping the buckets of ``counter`` that left the window"""
+    now = now or datetime.utcnow()
+    update = {
+        '$inc': {f'days.{_bucket(now)}': count},
+        '$setOnInsert': {'traineeId': counter.trainee_id, 'trainerId': counter.trainer_id},
+        '$set': {'updatedAt': now},
+    }
+    first = _window_start(now)
+    stale = [day for day in counter.days if day < first]
+    if stale:
+        update['$unset'] = {f'days.{day}': '' for day in stale}
+    await counters.update_one({'_id': pair_key(counter.trainee_id, counter.trainer_id)}, update, upsert=True)
+
+
+async def forget_session(counters, session: dict, now: Optional[datetime] = None):
+    """Stop counting a declined session towards the discount"""
+    day = _bucket(session['createdAt'])
+    if day < _window_start(now or datetime.utcnow()):
+        return
+    await counters.update_one(
+        {'_id': pair_key(session['traineeId'], session['trainerId']), f'days.{day}': {'$gt': 0}},
+        {'$inc': {f'days.{day}': -1}}
+    )
+
+
+async def backfill_pair_counters(db, now: Optional[datetime] = None) -> int:
+    """Rebuild every counter from the sessions created within the window; returns the pairs written"""
+    now = now or datetime.utcnow()
+    sessions = await db.sessions.find(
+        {'createdAt': {'$gte': datetime.strptime(_window_start(now), '%Y-%m-%d')},
+         'status': {'$ne': SessionStatus.DECLINED}},
+        {'traineeId': 1, 'trainerId': 1, 'createdAt': 1}
+    ).to_list(None)
+    pairs = Counter((s['traineeId'], s['trainerId'], _bucket(s['createdAt'])) for s in sessions)
+    days_by_pair = {}
+    for (trainee_id, trainer_id, day), count in pairs.items():
+        days_by_pair.setdefault((trainee_id, trainer_id), {})[day] = count
+    await db.pair_counters.delete_many({})
+    if days_by_pair:
+        await db.pair_counters.insert_many([
+            {'_id': pair_key(trainee_id, trainer_id), 'traineeId': trainee_id, 'trainerId': trainer_id,
+             'days': days, 'updatedAt': now}
+            for (trainee_id, trainer_id), days in days_by_pair.items()
+        ])
+    return len(days_by_pair)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+async def _main(args) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'rapidreps_db')]
+    try:
+        if args.backfill:
+            print(f"pair counters written: {await backfill_pair_counters(db)}")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain RapidReps pricing counters')
+    parser.add_argument('--backfill', action='store_true', help='rebuild pair counters from recent sessions')
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
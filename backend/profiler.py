@@ -0,0 +1,207 @@
+"""
+On-demand sampling profiler for individual API requests.
+
+An admin arms the profiler for a path prefix and a number of requests (see
+``/api/admin/profile``). Matching requests are sampled from a background thread
+while they run; the samples include the handler, Pydantic serialization and
+the coroutine chain suspended on DB awaits. Results are kept in memory and can
+be downloaded as collapsed stacks (flamegraph.pl, speedscope) or speedscope
+JSON.
+
+When nothing is armed the middleware does a single truthiness check per
+request and otherwise stays out of the way.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '2'))
+PROFILER_MAX_RESULTS = int(os.environ.get('PROFILER_MAX_RESULTS', '20'))
+
+AWAIT_FRAME = '<awaiting I/O>'
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _coroutine_frames(coro) -> Tuple[list, bool]:
+    """Frames of a coroutine's await chain, outermost first, and whether it is running"""
+    frames = []
+    running = bool(getattr(coro, 'cr_running', False))
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return frames, running
+
+
+def task_stack(task: asyncio.Task, thread_frame) -> Optional[Tuple[str, ...]]:
+    """Current stack of ``task``, root first.
+
+    While the task runs, its frames are on the loop thread's stack and include
+    synchronous callees (serialization, hashing). While it is suspended, the
+    await chain shows where it is waiting.
+    """
+    chain, running = _coroutine_frames(task.get_coro())
+    if not chain:
+        return None
+
+    if running and thread_frame is not None:
+        stack = []
+        frame = thread_frame
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            if frame is chain[0]:
+                return tuple(reversed(stack))
+            frame = frame.f_back
+
+    return tuple(_frame_name(frame) for frame in chain) + (AWAIT_FRAME,)
+
+
+class ProfileResult:
+    def __init__(self, label: str, interval_ms: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.interval_ms = interval_ms
+        self.started_at = datetime.utcnow()
+        self.duration_ms = 0.0
+        self.samples: Counter = Counter()
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'label': self.label,
+            'startedAt': self.started_at,
+            'durationMs': round(self.duration_ms, 2),
+            'sampleCount': sum(self.samples.values()),
+            'intervalMs': self.interval_ms,
+        }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stack format, one ``frame;frame;frame count`` per line"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+    def speedscope(self) -> dict:
+        frames: List[dict] = []
+        frame_index: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            indexes = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({'name': name})
+                indexes.append(frame_index[name])
+            samples.append(indexes)
+            weights.append(count * self.interval_ms)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.label,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': self.label,
+            'exporter': 'rapidreps-profiler',
+        }
+
+
+class _Sampler(threading.Thread):
+    """Samples one task's stack at a fixed interval until stopped"""
+
+    def __init__(self, task: asyncio.Task, result: ProfileResult):
+        super().__init__(name=f'profiler-{result.id}', daemon=True)
+        self.task = task
+        self.result = result
+        self.loop_thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = self.result.interval_ms / 1000
+        while not self.stopped.wait(interval):
+            stack = task_stack(self.task, sys._current_frames().get(self.loop_thread_id))
+            if stack:
+                self.result.samples[stack] += 1
+
+
+class RequestProfiler:
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, max_results: int = PROFILER_MAX_RESULTS):
+        self.interval_ms = interval_ms
+        # path prefix -> requests left to profile
+        self.armed: Dict[str, int] = {}
+        self.results = deque(maxlen=max_results)
+        self._lock = threading.Lock()
+
+    def arm(self, path_prefix: str, requests: int = 1):
+        with self._lock:
+            self.armed[path_prefix] = requests
+
+    def disarm(self):
+        with self._lock:
+            self.armed.clear()
+
+    def claim(self, path: str) -> bool:
+        """Take one profiling slot for ``path`` if an armed prefix matches it"""
+        with self._lock:
+            for prefix, remaining in self.armed.items():
+                if path.startswith(prefix):
+                    if remaining <= 1:
+                        del self.armed[prefix]
+                    else:
+                        self.armed[prefix] = remaining - 1
+                    return True
+        return False
+
+    def get(self, profile_id: str) -> Optional[ProfileResult]:
+        return next((r for r in self.results if r.id == profile_id), None)
+
+    async def profile(self, label: str, awaitable):
+        """Await ``awaitable`` in the current task while sampling it"""
+        result = ProfileResult(label, self.interval_ms)
+        sampler = _Sampler(asyncio.current_task(), result)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            return await awaitable
+        finally:
+            sampler.stopped.set()
+            sampler.join()
+            result.duration_ms = (time.perf_counter() - started) * 1000
+            self.results.append(result)
+
+
+profiler = RequestProfiler()
+
+
+class ProfilerMiddleware:
+    """ASGI middleware that profiles requests matching an armed path prefix.
+
+    It must sit inside any ``BaseHTTPMiddleware`` so that it runs in the same
+    task as the route handler.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.armed or scope['type'] != 'http' or not self.profiler.claim(scope['path']):
+            return await self.app(scope, receive, send)
+        label = f"{scope['method']} {scope['path']}"
+        await self.profiler.profile(label, self.app(scope, receive, send))
@@ -0,0 +1,132 @@
+"""
+Trainer double-booking protection for the RapidReps API.
+
+Two layers keep a trainer from being booked twice for the same time:
+
+- ``find_conflicts`` is a bounded range query on ``(trainerId,
+  sessionDateTimeStart)``. A session overlapping ``[start, end)`` must start
+  before ``end`` and, since no session is longer than
+  ``MAX_SESSION_MINUTES``, no earlier than ``start - MAX_SESSION_MINUTES``.
+  The query therefore reads only the trainer's sessions in that window, however
+  long their history is, and gives the caller a clear answer up front.
+- ``reserve_slots`` makes the booking atomic. Every active session owns one
+  ``session_slots`` document per ``SLOT_MINUTES`` bucket it touches, under a
+  unique ``(trainerId, slotStart)`` index. Two concurrent bookings for the same
+  time both pass the range query, but only one can insert the slots; the other
+  gets a duplicate key error, rolls back what it inserted and is refused.
+
+Slots are released when a session stops being active (declined, cancelled,
+no-show). Buckets are ``SLOT_MINUTES`` wide, so sessions that start off the
+quarter hour can block a neighbouring booking that shares a bucket.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from session_state import SessionStatus
+
+SLOT_MINUTES = 15
+# Longest bookable session; bounds how far back the conflict query has to look
+MAX_SESSION_MINUTES = int(os.environ.get('MAX_SESSION_MINUTES', '240'))
+
+# Statuses in which a session holds the trainer's time
+ACTIVE_STATUSES = (SessionStatus.REQUESTED, SessionStatus.CONFIRMED)
+
+Interval = Tuple[datetime, datetime]
+
+
+def floor_to_slot(moment: datetime) -> datetime:
+    return moment.replace(minute=moment.minute - moment.minute % SLOT_MINUTES, second=0, microsecond=0)
+
+
+def slot_starts(start: datetime, end: datetime) -> List[datetime]:
+    """Start of every bucket that ``[start, end)`` touches"""
+    slots = []
+    slot = floor_to_slot(start)
+    while slot < end:
+        slots.append(slot)
+        slot += timedelta(minutes=SLOT_MINUTES)
+    return slots
+
+
+def validate_duration(duration_minutes: int):
+    if not 0 < duration_minutes <= MAX_SESSION_MINUTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Session duration must be between 1 and {MAX_SESSION_MINUTES} minutes"
+        )
+
+
+async def find_conflicts(sessions, trainer_id: str, intervals: Iterable[Interval]) -> List[dict]:
+    """Active sessions of the trainer overlapping any of ``intervals``, in one range query"""
+    intervals = list(intervals)
+    if not intervals:
+        return []
+    window_start = min(start for start, _ in intervals) - timedelta(minutes=MAX_SESSION_MINUTES)
+    window_end = max(end for _, end in intervals)
+    # Status is checked here rather than in the query so the (trainerId, start) index serves it alone
+    candidates = await sessions.find(
+        {'trainerId': trainer_id, 'sessionDateTimeStart': {'$gt': window_start, '$lt': window_end}},
+        {'sessionDateTimeStart': 1, 'sessionDateTimeEnd': 1, 'status': 1}
+    ).to_list(None)
+    return [
+        session for session in candidates
+        if session['status'] in ACTIVE_STATUSES and any(
+            session['sessionDateTimeStart'] < end and session['sessionDateTimeEnd'] > start
+            for start, end in intervals
+        )
+    ]
+
+
+async def find_busy_trainers(sessions, trainer_ids: List[str], start: datetime, end: datetime) -> set:
+    """Which of ``trainer_ids`` have an active session overlapping ``[start, end)``, in one query"""
+    if not trainer_ids:
+        return set()
+    booked = await sessions.find(
+        {
+            'trainerId': {'$in': trainer_ids},
+            'sessionDateTimeStart': {'$gt': start - timedelta(minutes=MAX_SESSION_MINUTES), '$lt': end},
+        },
+        {'trainerId': 1, 'sessionDateTimeEnd': 1, 'status': 1}
+    ).to_list(None)
+    return {
+        session['trainerId'] for session in booked
+        if session['status'] in ACTIVE_STATUSES and session['sessionDateTimeEnd'] > start
+    }
+
+
+async def reserve_slots(slots, trainer_id: str, bookings: Iterable[Tuple[ObjectId, datetime, datetime]]):
+    """Claim the buckets of every ``(sessionId, start, end)`` booking, all or nothing.
+
+    Raises 409 if another booking holds any of them.
+    """
+    now = datetime.utcnow()
+    docs = [
+        {'trainerId': trainer_id, 'slotStart': slot, 'sessionId': session_id, 'createdAt': now}
+        for session_id, start, end in bookings
+        for slot in slot_starts(start, end)
+    ]
+    if not docs:
+        return
+    try:
+        await slots.insert_many(docs, ordered=True)
+    except (BulkWriteError, DuplicateKeyError):
+        await slots.delete_many({'sessionId': {'$in': list({doc['sessionId'] for doc in docs})}})
+        raise HTTPException(status_code=409, detail="Trainer is already booked at that time")
+
+
+async def release_slots(slots, session_ids: Iterable[ObjectId]):
+    session_ids = list(session_ids)
+    if session_ids:
+        await slots.delete_many({'sessionId': {'$in': session_ids}})
+
+
+async def book(db, trainer_id: str, bookings: List[Tuple[ObjectId, datetime, datetime]]):
+    """Check ``bookings`` against the trainer's calendar and reserve their slots, or raise 409"""
+    if await find_conflicts(db.sessions, trainer_id, [(start, end) for _, start, end in bookings]):
+        raise HTTPException(status_code=409, detail="Trainer is already booked at that time")
+    await reserve_slots(db.session_slots, trainer_id, bookings)
@@ -0,0 +1,512 @@
+"""
+Synthetic dataset generator and bulk loader for RapidReps.
+
+Generates users, trainer and trainee profiles clustered around real metro
+areas, weekly availability templates, sessions across every status with the
+``session_slots`` their active ones hold, ratings, conversations and messages,
+and writes them straight into MongoDB with unordered ``insert_many`` batches from
+several worker processes. Document ids are derived from their index, so every
+worker can reference any user or session without coordinating with the others.
+
+    # 1M trainers, 2M trainees, 5M sessions, 10M messages on 8 workers
+    python seed_dataset.py --trainers 1000000 --trainees 2000000 \\
+        --sessions 5000000 --conversations 1000000 --messages 10000000 --workers 8 --drop
+
+The builders (``build_users`` etc.) are plain functions so benchmarks can
+generate the same documents in memory.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, NamedTuple
+
+import bcrypt
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from availability import WEEKDAYS, availability_fields
+from scheduling import ACTIVE_STATUSES, slot_starts
+
+# (latitude, longitude, relative weight, time zone) of the metro areas users cluster around
+METRO_AREAS = [
+    (40.7128, -74.0060, 20, 'America/New_York'),      # New York
+    (34.0522, -118.2437, 14, 'America/Los_Angeles'),  # Los Angeles
+    (41.8781, -87.6298, 10, 'America/Chicago'),       # Chicago
+    (29.7604, -95.3698, 8, 'America/Chicago'),        # Houston
+    (33.4484, -112.0740, 6, 'America/Phoenix'),       # Phoenix
+    (39.9526, -75.1652, 6, 'America/New_York'),       # Philadelphia
+    (32.7767, -96.7970, 7, 'America/Chicago'),        # Dallas
+    (37.7749, -122.4194, 7, 'America/Los_Angeles'),   # San Francisco
+    (47.6062, -122.3321, 5, 'America/Los_Angeles'),   # Seattle
+    (25.7617, -80.1918, 6, 'America/New_York'),       # Miami
+    (33.7490, -84.3880, 6, 'America/New_York'),       # Atlanta
+    (42.3601, -71.0589, 5, 'America/New_York'),       # Boston
+    (39.7392, -104.9903, 4, 'America/Denver'),        # Denver
+    (39.2904, -76.6122, 4, 'America/New_York'),       # Baltimore
+    (38.9072, -77.0369, 5, 'America/New_York'),       # Washington
+    (30.2672, -97.7431, 4, 'America/Chicago'),        # Austin
+]
+# Standard deviation of the offset from a metro centre, in degrees (~10 miles)
+METRO_SPREAD_DEGREES = 0.15
+
+TRAINING_STYLES = ['strength', 'hiit', 'yoga', 'pilates', 'boxing', 'mobility', 'crossfit', 'running', 'bodybuilding']
+FITNESS_LEVELS = ['beginner', 'intermediate', 'advanced']
+# Session status mix, weighted towards history
+SESSION_STATUSES = [('completed', 45), ('confirmed', 15), ('requested', 15), ('declined', 10), ('cancelled', 10),
+                    ('no_show', 5)]
+# Share of completed sessions that get rated
+RATED_SHARE = 0.6
+# Local windows trainers pick their weekly availability from
+AVAILABILITY_WINDOWS = [('06:00', '10:00'), ('11:00', '14:00'), ('16:00', '20:00')]
+
+# Ids are derived from a document's index; the prefix keeps them apart from real ObjectIds
+USER_ID_PREFIX = '5eed0000'
+SESSION_ID_PREFIX = '5eed0001'
+
+
+class DatasetSpec(NamedTuple):
+    trainers: int
+    trainees: int
+    sessions: int
+    conversations: int
+    messages: int
+    seed: int
+    password_hash: str
+    now: datetime
+
+
+def user_oid(index: int) -> ObjectId:
+    return ObjectId(f'{USER_ID_PREFIX}{index:016x}')
+
+
+def session_oid(index: int) -> ObjectId:
+    return ObjectId(f'{SESSION_ID_PREFIX}{index:016x}')
+
+
+def trainer_user_id(spec: DatasetSpec, rng: random.Random) -> str:
+    return str(user_oid(rng.randrange(spec.trainers)))
+
+
+def trainee_user_id(spec: DatasetSpec, rng: random.Random) -> str:
+    return str(user_oid(spec.trainers + rng.randrange(spec.trainees)))
+
+
+def _rng(spec: DatasetSpec, kind: str, start: int) -> random.Random:
+    """Deterministic RNG per chunk, so a reload produces the same data"""
+    return random.Random(f'{spec.seed}:{kind}:{start}')
+
+
+_METRO_WEIGHTS = [w for _, _, w, _ in METRO_AREAS]
+
+
+def _location(rng: random.Random):
+    """Latitude, longitude and time zone of a point near a metro area"""
+    lat, lon, _, tz = rng.choices(METRO_AREAS, weights=_METRO_WEIGHTS)[0]
+    return round(rng.gauss(lat, METRO_SPREAD_DEGREES), 6), round(rng.gauss(lon, METRO_SPREAD_DEGREES), 6), tz
+
+
+def _availability(rng: random.Random, tz: str) -> dict:
+    """A weekly template of one or two windows on three to six days"""
+    template = {'timezone': tz}
+    for day in sorted(rng.sample(WEEKDAYS, rng.randint(3, 6)), key=WEEKDAYS.index):
+        windows = sorted(rng.sample(AVAILABILITY_WINDOWS, rng.randint(1, 2)))
+        template[day] = [{'start': start, 'end': end} for start, end in windows]
+    return template
+
+
+# ============================================================================
+# BUILDERS
+# ============================================================================
+
+def build_users(spec: DatasetSpec, start: int, end: int) -> List[dict]:
+    """Users ``[start, end)``; the first ``spec.trainers`` indexes are trainers"""
+    rng = _rng(spec, 'users', start)
+    docs = []
+    for index in range(start, end):
+        is_trainer = index < spec.trainers
+        created = spec.now - timedelta(days=rng.randint(1, 720))
+        docs.append({
+            '_id': user_oid(index),
+            'fullName': f"{'Trainer' if is_trainer else 'Trainee'} {index}",
+            'email': f'seed-{index}@example.com',
+            'phone': f'555-{index % 10000:04d}',
+            'passwordHash': spec.password_hash,
+            'roles': ['trainer'] if is_trainer else ['trainee'],
+            'isAdmin': False,
+            'createdAt': created,
+            'updatedAt': created,
+        })
+    return docs
+
+
+def build_trainer_profiles(spec: DatasetSpec, start: int, end: int) -> List[dict]:
+    rng = _rng(spec, 'trainer_profiles', start)
+    docs = []
+    for index in range(start, end):
+        lat, lon, tz = _location(rng)
+        availability = _availability(rng, tz)
+        offers_virtual = rng.random() < 0.35
+        created = spec.now - timedelta(days=rng.randint(1, 720))
+        docs.append({
+            'userId': str(user_oid(index)),
+            'avatarUrl': None,
+            'bio': 'Certified personal trainer',
+            'experienceYears': rng.randint(0, 20),
+            'certifications': rng.sample(['NASM', 'ACE', 'ISSA', 'NSCA', 'ACSM'], rng.randint(0, 2)),
+            'trainingStyles': rng.sample(TRAINING_STYLES, rng.randint(1, 3)),
+            'gymsWorkedAt': [],
+            'primaryGym': None,
+            'offersInPerson': rng.random() < 0.9,
+            'offersVirtual': offers_virtual,
+            'sessionDurationsOffered': [30, 45, 60],
+            'ratePerMinuteCents': rng.randint(50, 300),
+            'travelRadiusMiles': rng.choice([5, 10, 15, 25]),
+            'cancellationPolicy': 'Free cancellation before 24 hours',
+            'availability': availability,
+            **availability_fields(availability),
+            'verificationDocs': [],
+            'latitude': lat,
+            'longitude': lon,
+            'locationAddress': None,
+            'isAvailable': rng.random() < 0.7,
+            'isVirtualTrainingAvailable': offers_virtual and rng.random() < 0.7,
+            'videoCallPreference': 'native',
+            'averageRating': round(rng.uniform(3.0, 5.0), 2),
+            'totalSessionsCompleted': rng.randint(0, 500),
+            'isVerified': rng.random() < 0.5,
+            'stripeAccountId': None,
+            'createdAt': created,
+            'updatedAt': created,
+        })
+    return docs
+
+
+def build_trainee_profiles(spec: DatasetSpec, start: int, end: int) -> List[dict]:
+    rng = _rng(spec, 'trainee_profiles', start)
+    docs = []
+    for offset in range(start, end):
+        lat, lon, _ = _location(rng)
+        created = spec.now - timedelta(days=rng.randint(1, 720))
+        docs.append({
+            'userId': str(user_oid(spec.trainers + offset)),
+            'profilePhoto': None,
+            'fitnessGoals': 'Get stronger',
+            'currentFitnessLevel': rng.choice(FITNESS_LEVELS),
+            'experienceLevel': None,
+            'preferredTrainingStyles': rng.sample(TRAINING_STYLES, rng.randint(1, 3)),
+            'injuriesOrLimitations': None,
+            'homeGymOrZipCode': None,
+            'prefersInPerson': True,
+            'prefersVirtual': rng.random() < 0.3,
+            'isVirtualEnabled': False,
+            'typicalAvailability': None,
+            'budgetMinPerMinuteCents': 50,
+            'budgetMaxPerMinuteCents': 200,
+            'latitude': lat,
+            'longitude': lon,
+            'locationAddress': None,
+            'createdAt': created,
+            'updatedAt': created,
+        })
+    return docs
+
+
+def build_sessions_and_ratings(spec: DatasetSpec, start: int, end: int):
+    """Sessions ``[start, end)`` and the ratings of those that were completed and rated"""
+    rng = _rng(spec, 'sessions', start)
+    statuses = [s for s, _ in SESSION_STATUSES]
+    weights = [w for _, w in SESSION_STATUSES]
+    sessions, ratings = [], []
+    for index in range(start, end):
+        status = rng.choices(statuses, weights=weights)[0]
+        if status in ('completed', 'no_show', 'declined', 'cancelled'):
+            session_start = spec.now - timedelta(days=rng.randint(1, 365), hours=rng.randint(0, 12))
+        else:
+            session_start = spec.now + timedelta(days=rng.randint(1, 60), hours=rng.randint(0, 12))
+        session_start = session_start.replace(minute=rng.choice([0, 15, 30, 45]), second=0, microsecond=0)
+        duration = rng.choice([30, 45, 60])
+        rate = rng.randint(50, 300)
+        base_price = rate * duration
+        discount = int(base_price * 0.05) if rng.random() < 0.2 else 0
+        final_price = base_price - discount
+        platform_fee = int(final_price * 0.10)
+        created = session_start - timedelta(days=rng.randint(1, 14))
+        trainer_id = trainer_user_id(spec, rng)
+        trainee_id = trainee_user_id(spec, rng)
+
+        sessions.append({
+            '_id': session_oid(index),
+            'traineeId': trainee_id,
+            'trainerId': trainer_id,
+            'status': status,
+            'sessionDateTimeStart': session_start,
+            'sessionDateTimeEnd': session_start + timedelta(minutes=duration),
+            'durationMinutes': duration,
+            'basePricePerMinuteCents': rate,
+            'baseSessionPriceCents': base_price,
+            'discountType': 'multi_session' if discount else None,
+            'discountAmountCents': discount,
+            'finalSessionPriceCents': final_price,
+            'platformFeePercent': 10,
+            'platformFeeCents': platform_fee,
+            'trainerEarningsCents': final_price - platform_fee,
+            'locationType': rng.choice(['gym', 'home', 'virtual']),
+            'locationNameOrAddress': None,
+            'notes': None,
+            'paymentIntentId': None,
+            'createdAt': created,
+            'updatedAt': created,
+        })
+        if status == 'completed' and rng.random() < RATED_SHARE:
+            ratings.append({
+                'sessionId': str(session_oid(index)),
+                'traineeId': trainee_id,
+                'trainerId': trainer_id,
+                'rating': rng.choices([1, 2, 3, 4, 5], weights=[2, 3, 10, 35, 50])[0],
+                'reviewText': None,
+                'createdAt': session_start + timedelta(hours=rng.randint(1, 48)),
+            })
+    return sessions, ratings
+
+
+def build_session_slots(sessions: List[dict]) -> List[dict]:
+    """The ``session_slots`` the active ``sessions`` hold, so the double-booking guard sees them.
+
+    Sessions are placed at random and can overlap. Slot ids are derived from
+    the trainer and bucket, so the first session keeps a shared bucket, later
+    inserts of it are rejected as duplicates, and the unique
+    ``(trainerId, slotStart)`` index still builds.
+    """
+    docs = {}
+    for session in sessions:
+        if session['status'] not in ACTIVE_STATUSES:
+            continue
+        for slot in slot_starts(session['sessionDateTimeStart'], session['sessionDateTimeEnd']):
+            slot_id = f"{session['trainerId']}:{slot:%Y%m%dT%H%M}"
+            docs.setdefault(slot_id, {
+                '_id': slot_id,
+                'trainerId': session['trainerId'],
+                'slotStart': slot,
+                'sessionId': session['_id'],
+                'createdAt': session['createdAt'],
+            })
+    return list(docs.values())
+
+
+def build_conversations(spec: DatasetSpec, start: int, end: int) -> List[dict]:
+    rng = _rng(spec, 'conversations', start)
+    docs = []
+    for index in range(start, end):
+        created = spec.now - timedelta(days=rng.randint(1, 365))
+        docs.append({
+            '_id': f'seed-conversation-{index}',
+            'participants': [trainer_user_id(spec, rng), trainee_user_id(spec, rng)],
+            'createdAt': created,
+            'updatedAt': created,
+        })
+    return docs
+
+
+def build_messages(spec: DatasetSpec, start: int, end: int) -> List[dict]:
+    """Messages ``[start, end)``, spread evenly over the conversations.
+
+    The participants of conversation ``i`` are re-derived from the same RNG
+    stream ``build_conversations`` used, so messages always match their thread.
+    """
+    per_conversation = max(math.ceil(spec.messages / max(spec.conversations, 1)), 1)
+    docs = []
+    chunks = {}
+    for index in range(start, end):
+        conversation = index // per_conversation
+        chunk_start = conversation - conversation % _CONVERSATION_CHUNK
+        if chunk_start not in chunks:
+            chunks[chunk_start] = _conversation_participants(spec, chunk_start)
+        trainer_id, trainee_id = chunks[chunk_start][conversation - chunk_start]
+        position = index % per_conversation
+        sender, receiver = (trainee_id, trainer_id) if position % 2 == 0 else (trainer_id, trainee_id)
+        docs.append({
+            '_id': f'seed-message-{index}',
+            'conversationId': f'seed-conversation-{conversation}',
+            'senderId': sender,
+            'receiverId': receiver,
+            'content': f'Message {position} in thread {conversation}',
+            'isRead': position < per_conversation - 2,
+            'createdAt': spec.now - timedelta(days=365) + timedelta(minutes=conversation % 500000 + position),
+        })
+    return docs
+
+
+# Conversations are generated in fixed chunks so messages can replay their RNG stream
+_CONVERSATION_CHUNK = 10000
+
+
+def _conversation_participants(spec: DatasetSpec, chunk_start: int) -> List[tuple]:
+    """(trainer, trainee) of every conversation in the chunk, replaying ``build_conversations``"""
+    rng = _rng(spec, 'conversations', chunk_start)
+    pairs = []
+    for _ in range(chunk_start, min(chunk_start + _CONVERSATION_CHUNK, spec.conversations)):
+        rng.randint(1, 365)
+        pairs.append((trainer_user_id(spec, rng), trainee_user_id(spec, rng)))
+    return pairs
+
+
+# ============================================================================
+# LOADER
+# ============================================================================
+
+_db = None
+
+
+def _init_worker(mongo_url: str, db_name: str):
+    global _db
+    from pymongo import MongoClient
+    _db = MongoClient(mongo_url)[db_name]
+
+
+def _insert(collection: str, docs: List[dict], batch_size: int, skip_duplicates: bool = False) -> int:
+    inserted = 0
+    for i in range(0, len(docs), batch_size):
+        try:
+            inserted += len(_db[collection].insert_many(docs[i:i + batch_size], ordered=False).inserted_ids)
+        except BulkWriteError as exc:
+            if not skip_duplicates or any(error['code'] != 11000 for error in exc.details['writeErrors']):
+                raise
+            inserted += exc.details['nInserted']
+    return inserted
+
+
+def _load_chunk(task) -> dict:
+    kind, spec, start, end, batch_size = task
+    counts = {}
+    if kind == 'users':
+        counts['users'] = _insert('users', build_users(spec, start, end), batch_size)
+    elif kind == 'trainer_profiles':
+        counts['trainer_profiles'] = _insert('trainer_profiles', build_trainer_profiles(spec, start, end), batch_size)
+    elif kind == 'trainee_profiles':
+        counts['trainee_profiles'] = _insert('trainee_profiles', build_trainee_profiles(spec, start, end), batch_size)
+    elif kind == 'sessions':
+        sessions, ratings = build_sessions_and_ratings(spec, start, end)
+        counts['sessions'] = _insert('sessions', sessions, batch_size)
+        # Another worker may have written a bucket shared with one of these sessions
+        counts['session_slots'] = _insert('session_slots', build_session_slots(sessions), batch_size,
+                                          skip_duplicates=True)
+        if ratings:
+            counts['ratings'] = _insert('ratings', ratings, batch_size)
+    elif kind == 'conversations':
+        counts['conversations'] = _insert('conversations', build_conversations(spec, start, end), batch_size)
+    elif kind == 'messages':
+        counts['messages'] = _insert('messages', build_messages(spec, start, end), batch_size)
+    return counts
+
+
+def plan_tasks(spec: DatasetSpec, chunk_size: int, batch_size: int):
+    """Split every collection's index range into chunks a worker can load independently"""
+    totals = [
+        ('users', spec.trainers + spec.trainees),
+        ('trainer_profiles', spec.trainers),
+        ('trainee_profiles', spec.trainees),
+        ('sessions', spec.sessions),
+        ('conversations', spec.conversations),
+        ('messages', spec.messages),
+    ]
+    tasks = []
+    for kind, total in totals:
+        # Conversation chunks must line up with _conversation_participants
+        size = _CONVERSATION_CHUNK if kind == 'conversations' else chunk_size
+        for start in range(0, total, size):
+            tasks.append((kind, spec, start, min(start + size, total), batch_size))
+    return tasks
+
+
+def load(spec: DatasetSpec, mongo_url: str, db_name: str, workers: int, chunk_size: int, batch_size: int) -> dict:
+    totals = {}
+    started = time.perf_counter()
+    tasks = plan_tasks(spec, chunk_size, batch_size)
+    with Pool(workers, initializer=_init_worker, initargs=(mongo_url, db_name)) as pool:
+        for done, counts in enumerate(pool.imap_unordered(_load_chunk, tasks), 1):
+            for collection, count in counts.items():
+                totals[collection] = totals.get(collection, 0) + count
+            inserted = sum(totals.values())
+            elapsed = time.perf_counter() - started
+            print(f'\r{done}/{len(tasks)} chunks, {inserted:,} docs, {inserted / elapsed:,.0f} docs/s', end='', flush=True)
+    print()
+    return totals
+
+
+async def _ensure_indexes(mongo_url: str, db_name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from indexes import ensure_indexes
+
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        return await ensure_indexes(client[db_name])
+    finally:
+        client.close()
+
+
+def main(args):
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    mongo_url = args.mongo_url or os.environ['MONGO_URL']
+    db_name = args.db or os.environ.get('DB_NAME', 'rapidreps_db')
+
+    if args.conversations == 0 and args.messages:
+        raise SystemExit('--messages needs at least one conversation')
+
+    spec = DatasetSpec(
+        trainers=args.trainers,
+        trainees=args.trainees,
+        sessions=args.sessions,
+        conversations=args.conversations,
+        messages=args.messages,
+        seed=args.seed,
+        # One hash shared by every seeded user; bcrypt per user would dominate the load time
+        password_hash=bcrypt.hashpw(args.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        now=datetime.utcnow().replace(microsecond=0),
+    )
+
+    if args.drop:
+        client = MongoClient(mongo_url)
+        for collection in ('users', 'trainer_profiles', 'trainee_profiles', 'sessions', 'session_slots',
+                           'session_series', 'pair_counters', 'ratings', 'conversations', 'messages'):
+            client[db_name][collection].drop()
+        client.close()
+
+    started = time.perf_counter()
+    totals = load(spec, mongo_url, db_name, args.workers, args.chunk_size, args.batch_size)
+    print(f'Loaded in {time.perf_counter() - started:.1f}s: ' +
+          ', '.join(f'{collection}={count:,}' for collection, count in sorted(totals.items())))
+
+    if not args.skip_indexes:
+        # Building indexes once after the load is much faster than maintaining them per insert
+        started = time.perf_counter()
+        result = asyncio.run(_ensure_indexes(mongo_url, db_name))
+        print(f"Indexes built in {time.perf_counter() - started:.1f}s, failed: {', '.join(result['failed']) or '-'}")
+    print(f'Every seeded user can log in as seed-<n>@example.com with password {args.password!r}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate and bulk load a synthetic RapidReps dataset')
+    parser.add_argument('--trainers', type=int, default=1000)
+    parser.add_argument('--trainees', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--chunk-size', type=int, default=50000, help='documents generated per worker task')
+    parser.add_argument('--batch-size', type=int, default=5000, help='documents per insert_many call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--mongo-url', help='defaults to MONGO_URL')
+    parser.add_argument('--db', help='defaults to DB_NAME')
+    parser.add_argument('--drop', action='store_true', help='drop the seeded collections first')
+    parser.add_argument('--skip-indexes', action='store_true', help='do not build indexes after loading')
+    main(parser.parse_args())
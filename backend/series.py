@@ -0,0 +1,280 @@
+"""
+Recurring session series for the RapidReps API.
+
+A series books the same local time every ``intervalWeeks`` weeks, for
+``occurrences`` sessions. However many occurrences it has, creating one
+costs a fixed number of round trips:
+
+- one ``find_conflicts`` range query that covers every occurrence, and one
+  ``pending_occurrences`` query for the trainer's other series;
+- one pair counter read, which prices all occurrences together (the
+  occurrence that would be the trainee's third recent session with the
+  trainer, and every one after it, gets the multi-session discount);
+- one ``session_slots`` insert_many and one ``sessions`` insert_many.
+
+Every occurrence holds the trainer's time from the start: its session id is
+chosen up front (``occurrenceIds``) and its slots are reserved under it, so a
+later single booking on top of any week is refused with 409. Only
+occurrences that start within ``SERIES_HORIZON_DAYS`` become session
+documents, though. The rest stay in the ``session_series`` document, and
+``materialize_due`` writes their sessions as the horizon moves forward. The
+``nextOccurrenceStart`` field points at the first unbooked occurrence and is
+removed once every occurrence has been booked. Each extension is claimed by
+a conditional update on ``materializedCount``, so two readers can never book
+the same occurrence. Readers that need the trainer's full calendar before
+then (free slots, availability search) add ``pending_occurrences``.
+
+Either participant can cancel a series with ``cancel_series``. That stops
+further occurrences from being booked and releases their slots. Occurrences
+already booked as sessions are kept and are cancelled or declined one by one.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from pricing import MULTI_SESSION_MIN_RECENT, PairCounter, load_pair_counter, quote, record_sessions
+from scheduling import find_conflicts, release_slots, reserve_slots
+from session_state import SessionStatus
+
+# Occurrences starting further out than this stay in the series document until the horizon reaches them
+SERIES_HORIZON_DAYS = int(os.environ.get('SERIES_HORIZON_DAYS', '28'))
+MAX_SERIES_OCCURRENCES = int(os.environ.get('MAX_SERIES_OCCURRENCES', '52'))
+MAX_SERIES_INTERVAL_WEEKS = 4
+
+
+def validate_series(occurrences: int, interval_weeks: int):
+    if not 0 < occurrences <= MAX_SERIES_OCCURRENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A series must have between 1 and {MAX_SERIES_OCCURRENCES} occurrences"
+        )
+    if not 0 < interval_weeks <= MAX_SERIES_INTERVAL_WEEKS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"intervalWeeks must be between 1 and {MAX_SERIES_INTERVAL_WEEKS}"
+        )
+
+
+def occurrence_starts(first_start: datetime, tz: ZoneInfo, interval_weeks: int, count: int) -> List[datetime]:
+    """Naive UTC start of every occurrence, all at the first one's local wall-clock time"""
+    if first_start.tzinfo is None:
+        first_start = first_start.replace(tzinfo=timezone.utc)
+    local = first_start.astimezone(tz).replace(tzinfo=None)
+    return [
+        (local + timedelta(weeks=interval_weeks * index)).replace(tzinfo=tz)
+        .astimezone(timezone.utc).replace(tzinfo=None)
+        for index in range(count)
+    ]
+
+
+def _series_starts(series: dict) -> List[datetime]:
+    return occurrence_starts(
+        series['firstSessionStart'], ZoneInfo(series['timezone']), series['intervalWeeks'], series['occurrences']
+    )
+
+
+def _overlapping(starts: List[Tuple[int, datetime]], duration: timedelta, booked: List[dict]) -> set:
+    """Indexes of the occurrences that overlap any of the ``booked`` sessions"""
+    return {
+        index for index, start in starts
+        if any(s['sessionDateTimeStart'] < start + duration and s['sessionDateTimeEnd'] > start for s in booked)
+    }
+
+
+def occurrence_doc(series: dict, index: int, start: datetime, now: datetime) -> dict:
+    """The session document for occurrence ``index`` of ``series``"""
+    base_rate = series['basePricePerMinuteCents']
+    price = quote(base_rate, base_rate * series['durationMinutes'], index >= series['discountFromOccurrence'])
+    return {
+        '_id': series['occurrenceIds'][index],
+        'traineeId': series['traineeId'],
+        'trainerId': series['trainerId'],
+        'status': SessionStatus.REQUESTED,
+        'sessionDateTimeStart': start,
+        'sessionDateTimeEnd': start + timedelta(minutes=series['durationMinutes']),
+        'durationMinutes': series['durationMinutes'],
+        **price,
+        'locationType': series['locationType'],
+        'locationNameOrAddress': series.get('locationNameOrAddress'),
+        'notes': series.get('notes'),
+        'paymentIntentId': None,
+        'seriesId': str(series['_id']),
+        'occurrenceIndex': index,
+        'createdAt': now,
+        'updatedAt': now,
+    }
+
+
+
+def _progress(starts: List[datetime], booked_count: int, horizon: datetime) -> dict:
+    """Update that records the first ``booked_count`` occurrences as booked"""
+    update = {'$set': {'materializedCount': booked_count, 'materializedThrough': horizon}}
+    if booked_count < len(starts):
+        update['$set']['nextOccurrenceStart'] = starts[booked_count]
+    else:
+        update['$unset'] = {'nextOccurrenceStart': ''}
+    return update
+
+
+def _due_count(starts: List[datetime], horizon: datetime) -> int:
+    return sum(1 for start in starts if start < horizon)
+
+
+async def create_series(db, fields: dict, rate_cents: int, tz: ZoneInfo) -> Tuple[dict, List[dict]]:
+    """Validate, price and store a series, booking the occurrences inside the horizon.
+
+    ``fields`` are the request fields. Raises 409 if the trainer is booked at
+    any occurrence. Returns the series and its booked session documents.
+    """
+    now = datetime.utcnow()
+    horizon = now + timedelta(days=SERIES_HORIZON_DAYS)
+    starts = occurrence_starts(fields['firstSessionStart'], tz, fields['intervalWeeks'], fields['occurrences'])
+    duration = timedelta(minutes=fields['durationMinutes'])
+
+    booked = await find_conflicts(db.sessions, fields['trainerId'], [(start, start + duration) for start in starts])
+    booked += await pending_occurrences(db.session_series, [fields['trainerId']], starts[0], starts[-1] + duration)
+    clashes = sorted(_overlapping(list(enumerate(starts)), duration, booked))
+    if clashes:
+        raise HTTPException(
+            status_code=409,
+            detail="Trainer is already booked at " + ", ".join(starts[i].isoformat() for i in clashes),
+        )
+
+    pair_counter = await load_pair_counter(db.pair_counters, fields['traineeId'], fields['trainerId'])
+
+    series = {
+        '_id': ObjectId(),
+        **fields,
+        'firstSessionStart': starts[0],
+        'timezone': tz.key,
+        'basePricePerMinuteCents': rate_cents,
+        'discountFromOccurrence': max(0, MULTI_SESSION_MIN_RECENT - pair_counter.recent(now)),
+        'occurrenceIds': [ObjectId() for _ in starts],
+        'createdAt': now,
+        'updatedAt': now,
+    }
+    due = _due_count(starts, horizon)
+    progress = _progress(starts, due, horizon)
+    series.update(progress['$set'])
+
+    # Every occurrence's slots, not only the booked ones, so later weeks cannot be taken
+    await reserve_slots(db.session_slots, fields['trainerId'], [
+        (occurrence_id, start, start + duration) for occurrence_id, start in zip(series['occurrenceIds'], starts)
+    ])
+    docs = [occurrence_doc(series, index, start, now) for index, start in enumerate(starts[:due])]
+    try:
+        if docs:
+            await db.sessions.insert_many(docs)
+        await db.session_series.insert_one(series)
+    except Exception:
+        await db.sessions.delete_many({'seriesId': str(series['_id'])})
+        await release_slots(db.session_slots, series['occurrenceIds'])
+        raise
+    if docs:
+        await record_sessions(db.pair_counters, pair_counter, len(docs), now)
+    return series, docs
+
+
+async def materialize_due(db, owner: dict, now: Optional[datetime] = None) -> List[dict]:
+    """Book the occurrences of ``owner``'s series (e.g. ``{'traineeId': ...}``) that the horizon has reached.
+
+    Returns the new session documents.
+    """
+    now = now or datetime.utcnow()
+    horizon = now + timedelta(days=SERIES_HORIZON_DAYS)
+    due_series = await db.session_series.find({**owner, 'nextOccurrenceStart': {'$lt': horizon}}).to_list(None)
+    booked = []
+    for series in due_series:
+        booked.extend(await _extend(db, series, horizon, now))
+    return booked
+
+
+async def _extend(db, series: dict, horizon: datetime, now: datetime) -> List[dict]:
+    starts = _series_starts(series)
+    first = series['materializedCount']
+    due = _due_count(starts, horizon)
+    if due <= first:
+        return []
+
+    update = _progress(starts, due, horizon)
+    update['$set']['updatedAt'] = now
+    claimed = await db.session_series.find_one_and_update(
+        {'_id': series['_id'], 'materializedCount': first}, update, return_document=ReturnDocument.AFTER
+    )
+    if claimed is None:
+        # Another request is booking these occurrences
+        return []
+
+    # The occurrences' slots were reserved when the series was created
+    docs = [occurrence_doc(series, index, start, now) for index, start in list(enumerate(starts))[first:due]]
+    await db.sessions.insert_many(docs)
+    await record_sessions(db.pair_counters, PairCounter(series['traineeId'], series['trainerId'], {}),
+                          len(docs), now)
+    return docs
+
+
+async def pending_occurrences(session_series, trainer_ids: Iterable[str], start: datetime,
+                              end: datetime) -> List[dict]:
+    """Occurrences of the trainers' series that overlap ``[start, end)`` but have no session document yet.
+
+    They are returned as the session documents they will become.
+    """
+    trainer_ids = list(trainer_ids)
+    if not trainer_ids:
+        return []
+    pending = await session_series.find(
+        {'trainerId': {'$in': trainer_ids}, 'nextOccurrenceStart': {'$lt': end}}
+    ).to_list(None)
+    found = []
+    for series in pending:
+        duration = timedelta(minutes=series['durationMinutes'])
+        first = series['materializedCount']
+        for index, occurrence_start in enumerate(_series_starts(series)[first:], start=first):
+            if occurrence_start < end and occurrence_start + duration > start:
+                found.append(occurrence_doc(series, index, occurrence_start, series['updatedAt']))
+    return found
+
+
+async def cancel_series(db, series_id: str, user_id: str, now: Optional[datetime] = None) -> dict:
+    """Stop booking the rest of a series and release the slots its unbooked occurrences hold.
+
+    Raises 404 for an unknown series, 403 unless ``user_id`` is its trainee or
+    trainer, and 409 once no occurrence is left to cancel. Returns the updated series.
+    """
+    now = now or datetime.utcnow()
+    try:
+        oid = ObjectId(series_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid series ID format")
+
+    # A concurrent materialize_due may move materializedCount between our read and our claim
+    for _ in range(3):
+        series = await db.session_series.find_one({'_id': oid})
+        if series is None:
+            raise HTTPException(status_code=404, detail="Series not found")
+        if user_id not in (series['traineeId'], series['trainerId']):
+            raise HTTPException(status_code=403, detail="Not a participant in this series")
+        if 'nextOccurrenceStart' not in series:
+            raise HTTPException(status_code=409, detail="Series has no occurrences left to cancel")
+
+        cancelled = await db.session_series.find_one_and_update(
+            {'_id': oid, 'materializedCount': series['materializedCount'], 'nextOccurrenceStart': {'$exists': True}},
+            {
+                '$unset': {'nextOccurrenceStart': ''},
+                '$set': {
+                    'cancelledAt': now,
+                    'cancelledBy': 'trainee' if user_id == series['traineeId'] else 'trainer',
+                    'updatedAt': now,
+                },
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if cancelled is not None:
+            await release_slots(db.session_slots, cancelled['occurrenceIds'][cancelled['materializedCount']:])
+            return cancelled
+    raise HTTPException(status_code=409, detail="Series is being updated, try again")
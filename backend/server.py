@@ -1,26 +1,67 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import uuid
-from datetime import datetime, timedelta
+import base64
+import binascii
+from datetime import date, datetime, timedelta, timezone
 import bcrypt
 import jwt
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from availability import (
+    InvalidTemplate, availability_fields, build_calendar, filter_available, free_slots, template_timezone,
+)
+from cache import TTLCache
+from calendar_feed import (
+    CALENDAR_MEDIA_TYPE, EVENT_FIELDS, feed_body, feed_validators, feed_window, http_date, modified_since,
+    new_token, parse_token, token_matches,
+)
+from compression import CompressionMiddleware
+from db_monitor import PoolStatsListener, RequestStatsListener, start_request_stats
+from idempotency import IdempotencyMiddleware
+from indexes import ensure_indexes
+from pricing import PairCounter, forget_session, load_pair_counter, quote, record_sessions, virtual_quote
+from profiler import ProfilerMiddleware, profiler
+from responses import (
+    REVALIDATE, FastJSONResponse, etag_matches, make_etag, model_list_response, not_modified,
+)
+from scheduling import book, release_slots, validate_duration
+from series import cancel_series, create_series, materialize_due, pending_occurrences, validate_series
+from session_state import CANCELLATION_FEE_STAGES, SessionStatus, apply_transition
+from storage import MemoryClient
+from sweeper import SessionSweeper
+from metrics import (
+    REGISTRY, HTTP_REQUESTS, HTTP_ERRORS, HTTP_LATENCY, HTTP_IN_FLIGHT,
+    DB_QUERIES_PER_REQUEST, DB_TIME_PER_REQUEST, DB_DOCS_PER_REQUEST,
+    BCRYPT_QUEUE_DEPTH, BCRYPT_ACTIVE,
+)
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Storage: MongoDB by default, or the in-process backend from storage.py for benchmarks and tests
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+if STORAGE_BACKEND == 'memory':
+    client = MemoryClient()
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[RequestStatsListener(), PoolStatsListener()])
 db = client[os.environ.get('DB_NAME', 'rapidreps_db')]
 
 # JWT Configuration
@@ -30,8 +71,43 @@ JWT_EXPIRATION_HOURS = 24
 
 security = HTTPBearer()
 
+# bcrypt is deliberately slow, so it runs on its own pool instead of the event loop
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '4'))
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+
+# Profiles are read on every trainer card and booking screen but written rarely; every write path
+# invalidates by userId, so the TTL only bounds staleness from writes made outside this API
+PROFILE_CACHE_TTL_SECONDS = float(os.environ.get('PROFILE_CACHE_TTL_SECONDS', '60'))
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '10000'))
+trainer_profile_cache = TTLCache('trainer_profiles', PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+trainee_profile_cache = TTLCache('trainee_profiles', PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+# Free-slot calendars cover FREE_SLOT_HORIZON_DAYS from today and are invalidated on every booking
+# or profile change of the trainer; the TTL lets "today" move forward
+FREE_SLOT_HORIZON_DAYS = int(os.environ.get('FREE_SLOT_HORIZON_DAYS', '28'))
+FREE_SLOT_MAX_DAYS = int(os.environ.get('FREE_SLOT_MAX_DAYS', '31'))
+FREE_SLOT_CACHE_TTL_SECONDS = float(os.environ.get('FREE_SLOT_CACHE_TTL_SECONDS', '300'))
+free_slot_cache = TTLCache('free_slots', PROFILE_CACHE_SIZE, FREE_SLOT_CACHE_TTL_SECONDS)
+# Calendar feed documents, keyed by trainer id; bumped and invalidated on every change to the
+# trainer's sessions, so unchanged feeds are revalidated without a query
+CALENDAR_FEED_CACHE_TTL_SECONDS = float(os.environ.get('CALENDAR_FEED_CACHE_TTL_SECONDS', '3600'))
+calendar_feed_cache = TTLCache('calendar_feeds', PROFILE_CACHE_SIZE, CALENDAR_FEED_CACHE_TTL_SECONDS)
+# Trainers matching the other search filters that an availableAt search checks
+AVAILABILITY_SEARCH_CANDIDATES = int(os.environ.get('AVAILABILITY_SEARCH_CANDIDATES', '5000'))
+
+# Session lists are paged by (sessionDateTimeStart, _id); the next page's cursor is sent in this header
+SESSION_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+# Newest ratings returned for a trainer
+RATINGS_PAGE_SIZE = 100
+
+# Debug mode exposes per-request DB stats as response headers
+DEBUG = os.environ.get('DEBUG', 'false').lower() == 'true'
+# Log requests that issue the same query shape more often than this (N+1 patterns)
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '10'))
+
 # Create the main app
-app = FastAPI(title="RapidReps API")
+app = FastAPI(title="RapidReps API", default_response_class=FastJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -50,14 +126,6 @@ class FitnessLevel:
     INTERMEDIATE = "intermediate"
     ADVANCED = "advanced"
 
-class SessionStatus:
-    REQUESTED = "requested"
-    CONFIRMED = "confirmed"
-    DECLINED = "declined"
-    CANCELLED = "cancelled"
-    COMPLETED = "completed"
-    NO_SHOW = "no_show"
-
 # User Models
 class UserSignUp(BaseModel):
     fullName: str
@@ -109,6 +177,30 @@ class TrainerProfileCreate(BaseModel):
     isVirtualTrainingAvailable: bool = False
     videoCallPreference: Optional[str] = "native"  # native, zoom, etc.
 
+class TrainerProfileUpdate(BaseModel):
+    """Partial update: only the fields the client sends are written. Fields the
+    profile cannot hold as null default to None but reject an explicit null."""
+    avatarUrl: Optional[str] = None
+    bio: Optional[str] = None
+    experienceYears: int = None
+    certifications: List[str] = None
+    trainingStyles: List[str] = None
+    gymsWorkedAt: List[str] = None
+    primaryGym: Optional[str] = None
+    offersInPerson: bool = None
+    offersVirtual: bool = None
+    sessionDurationsOffered: List[int] = None
+    ratePerMinuteCents: int = None
+    travelRadiusMiles: Optional[int] = None
+    cancellationPolicy: Optional[str] = None
+    availability: Optional[dict] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    locationAddress: Optional[str] = None
+    isAvailable: bool = None
+    isVirtualTrainingAvailable: bool = None
+    videoCallPreference: Optional[str] = None
+
 class TrainerProfileResponse(BaseModel):
     id: str
     userId: str
@@ -160,6 +252,25 @@ class TraineeProfileCreate(BaseModel):
     longitude: Optional[float] = None
     locationAddress: Optional[str] = None  # "City, State"
 
+class TraineeProfileUpdate(BaseModel):
+    """Partial update, as TrainerProfileUpdate"""
+    profilePhoto: Optional[str] = None
+    fitnessGoals: Optional[str] = None
+    currentFitnessLevel: str = None
+    experienceLevel: Optional[str] = None
+    preferredTrainingStyles: List[str] = None
+    injuriesOrLimitations: Optional[str] = None
+    homeGymOrZipCode: Optional[str] = None
+    prefersInPerson: bool = None
+    prefersVirtual: bool = None
+    isVirtualEnabled: bool = None
+    typicalAvailability: Optional[dict] = None
+    budgetMinPerMinuteCents: int = None
+    budgetMaxPerMinuteCents: int = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    locationAddress: Optional[str] = None
+
 class TraineeProfileResponse(BaseModel):
     id: str
     userId: str
@@ -212,6 +323,46 @@ class SessionResponse(BaseModel):
     notes: Optional[str] = None
     createdAt: datetime
 
+class SessionSeriesCreate(BaseModel):
+    traineeId: str
+    trainerId: str
+    firstSessionStart: datetime
+    durationMinutes: int
+    occurrences: int
+    intervalWeeks: int = 1
+    # Occurrences keep the first one's wall-clock time in this zone; defaults to the trainer's
+    timezone: Optional[str] = None
+    locationType: str  # "gym", "home", "virtual"
+    locationNameOrAddress: Optional[str] = None
+    notes: Optional[str] = None
+
+class SessionSeriesResponse(BaseModel):
+    id: str
+    traineeId: str
+    trainerId: str
+    firstSessionStart: datetime
+    timezone: str
+    durationMinutes: int
+    occurrences: int
+    intervalWeeks: int
+    basePricePerMinuteCents: int
+    locationType: str
+    locationNameOrAddress: Optional[str] = None
+    notes: Optional[str] = None
+    materializedCount: int
+    materializedThrough: datetime
+    # Sessions booked so far; later occurrences are booked as they come within the horizon
+    sessions: List[SessionResponse] = []
+    # Set once a participant cancels the occurrences not booked yet
+    cancelledAt: Optional[datetime] = None
+    cancelledBy: Optional[str] = None
+    createdAt: datetime
+
+class CalendarFeedResponse(BaseModel):
+    # Subscription URL; creating a new one stops the previous URL from working
+    url: str
+    createdAt: datetime
+
 # Rating Models
 class RatingCreate(BaseModel):
     sessionId: str
@@ -236,6 +387,18 @@ class VirtualSessionRequest(BaseModel):
     paymentMethod: str = "mock"  # For MVP: mock payment
     notes: Optional[str] = None
 
+class FreeSlot(BaseModel):
+    start: datetime
+    end: datetime
+
+class FreeSlotsResponse(BaseModel):
+    trainerId: str
+    timezone: str
+    startDate: date
+    endDate: date
+    # Bookable slots per offered session length in minutes
+    slots: Dict[int, List[FreeSlot]]
+
 class VirtualSessionMatchResponse(BaseModel):
     sessionId: str
     trainerId: str
@@ -311,6 +474,10 @@ class TraineeAchievements(BaseModel):
 # HELPER FUNCTIONS
 # ============================================================================
 
+def normalize_email(email: str) -> str:
+    """Emails are stored and looked up lowercased, so the unique index on users.email is case-insensitive"""
+    return email.strip().lower()
+
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -322,6 +489,20 @@ def verify_password(plain_password: str, hashed_password) -> bool:
         hashed_password = hashed_password.encode('utf-8')
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
 
+async def run_bcrypt(func, *args):
+    """Run a bcrypt helper on the bcrypt pool, tracking queue depth for metrics"""
+    BCRYPT_QUEUE_DEPTH.inc()
+
+    def job():
+        BCRYPT_QUEUE_DEPTH.dec()
+        BCRYPT_ACTIVE.inc()
+        try:
+            return func(*args)
+        finally:
+            BCRYPT_ACTIVE.dec()
+
+    return await asyncio.get_running_loop().run_in_executor(bcrypt_executor, job)
+
 def create_access_token(user_id: str, email: str) -> str:
     """Create JWT access token"""
     expiration = datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
@@ -361,6 +542,53 @@ def serialize_doc(doc: dict) -> dict:
         del doc['_id']
     return doc
 
+def profile_etag(profile: dict) -> str:
+    """Every profile write sets updatedAt, so it versions the whole document"""
+    return make_etag(profile['_id'], profile.get('updatedAt') or profile.get('createdAt'))
+
+async def load_profile(cache: TTLCache, collection, user_id: str) -> Optional[dict]:
+    """Read-through profile lookup; returns a copy, since serialize_doc mutates what it is given"""
+    profile = cache.get(user_id)
+    if profile is None:
+        version = cache.version
+        profile = await collection.find_one({'userId': user_id})
+        if profile is None:
+            return None
+        cache.set(user_id, profile, version)
+    return dict(profile)
+
+def to_naive_utc(moment: datetime) -> datetime:
+    """Sessions are stored as naive UTC; convert times that came with an offset"""
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def encode_session_cursor(session: dict) -> str:
+    key = f"{session['sessionDateTimeStart'].isoformat()}|{session['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_session_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """(sessionDateTimeStart, _id) of the last session on the previous page; 400 if malformed"""
+    try:
+        key = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        start, session_id = key.split('|')
+        return datetime.fromisoformat(start), ObjectId(session_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def availability_search_fields(availability: Optional[dict]) -> dict:
+    """Search fields precomputed from an availability template; 400 if the template is malformed"""
+    try:
+        return availability_fields(availability)
+    except InvalidTemplate as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid availability: {exc}")
+
+def ratings_etag(trainer_id: str, count: int, latest: Optional[dict]) -> str:
+    """Ratings are only ever added or deleted, so the count and the newest one identify the list"""
+    if latest is None:
+        return make_etag(trainer_id, 0)
+    return make_etag(trainer_id, count, latest['_id'], latest['createdAt'])
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two points using Haversine formula. Returns distance in miles."""
     from math import radians, sin, cos, sqrt, atan2
@@ -385,6 +613,10 @@ class ReportCreate(BaseModel):
     contentType: Optional[str] = None  # e.g., "profile", "message", "media", "session"
     contentId: Optional[str] = None
 
+class ProfileArmRequest(BaseModel):
+    pathPrefix: str  # e.g. "/api/trainers/search"
+    requests: int = 1
+
 class BlockResponse(BaseModel):
     blockedUserIds: List[str]
 
@@ -418,18 +650,15 @@ class ConversationResponse(BaseModel):
 @api_router.post("/auth/signup", response_model=TokenResponse)
 async def signup(user_data: UserSignUp):
     """Register a new user"""
-    # Check if user already exists
-    existing_user = await db.users.find_one({'email': user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+    email = normalize_email(user_data.email)
     
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_bcrypt(hash_password, user_data.password)
     
     # Create user document
     user_doc = {
         'fullName': user_data.fullName,
-        'email': user_data.email,
+        'email': email,
         'phone': user_data.phone,
         'passwordHash': hashed_password,
         'roles': user_data.roles,
@@ -438,17 +667,21 @@ async def signup(user_data: UserSignUp):
         'updatedAt': datetime.utcnow()
     }
     
-    result = await db.users.insert_one(user_doc)
+    # The unique index on email rejects duplicates, including concurrent signups
+    try:
+        result = await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     user_id = str(result.inserted_id)
     
     # Create access token
-    access_token = create_access_token(user_id, user_data.email)
+    access_token = create_access_token(user_id, email)
     
     # Return user and token
     user_response = UserResponse(
         id=user_id,
         fullName=user_data.fullName,
-        email=user_data.email,
+        email=email,
         phone=user_data.phone,
         roles=user_data.roles,
         isAdmin=False,
@@ -461,12 +694,12 @@ async def signup(user_data: UserSignUp):
 async def login(credentials: UserLogin):
     """Login user"""
     # Find user
-    user = await db.users.find_one({'email': credentials.email})
+    user = await db.users.find_one({'email': normalize_email(credentials.email)})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Verify password
-    if not verify_password(credentials.password, user['passwordHash']):
+    if not await run_bcrypt(verify_password, credentials.password, user['passwordHash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     user_id = str(user['_id'])
@@ -510,7 +743,23 @@ async def delete_me(current_user: dict = Depends(get_current_user)):
     # Delete related docs (best-effort)
     await db.trainer_profiles.delete_many({'userId': user_id})
     await db.trainee_profiles.delete_many({'userId': user_id})
-    await db.sessions.delete_many({'$or': [{'traineeId': user_id}, {'trainerId': user_id}]})
+    trainer_profile_cache.invalidate(user_id)
+    trainee_profile_cache.invalidate(user_id)
+    user_series = await db.session_series.find(
+        {'$or': [{'traineeId': user_id}, {'trainerId': user_id}]}, {'trainerId': 1, 'occurrenceIds': 1}
+    ).to_list(None)
+    await release_slots(db.session_slots, [oid for s in user_series for oid in s.get('occurrenceIds', [])])
+    await db.session_series.delete_many({'_id': {'$in': [s['_id'] for s in user_series]}})
+    await db.pair_counters.delete_many({'$or': [{'traineeId': user_id}, {'trainerId': user_id}]})
+    await db.calendar_feeds.delete_one({'_id': user_id})
+    calendar_feed_cache.invalidate(user_id)
+    sessions = await db.sessions.find(
+        {'$or': [{'traineeId': user_id}, {'trainerId': user_id}]}, {'trainerId': 1}
+    ).to_list(None)
+    session_ids = [s['_id'] for s in sessions]
+    await release_slots(db.session_slots, session_ids)
+    await db.sessions.delete_many({'_id': {'$in': session_ids}})
+    await sessions_changed({user_id} | {s['trainerId'] for s in sessions + user_series})
     await db.ratings.delete_many({'$or': [{'traineeId': user_id}, {'trainerId': user_id}]})
     await db.trainer_achievements.delete_many({'trainerId': user_id})
     await db.trainee_achievements.delete_many({'traineeId': user_id})
@@ -669,16 +918,16 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
             'isRead': False
         })
         
-        conversations.append(ConversationResponse(
-            id=str(conv['_id']),
-            participants=conv['participants'],
-            participantDetails=participant_details,
-            lastMessage=last_message,
-            unreadCount=unread_count,
-            updatedAt=conv['updatedAt']
-        ))
+        conversations.append({
+            'id': str(conv['_id']),
+            'participants': conv['participants'],
+            'participantDetails': participant_details,
+            'lastMessage': last_message,
+            'unreadCount': unread_count,
+            'updatedAt': conv['updatedAt']
+        })
     
-    return conversations
+    return model_list_response(ConversationResponse, conversations)
 
 @api_router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_messages(conversation_id: str, current_user: dict = Depends(get_current_user)):
@@ -695,15 +944,15 @@ async def get_messages(conversation_id: str, current_user: dict = Depends(get_cu
     
     messages = []
     async for msg in cursor:
-        messages.append(MessageResponse(
-            id=str(msg['_id']),
-            conversationId=msg['conversationId'],
-            senderId=msg['senderId'],
-            receiverId=msg['receiverId'],
-            content=msg['content'],
-            isRead=msg.get('isRead', False),
-            createdAt=msg['createdAt']
-        ))
+        messages.append({
+            'id': str(msg['_id']),
+            'conversationId': msg['conversationId'],
+            'senderId': msg['senderId'],
+            'receiverId': msg['receiverId'],
+            'content': msg['content'],
+            'isRead': msg.get('isRead', False),
+            'createdAt': msg['createdAt']
+        })
     
     # Mark messages as read
     await db.messages.update_many(
@@ -711,7 +960,7 @@ async def get_messages(conversation_id: str, current_user: dict = Depends(get_cu
         {'$set': {'isRead': True}}
     )
     
-    return messages
+    return model_list_response(MessageResponse, messages)
 
 @api_router.post("/conversations")
 async def get_or_create_conversation(receiver_id: str, current_user: dict = Depends(get_current_user)):
@@ -744,39 +993,61 @@ async def get_or_create_conversation(receiver_id: str, current_user: dict = Depe
 @api_router.post("/trainer-profiles", response_model=TrainerProfileResponse)
 async def create_trainer_profile(profile: TrainerProfileCreate, current_user: dict = Depends(get_current_user)):
     """Create or update trainer profile"""
-    # Check if profile already exists
-    existing_profile = await db.trainer_profiles.find_one({'userId': profile.userId})
-    
-    profile_doc = profile.dict()
-    profile_doc['averageRating'] = 0.0
-    profile_doc['totalSessionsCompleted'] = 0
-    profile_doc['isVerified'] = False
-    profile_doc['stripeAccountId'] = None
-    profile_doc['createdAt'] = datetime.utcnow()
-    profile_doc['updatedAt'] = datetime.utcnow()
-    
-    if existing_profile:
-        # Update existing
-        profile_doc['createdAt'] = existing_profile['createdAt']
-        await db.trainer_profiles.update_one(
-            {'userId': profile.userId},
-            {'$set': profile_doc}
-        )
-        profile_doc['_id'] = existing_profile['_id']
-    else:
-        # Create new
-        result = await db.trainer_profiles.insert_one(profile_doc)
-        profile_doc['_id'] = result.inserted_id
+    search_fields = availability_search_fields(profile.availability)
+    now = datetime.utcnow()
+    profile_doc = await db.trainer_profiles.find_one_and_update(
+        {'userId': profile.userId},
+        {
+            '$set': {**profile.dict(), **search_fields, 'updatedAt': now},
+            # Ratings, completed sessions and verification are maintained by their own
+            # write paths, so saving the profile again must not reset them
+            '$setOnInsert': {
+                'averageRating': 0.0,
+                'totalSessionsCompleted': 0,
+                'isVerified': False,
+                'stripeAccountId': None,
+                'createdAt': now,
+            },
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    trainer_profile_cache.invalidate(profile.userId)
+    free_slot_cache.invalidate(profile.userId)
     
     return TrainerProfileResponse(**serialize_doc(profile_doc))
 
+@api_router.patch("/trainer-profiles/me", response_model=TrainerProfileResponse)
+async def update_my_trainer_profile(update: TrainerProfileUpdate, current_user: dict = Depends(get_current_user)):
+    """Update only the given fields of the current user's trainer profile"""
+    user_id = str(current_user['_id'])
+    changes = update.dict(exclude_unset=True)
+    if 'availability' in changes:
+        changes.update(availability_search_fields(changes['availability']))
+    profile = await db.trainer_profiles.find_one_and_update(
+        {'userId': user_id},
+        {'$set': {**changes, 'updatedAt': datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not profile:
+        raise HTTPException(status_code=404, detail="Trainer profile not found")
+    trainer_profile_cache.invalidate(user_id)
+    free_slot_cache.invalidate(user_id)
+    
+    return TrainerProfileResponse(**serialize_doc(profile))
+
 @api_router.get("/trainer-profiles/{user_id}", response_model=TrainerProfileResponse)
-async def get_trainer_profile(user_id: str):
+async def get_trainer_profile(user_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get trainer profile by user ID"""
-    profile = await db.trainer_profiles.find_one({'userId': user_id})
+    profile = await load_profile(trainer_profile_cache, db.trainer_profiles, user_id)
     if not profile:
         raise HTTPException(status_code=404, detail="Trainer profile not found")
-    
+
+    etag = profile_etag(profile)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = REVALIDATE
     return TrainerProfileResponse(**serialize_doc(profile))
 
 
@@ -786,7 +1057,8 @@ async def upload_verification_documents(
     current_user: dict = Depends(get_current_user)
 ):
     """Upload verification documents for trainer profile (base64 encoded)"""
-    profile = await db.trainer_profiles.find_one({'userId': current_user['id']})
+    user_id = str(current_user['_id'])
+    profile = await db.trainer_profiles.find_one({'userId': user_id})
     
     if not profile:
         raise HTTPException(status_code=404, detail="Trainer profile not found")
@@ -796,7 +1068,7 @@ async def upload_verification_documents(
     updated_docs = existing_docs + documents
     
     result = await db.trainer_profiles.update_one(
-        {'userId': current_user['id']},
+        {'userId': user_id},
         {
             '$set': {
                 'verificationDocs': updated_docs,
@@ -804,6 +1076,7 @@ async def upload_verification_documents(
             }
         }
     )
+    trainer_profile_cache.invalidate(user_id)
     
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to upload documents")
@@ -817,7 +1090,7 @@ async def upload_verification_documents(
 @api_router.get("/trainer-profiles/my-documents")
 async def get_my_verification_documents(current_user: dict = Depends(get_current_user)):
     """Get verification documents for current trainer"""
-    profile = await db.trainer_profiles.find_one({'userId': current_user['id']})
+    profile = await db.trainer_profiles.find_one({'userId': str(current_user['_id'])})
     
     if not profile:
         raise HTTPException(status_code=404, detail="Trainer profile not found")
@@ -838,9 +1111,15 @@ async def search_trainers(
     virtual: Optional[bool] = None,
     latitude: Optional[float] = None,
     longitude: Optional[float] = None,
-    wantsVirtual: Optional[bool] = None
+    wantsVirtual: Optional[bool] = None,
+    availableAt: Optional[datetime] = None,
+    availableMinutes: int = 60
 ):
-    """Search trainers with filters - includes location and virtual matching"""
+    """Search trainers with filters - includes location and virtual matching
+    
+    With ``availableAt``, only trainers whose weekly availability covers ``availableMinutes`` from
+    that time and who have no booking then are returned.
+    """
     query = {'isAvailable': True}  # Only show available trainers
     
     if styles:
@@ -862,7 +1141,17 @@ async def search_trainers(
         query['offersVirtual'] = virtual
     
     # Get all matching trainers
-    trainers = await db.trainer_profiles.find(query).to_list(100)
+    if availableAt is None:
+        trainers = await db.trainer_profiles.find(query).to_list(100)
+    else:
+        validate_duration(availableMinutes)
+        availableAt = to_naive_utc(availableAt)
+        # Filter a wider candidate set, since many trainers will not be free at that time
+        candidates = await db.trainer_profiles.find(query).to_list(AVAILABILITY_SEARCH_CANDIDATES)
+        trainers = (await filter_available(
+            db.sessions, candidates, availableAt, availableAt + timedelta(minutes=availableMinutes),
+            db.session_series
+        ))[:100]
     
     # Filter based on location and virtual training preferences
     # Priority: In-person trainers within 15 miles, then virtual trainers within 20 miles
@@ -905,7 +1194,7 @@ async def search_trainers(
         if user:
             trainer['fullName'] = user.get('fullName', 'Unknown Trainer')
     
-    return [TrainerProfileResponse(**serialize_doc(t)) for t in filtered_trainers]
+    return model_list_response(TrainerProfileResponse, [serialize_doc(t) for t in filtered_trainers])
 
 # ============================================================================
 # TRAINEE PROFILE ROUTES
@@ -914,35 +1203,44 @@ async def search_trainers(
 @api_router.post("/trainee-profiles", response_model=TraineeProfileResponse)
 async def create_trainee_profile(profile: TraineeProfileCreate, current_user: dict = Depends(get_current_user)):
     """Create or update trainee profile"""
-    # Check if profile already exists
-    existing_profile = await db.trainee_profiles.find_one({'userId': profile.userId})
-    
-    profile_doc = profile.dict()
-    profile_doc['createdAt'] = datetime.utcnow()
-    profile_doc['updatedAt'] = datetime.utcnow()
-    
-    if existing_profile:
-        # Update existing
-        profile_doc['createdAt'] = existing_profile['createdAt']
-        await db.trainee_profiles.update_one(
-            {'userId': profile.userId},
-            {'$set': profile_doc}
-        )
-        profile_doc['_id'] = existing_profile['_id']
-    else:
-        # Create new
-        result = await db.trainee_profiles.insert_one(profile_doc)
-        profile_doc['_id'] = result.inserted_id
+    now = datetime.utcnow()
+    profile_doc = await db.trainee_profiles.find_one_and_update(
+        {'userId': profile.userId},
+        {'$set': {**profile.dict(), 'updatedAt': now}, '$setOnInsert': {'createdAt': now}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    trainee_profile_cache.invalidate(profile.userId)
     
     return TraineeProfileResponse(**serialize_doc(profile_doc))
 
+@api_router.patch("/trainee-profiles/me", response_model=TraineeProfileResponse)
+async def update_my_trainee_profile(update: TraineeProfileUpdate, current_user: dict = Depends(get_current_user)):
+    """Update only the given fields of the current user's trainee profile"""
+    user_id = str(current_user['_id'])
+    profile = await db.trainee_profiles.find_one_and_update(
+        {'userId': user_id},
+        {'$set': {**update.dict(exclude_unset=True), 'updatedAt': datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not profile:
+        raise HTTPException(status_code=404, detail="Trainee profile not found")
+    trainee_profile_cache.invalidate(user_id)
+    
+    return TraineeProfileResponse(**serialize_doc(profile))
+
 @api_router.get("/trainee-profiles/{user_id}", response_model=TraineeProfileResponse)
-async def get_trainee_profile(user_id: str):
+async def get_trainee_profile(user_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get trainee profile by user ID"""
-    profile = await db.trainee_profiles.find_one({'userId': user_id})
+    profile = await load_profile(trainee_profile_cache, db.trainee_profiles, user_id)
     if not profile:
         raise HTTPException(status_code=404, detail="Trainee profile not found")
-    
+
+    etag = profile_etag(profile)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = REVALIDATE
     return TraineeProfileResponse(**serialize_doc(profile))
 
 @api_router.get("/trainers/nearby-trainees")
@@ -994,8 +1292,9 @@ async def get_nearby_trainees(current_user: dict = Depends(get_current_user)):
 @api_router.patch("/trainer-profiles/toggle-availability")
 async def toggle_trainer_availability(isAvailable: bool, current_user: dict = Depends(get_current_user)):
     """Toggle trainer availability (online/offline)"""
+    user_id = str(current_user['_id'])
     result = await db.trainer_profiles.update_one(
-        {'userId': str(current_user['_id'])},
+        {'userId': user_id},
         {
             '$set': {
                 'isAvailable': isAvailable,
@@ -1003,6 +1302,7 @@ async def toggle_trainer_availability(isAvailable: bool, current_user: dict = De
             }
         }
     )
+    trainer_profile_cache.invalidate(user_id)
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Trainer profile not found")
@@ -1017,64 +1317,97 @@ async def toggle_trainer_availability(isAvailable: bool, current_user: dict = De
 # SESSION ROUTES
 # ============================================================================
 
+async def sessions_changed(trainer_ids):
+    """Drop the free-slot calendars and move the calendar feeds of trainers whose sessions changed"""
+    trainer_ids = list(set(trainer_ids))
+    await db.calendar_feeds.update_many(
+        {'_id': {'$in': trainer_ids}}, {'$set': {'sessionsChangedAt': datetime.utcnow()}}
+    )
+    for trainer_id in trainer_ids:
+        free_slot_cache.invalidate(trainer_id)
+        calendar_feed_cache.invalidate(trainer_id)
+
 @api_router.post("/sessions", response_model=SessionResponse)
 async def create_session(session: SessionCreate, current_user: dict = Depends(get_current_user)):
     """Create a new session booking"""
-    # Get trainer profile to get rate
-    trainer_profile = await db.trainer_profiles.find_one({'userId': session.trainerId})
+    validate_duration(session.durationMinutes)
+    
+    trainer_profile = await load_profile(trainer_profile_cache, db.trainer_profiles, session.trainerId)
     if not trainer_profile:
         raise HTTPException(status_code=404, detail="Trainer not found")
     
+    now = datetime.utcnow()
     base_rate = trainer_profile['ratePerMinuteCents']
-    base_price = base_rate * session.durationMinutes
+    pair_counter = await load_pair_counter(db.pair_counters, session.traineeId, session.trainerId)
+    price = quote(base_rate, base_rate * session.durationMinutes, pair_counter.discounted(now))
     
-    # Check for multi-session discount (3+ sessions in last 30 days)
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_sessions = await db.sessions.count_documents({
-        'traineeId': session.traineeId,
-        'trainerId': session.trainerId,
-        'createdAt': {'$gte': thirty_days_ago},
-        'status': {'$ne': SessionStatus.DECLINED}
-    })
-    
-    discount_amount = 0
-    discount_type = None
-    if recent_sessions >= 2:  # This will be the 3rd session
-        discount_amount = int(base_price * 0.05)  # 5% discount
-        discount_type = "multi_session"
-    
-    final_price = base_price - discount_amount
-    platform_fee = int(final_price * 0.10)  # 10% platform fee
-    trainer_earnings = final_price - platform_fee
+    session_id = ObjectId()
+    session_start = to_naive_utc(session.sessionDateTimeStart)
+    session_end = session_start + timedelta(minutes=session.durationMinutes)
+    await book(db, session.trainerId, [(session_id, session_start, session_end)])
     
     session_doc = {
+        '_id': session_id,
         'traineeId': session.traineeId,
         'trainerId': session.trainerId,
         'status': SessionStatus.REQUESTED,
-        'sessionDateTimeStart': session.sessionDateTimeStart,
-        'sessionDateTimeEnd': session.sessionDateTimeStart + timedelta(minutes=session.durationMinutes),
+        'sessionDateTimeStart': session_start,
+        'sessionDateTimeEnd': session_end,
         'durationMinutes': session.durationMinutes,
-        'basePricePerMinuteCents': base_rate,
-        'baseSessionPriceCents': base_price,
-        'discountType': discount_type,
-        'discountAmountCents': discount_amount,
-        'finalSessionPriceCents': final_price,
-        'platformFeePercent': 10,
-        'platformFeeCents': platform_fee,
-        'trainerEarningsCents': trainer_earnings,
+        **price,
         'locationType': session.locationType,
         'locationNameOrAddress': session.locationNameOrAddress,
         'notes': session.notes,
         'paymentIntentId': None,
-        'createdAt': datetime.utcnow(),
-        'updatedAt': datetime.utcnow()
+        'createdAt': now,
+        'updatedAt': now
     }
     
-    result = await db.sessions.insert_one(session_doc)
-    session_doc['_id'] = result.inserted_id
+    try:
+        await db.sessions.insert_one(session_doc)
+    except Exception:
+        await release_slots(db.session_slots, [session_id])
+        raise
+    await record_sessions(db.pair_counters, pair_counter, now=now)
+    await sessions_changed([session.trainerId])
     
     return SessionResponse(**serialize_doc(session_doc))
 
+@api_router.post("/session-series", response_model=SessionSeriesResponse)
+async def create_session_series(series: SessionSeriesCreate, current_user: dict = Depends(get_current_user)):
+    """Book the same slot every week (or every few weeks) in one request"""
+    validate_duration(series.durationMinutes)
+    validate_series(series.occurrences, series.intervalWeeks)
+
+    trainer_profile = await load_profile(trainer_profile_cache, db.trainer_profiles, series.trainerId)
+    if not trainer_profile:
+        raise HTTPException(status_code=404, detail="Trainer not found")
+    try:
+        tz = template_timezone({'timezone': series.timezone or trainer_profile.get('availabilityTimezone')})
+    except InvalidTemplate as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    fields = series.dict(exclude={'timezone'})
+    series_doc, session_docs = await create_series(db, fields, trainer_profile['ratePerMinuteCents'], tz)
+    await sessions_changed([series.trainerId])
+
+    sessions = [SessionResponse(**serialize_doc(doc)) for doc in session_docs]
+    return SessionSeriesResponse(**serialize_doc(series_doc), sessions=sessions)
+
+@api_router.patch("/session-series/{series_id}/cancel", response_model=SessionSeriesResponse)
+async def cancel_session_series(series_id: str, current_user: dict = Depends(get_current_user)):
+    """Trainee or trainer stops a series; occurrences already booked are cancelled one by one"""
+    series_doc = await cancel_series(db, series_id, str(current_user['_id']))
+    await sessions_changed([series_doc['trainerId']])
+    return SessionSeriesResponse(**serialize_doc(series_doc))
+
+async def materialize_series(owner: dict) -> List[dict]:
+    """Book series occurrences that have come within the horizon before listing sessions"""
+    booked = await materialize_due(db, owner)
+    if booked:
+        await sessions_changed(doc['trainerId'] for doc in booked)
+    return booked
+
 @api_router.get("/sessions/{session_id}", response_model=SessionResponse)
 async def get_session(session_id: str):
     """Get session by ID"""
@@ -1089,71 +1422,81 @@ async def get_session(session_id: str):
     
     return SessionResponse(**serialize_doc(session))
 
+async def list_sessions(owner: dict, status: Optional[str], start_from: Optional[datetime],
+                        start_to: Optional[datetime], cursor: Optional[str], limit: int) -> Response:
+    """One page of a participant's sessions, newest first, with the next page's cursor in a header"""
+    await materialize_series(owner)
+    query = dict(owner)
+    if status:
+        query['status'] = status
+    
+    start_range = {}
+    if start_from is not None:
+        start_range['$gte'] = to_naive_utc(start_from)
+    if start_to is not None:
+        start_range['$lt'] = to_naive_utc(start_to)
+    if cursor:
+        # Keyset: strictly after the previous page's last (start, _id) in descending order
+        last_start, last_id = decode_session_cursor(cursor)
+        start_range['$lte'] = last_start
+        query['$or'] = [{'sessionDateTimeStart': {'$lt': last_start}}, {'_id': {'$lt': last_id}}]
+    if start_range:
+        query['sessionDateTimeStart'] = start_range
+    
+    sessions = await db.sessions.find(query).sort(
+        [('sessionDateTimeStart', -1), ('_id', -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_session_cursor(sessions[-1])
+    return model_list_response(SessionResponse, [serialize_doc(s) for s in sessions], headers=headers)
+
 @api_router.get("/trainer/sessions", response_model=List[SessionResponse])
 async def get_trainer_sessions(
     status: Optional[str] = None,
+    start_from: Optional[datetime] = Query(None, alias='from'),
+    start_to: Optional[datetime] = Query(None, alias='to'),
+    cursor: Optional[str] = None,
+    limit: int = Query(SESSION_PAGE_SIZE, ge=1, le=SESSION_PAGE_SIZE),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get sessions for a trainer"""
-    user_id = str(current_user['_id'])
-    query = {'trainerId': user_id}
+    """Get sessions for a trainer, newest first.
     
-    if status:
-        query['status'] = status
-    
-    sessions = await db.sessions.find(query).sort('sessionDateTimeStart', -1).to_list(100)
-    return [SessionResponse(**serialize_doc(s)) for s in sessions]
+    ``from`` (inclusive) and ``to`` (exclusive) bound the session start. Pass the
+    X-Next-Cursor header of a response as ``cursor`` to get the next page.
+    """
+    owner = {'trainerId': str(current_user['_id'])}
+    return await list_sessions(owner, status, start_from, start_to, cursor, limit)
 
 @api_router.get("/trainee/sessions", response_model=List[SessionResponse])
 async def get_trainee_sessions(
     status: Optional[str] = None,
+    start_from: Optional[datetime] = Query(None, alias='from'),
+    start_to: Optional[datetime] = Query(None, alias='to'),
+    cursor: Optional[str] = None,
+    limit: int = Query(SESSION_PAGE_SIZE, ge=1, le=SESSION_PAGE_SIZE),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get sessions for a trainee"""
-    user_id = str(current_user['_id'])
-    query = {'traineeId': user_id}
-    
-    if status:
-        query['status'] = status
-    
-    sessions = await db.sessions.find(query).sort('sessionDateTimeStart', -1).to_list(100)
-    return [SessionResponse(**serialize_doc(s)) for s in sessions]
+    """Get sessions for a trainee, newest first; paged like /trainer/sessions"""
+    owner = {'traineeId': str(current_user['_id'])}
+    return await list_sessions(owner, status, start_from, start_to, cursor, limit)
 
 @api_router.patch("/sessions/{session_id}/accept", response_model=SessionResponse)
 async def accept_session(session_id: str, current_user: dict = Depends(get_current_user)):
     """Trainer accepts a session request"""
-    session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if session['trainerId'] != str(current_user['_id']):
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    await db.sessions.update_one(
-        {'_id': ObjectId(session_id)},
-        {'$set': {'status': SessionStatus.CONFIRMED, 'updatedAt': datetime.utcnow()}}
-    )
-    
-    updated_session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    return SessionResponse(**serialize_doc(updated_session))
+    session = await apply_transition(db.sessions, session_id, 'accept', str(current_user['_id']))
+    await sessions_changed([session['trainerId']])
+    return SessionResponse(**serialize_doc(session))
 
 @api_router.patch("/sessions/{session_id}/decline", response_model=SessionResponse)
 async def decline_session(session_id: str, current_user: dict = Depends(get_current_user)):
     """Trainer declines a session request"""
-    session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if session['trainerId'] != str(current_user['_id']):
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    await db.sessions.update_one(
-        {'_id': ObjectId(session_id)},
-        {'$set': {'status': SessionStatus.DECLINED, 'updatedAt': datetime.utcnow()}}
-    )
-    
-    updated_session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    return SessionResponse(**serialize_doc(updated_session))
+    session = await apply_transition(db.sessions, session_id, 'decline', str(current_user['_id']))
+    await release_slots(db.session_slots, [session['_id']])
+    await forget_session(db.pair_counters, session)
+    await sessions_changed([session['trainerId']])
+    return SessionResponse(**serialize_doc(session))
 
 @api_router.patch("/sessions/{session_id}/cancel")
 async def cancel_session(session_id: str, current_user: dict = Depends(get_current_user)):
@@ -1161,66 +1504,22 @@ async def cancel_session(session_id: str, current_user: dict = Depends(get_curre
     
     Cancellation Policy:
     - If status is REQUESTED (pending): Full refund, no fee
-    - If status is ACCEPTED: 20% cancellation fee charged, 80% refund
-    - If status is IN_PROGRESS or COMPLETED: Cannot cancel
+    - If status is CONFIRMED: 20% cancellation fee charged, 80% refund
+    - Otherwise (declined, cancelled, completed, no-show): Cannot cancel
     """
-    session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Verify it's the trainee's session
-    if session['traineeId'] != str(current_user['_id']):
-        raise HTTPException(status_code=403, detail="Not authorized to cancel this session")
-    
-    # Check session status
-    current_status = session.get('status')
-    
-    if current_status in [SessionStatus.COMPLETED, SessionStatus.IN_PROGRESS]:
-        raise HTTPException(
-            status_code=400, 
-            detail="Cannot cancel session that is in progress or completed"
-        )
-    
-    if current_status == SessionStatus.CANCELLED:
-        raise HTTPException(status_code=400, detail="Session already cancelled")
-    
-    if current_status == SessionStatus.DECLINED:
-        raise HTTPException(status_code=400, detail="Session was already declined by trainer")
-    
-    # Calculate cancellation fee
-    cancellation_fee_cents = 0
-    refund_amount_cents = 0
-    
-    if current_status == SessionStatus.ACCEPTED:
-        # 20% cancellation fee if trainer already accepted
-        final_price = session.get('finalSessionPriceCents', 0)
-        cancellation_fee_cents = int(final_price * 0.20)
-        refund_amount_cents = final_price - cancellation_fee_cents
-    elif current_status == SessionStatus.REQUESTED:
-        # No fee if still pending
-        refund_amount_cents = session.get('finalSessionPriceCents', 0)
-        cancellation_fee_cents = 0
-    
-    # Update session status
-    await db.sessions.update_one(
-        {'_id': ObjectId(session_id)},
-        {
-            '$set': {
-                'status': SessionStatus.CANCELLED,
-                'updatedAt': datetime.utcnow(),
-                'cancelledAt': datetime.utcnow(),
-                'cancelledBy': 'trainee',
-                'cancellationFeeCents': cancellation_fee_cents,
-                'refundAmountCents': refund_amount_cents
-            }
-        }
+    session = await apply_transition(
+        db.sessions, session_id, 'cancel', str(current_user['_id']),
+        stages=CANCELLATION_FEE_STAGES,
+        fields={'cancelledAt': datetime.utcnow(), 'cancelledBy': 'trainee'}
     )
-    
-    updated_session = await db.sessions.find_one({'_id': ObjectId(session_id)})
+    await release_slots(db.session_slots, [session['_id']])
+    await sessions_changed([session['trainerId']])
+    cancellation_fee_cents = session['cancellationFeeCents']
+    refund_amount_cents = session['refundAmountCents']
     
     return {
         'success': True,
-        'session': SessionResponse(**serialize_doc(updated_session)),
+        'session': SessionResponse(**serialize_doc(session)),
         'cancellationFeeCents': cancellation_fee_cents,
         'refundAmountCents': refund_amount_cents,
         'message': f'Session cancelled. {"No cancellation fee." if cancellation_fee_cents == 0 else f"Cancellation fee: ${cancellation_fee_cents/100:.2f}. Refund: ${refund_amount_cents/100:.2f}"}'
@@ -1228,24 +1527,130 @@ async def cancel_session(session_id: str, current_user: dict = Depends(get_curre
 
 @api_router.patch("/sessions/{session_id}/complete", response_model=SessionResponse)
 async def complete_session(session_id: str, current_user: dict = Depends(get_current_user)):
-    """Mark session as completed"""
-    session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    await db.sessions.update_one(
-        {'_id': ObjectId(session_id)},
-        {'$set': {'status': SessionStatus.COMPLETED, 'updatedAt': datetime.utcnow()}}
-    )
+    """Mark session as completed (either participant)"""
+    session = await apply_transition(db.sessions, session_id, 'complete', str(current_user['_id']))
     
-    # Update trainer stats
+    # Only the request whose transition matched gets here, so stats move exactly once
     await db.trainer_profiles.update_one(
         {'userId': session['trainerId']},
-        {'$inc': {'totalSessionsCompleted': 1}}
+        {'$inc': {'totalSessionsCompleted': 1}, '$set': {'updatedAt': datetime.utcnow()}}
+    )
+    trainer_profile_cache.invalidate(session['trainerId'])
+    await sessions_changed([session['trainerId']])
+    
+    return SessionResponse(**serialize_doc(session))
+
+@api_router.get("/trainers/{trainer_id}/free-slots", response_model=FreeSlotsResponse)
+async def get_trainer_free_slots(
+    trainer_id: str,
+    start_date: Optional[date] = Query(None, alias='from'),
+    end_date: Optional[date] = Query(None, alias='to')
+):
+    """Free bookable slots for each session length the trainer offers.
+    
+    ``from`` and ``to`` are inclusive dates in the trainer's time zone (default: the next 7 days).
+    """
+    profile = await load_profile(trainer_profile_cache, db.trainer_profiles, trainer_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Trainer profile not found")
+    availability = profile.get('availability')
+    try:
+        today = datetime.now(template_timezone(availability)).date()
+    except InvalidTemplate:
+        raise HTTPException(status_code=409, detail="Trainer availability is not set up correctly")
+    
+    start_date = start_date or today
+    end_date = end_date or start_date + timedelta(days=6)
+    if end_date < start_date or (end_date - start_date).days >= FREE_SLOT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must span 1 to {FREE_SLOT_MAX_DAYS} days")
+    
+    calendar = free_slot_cache.get(trainer_id)
+    window = calendar.window(start_date, end_date) if calendar else None
+    if window is None:
+        horizon_end = today + timedelta(days=FREE_SLOT_HORIZON_DAYS - 1)
+        if today <= start_date and end_date <= horizon_end:
+            version = free_slot_cache.version
+            calendar = await build_calendar(db.sessions, trainer_id, availability, today, FREE_SLOT_HORIZON_DAYS,
+                                            db.session_series)
+            free_slot_cache.set(trainer_id, calendar, version)
+            window = calendar.window(start_date, end_date)
+        else:
+            window = await build_calendar(db.sessions, trainer_id, availability, start_date,
+                                          (end_date - start_date).days + 1, db.session_series)
+    
+    slots = free_slots(window, profile.get('sessionDurationsOffered') or [], datetime.utcnow())
+    return FreeSlotsResponse(
+        trainerId=trainer_id,
+        timezone=window.timezone,
+        startDate=start_date,
+        endDate=end_date,
+        slots={duration: [FreeSlot(start=start, end=end) for start, end in found]
+               for duration, found in slots.items()}
     )
+
+# ============================================================================
+# CALENDAR FEED ROUTES
+# ============================================================================
+
+async def load_calendar_feed(trainer_id: str) -> Optional[dict]:
+    feed = calendar_feed_cache.get(trainer_id)
+    if feed is None:
+        version = calendar_feed_cache.version
+        feed = await db.calendar_feeds.find_one({'_id': trainer_id})
+        if feed is not None:
+            calendar_feed_cache.set(trainer_id, feed, version)
+    return feed
+
+@api_router.post("/trainer/calendar-feed", response_model=CalendarFeedResponse)
+async def create_calendar_feed(request: Request, current_user: dict = Depends(get_current_user)):
+    """Create the trainer's private iCalendar subscription URL, replacing any previous one"""
+    if UserRole.TRAINER not in current_user.get('roles', []):
+        raise HTTPException(status_code=403, detail="Trainer access required")
     
-    updated_session = await db.sessions.find_one({'_id': ObjectId(session_id)})
-    return SessionResponse(**serialize_doc(updated_session))
+    trainer_id = str(current_user['_id'])
+    token, token_hash = new_token(trainer_id)
+    now = datetime.utcnow()
+    await db.calendar_feeds.update_one(
+        {'_id': trainer_id},
+        {'$set': {'tokenHash': token_hash, 'createdAt': now, 'sessionsChangedAt': now}},
+        upsert=True
+    )
+    calendar_feed_cache.invalidate(trainer_id)
+    return CalendarFeedResponse(url=str(request.url_for('get_calendar_feed', token=token)), createdAt=now)
+
+@api_router.get("/calendar/{token}.ics", response_class=StreamingResponse)
+async def get_calendar_feed(
+    token: str,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None)
+):
+    """The trainer's sessions as iCalendar, answering unchanged polls with 304"""
+    parsed = parse_token(token)
+    feed = await load_calendar_feed(parsed[0]) if parsed else None
+    if feed is None or not token_matches(feed, parsed[1]):
+        raise HTTPException(status_code=404, detail="Calendar feed not found")
+    # Booking occurrences the horizon has reached moves sessionsChangedAt, so reload the feed after
+    if await materialize_series({'trainerId': feed['_id']}):
+        feed = await load_calendar_feed(feed['_id'])
+    
+    now = datetime.utcnow()
+    etag, last_modified = feed_validators(feed, now.date())
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': REVALIDATE}
+    # If-Modified-Since only counts when the client sent no ETag
+    if etag_matches(if_none_match, etag) or (
+        if_none_match is None and not modified_since(if_modified_since, last_modified)
+    ):
+        response = not_modified(etag)
+        response.headers['Last-Modified'] = headers['Last-Modified']
+        return response
+    
+    start_from, start_to = feed_window(now.date())
+    sessions = db.sessions.find(
+        {'trainerId': feed['_id'], 'sessionDateTimeStart': {'$gte': start_from, '$lt': start_to}},
+        EVENT_FIELDS
+    ).sort([('sessionDateTimeStart', 1), ('_id', 1)])
+    pending = await pending_occurrences(db.session_series, [feed['_id']], start_from, start_to)
+    return StreamingResponse(feed_body(sessions, now, pending), media_type=CALENDAR_MEDIA_TYPE, headers=headers)
 
 # ============================================================================
 # VIRTUAL SESSION ROUTES
@@ -1279,40 +1684,47 @@ async def request_virtual_session(
         reverse=True
     )
     
-    # Select the best available trainer
-    selected_trainer = available_trainers[0]
-    trainer_user = await db.users.find_one({'_id': ObjectId(selected_trainer['userId'])})
-    
-    if not trainer_user:
-        raise HTTPException(status_code=404, detail="Trainer user not found")
-    
-    # Calculate pricing (fixed $18 for 30 min virtual session for MVP)
-    base_price = 1800  # $18.00 in cents
-    platform_fee = int(base_price * 0.10)  # 10% platform fee
-    trainer_earnings = base_price - platform_fee
+    validate_duration(request.durationMinutes)
     
     # Create session starting immediately
+    session_id = ObjectId()
     session_start = datetime.utcnow()
     session_end = session_start + timedelta(minutes=request.durationMinutes)
     
+    # Select the best available trainer who is not already in a session
+    selected_trainer = None
+    for trainer in available_trainers:
+        try:
+            await book(db, trainer['userId'], [(session_id, session_start, session_end)])
+        except HTTPException as exc:
+            if exc.status_code == 409:
+                continue
+            raise
+        selected_trainer = trainer
+        break
+    if selected_trainer is None:
+        raise HTTPException(
+            status_code=404,
+            detail="No virtual trainers available at the moment. Please try again later."
+        )
+    trainer_user = await db.users.find_one({'_id': ObjectId(selected_trainer['userId'])})
+    
+    if not trainer_user:
+        await release_slots(db.session_slots, [session_id])
+        raise HTTPException(status_code=404, detail="Trainer user not found")
+    
     # Mock payment processing (for MVP)
     payment_status = "completed"  # Mock successful payment
     
     session_doc = {
+        '_id': session_id,
         'traineeId': request.traineeId,
         'trainerId': selected_trainer['userId'],
         'status': SessionStatus.CONFIRMED,  # Auto-confirm for virtual sessions
         'sessionDateTimeStart': session_start,
         'sessionDateTimeEnd': session_end,
         'durationMinutes': request.durationMinutes,
-        'basePricePerMinuteCents': 60,  # $0.60/min for $18/30min
-        'baseSessionPriceCents': base_price,
-        'discountType': None,
-        'discountAmountCents': 0,
-        'finalSessionPriceCents': base_price,
-        'platformFeePercent': 10,
-        'platformFeeCents': platform_fee,
-        'trainerEarningsCents': trainer_earnings,
+        **virtual_quote(),  # flat price for MVP
         'locationType': 'virtual',
         'locationNameOrAddress': 'Zoom Video Call',
         'notes': request.notes,
@@ -1324,12 +1736,18 @@ async def request_virtual_session(
         'updatedAt': datetime.utcnow()
     }
     
-    result = await db.sessions.insert_one(session_doc)
-    session_id = str(result.inserted_id)
+    try:
+        await db.sessions.insert_one(session_doc)
+    except Exception:
+        await release_slots(db.session_slots, [session_id])
+        raise
+    # Virtual sessions are never discounted, so the counter is not read; stale buckets wait for the next booking
+    await record_sessions(db.pair_counters, PairCounter(request.traineeId, selected_trainer['userId'], {}))
+    await sessions_changed([selected_trainer['userId']])
     
     # Return match response
     return VirtualSessionMatchResponse(
-        sessionId=session_id,
+        sessionId=str(session_id),
         trainerId=selected_trainer['userId'],
         trainerName=trainer_user.get('fullName', 'Trainer'),
         trainerBio=selected_trainer.get('bio'),
@@ -1337,7 +1755,7 @@ async def request_virtual_session(
         sessionDateTimeStart=session_start,
         sessionDateTimeEnd=session_end,
         durationMinutes=request.durationMinutes,
-        finalSessionPriceCents=base_price,
+        finalSessionPriceCents=session_doc['finalSessionPriceCents'],
         zoomMeetingLink=selected_trainer.get('zoomMeetingLink', 'https://zoom.us/j/placeholder'),
         status=SessionStatus.CONFIRMED
     )
@@ -1374,16 +1792,33 @@ async def create_rating(rating: RatingCreate, current_user: dict = Depends(get_c
         avg_rating = sum(r['rating'] for r in all_ratings) / len(all_ratings)
         await db.trainer_profiles.update_one(
             {'userId': rating.trainerId},
-            {'$set': {'averageRating': round(avg_rating, 2)}}
+            {'$set': {'averageRating': round(avg_rating, 2), 'updatedAt': datetime.utcnow()}}
         )
+        trainer_profile_cache.invalidate(rating.trainerId)
     
     return RatingResponse(**serialize_doc(rating_doc))
 
 @api_router.get("/trainers/{trainer_id}/ratings", response_model=List[RatingResponse])
-async def get_trainer_ratings(trainer_id: str):
+async def get_trainer_ratings(trainer_id: str, if_none_match: Optional[str] = Header(None)):
     """Get all ratings for a trainer"""
-    ratings = await db.ratings.find({'trainerId': trainer_id}).sort('createdAt', -1).to_list(100)
-    return [RatingResponse(**serialize_doc(r)) for r in ratings]
+    count = None
+    if if_none_match:
+        count = await db.ratings.count_documents({'trainerId': trainer_id})
+        latest = await db.ratings.find_one(
+            {'trainerId': trainer_id}, {'_id': 1, 'createdAt': 1}, sort=[('createdAt', -1)]
+        )
+        etag = ratings_etag(trainer_id, count, latest)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    ratings = await db.ratings.find({'trainerId': trainer_id}).sort('createdAt', -1).to_list(RATINGS_PAGE_SIZE)
+    if count is None:
+        # A page short of the cap holds every rating, so only a full page needs counting
+        count = len(ratings) if len(ratings) < RATINGS_PAGE_SIZE else \
+            await db.ratings.count_documents({'trainerId': trainer_id})
+    etag = ratings_etag(trainer_id, count, ratings[0] if ratings else None)
+    return model_list_response(RatingResponse, [serialize_doc(r) for r in ratings],
+                               headers={'ETag': etag, 'Cache-Control': REVALIDATE})
 
 # ============================================================================
 # TRAINER EARNINGS
@@ -1433,8 +1868,9 @@ async def get_all_trainers(current_user: dict = Depends(get_current_user)):
     if not current_user.get('isAdmin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    trainers = await db.trainer_profiles.find().to_list(1000)
-    return [serialize_doc(t) for t in trainers]
+    # The availability search mask is binary and internal
+    trainers = await db.trainer_profiles.find({}, {'availabilityMask': 0}).to_list(1000)
+    return FastJSONResponse([serialize_doc(t) for t in trainers])
 
 @api_router.patch("/admin/trainers/{trainer_id}/verify")
 async def verify_trainer(trainer_id: str, verified: bool, current_user: dict = Depends(get_current_user)):
@@ -1442,13 +1878,16 @@ async def verify_trainer(trainer_id: str, verified: bool, current_user: dict = D
     if not current_user.get('isAdmin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.trainer_profiles.update_one(
+    # The cache is keyed by userId, which only the profile document knows
+    profile = await db.trainer_profiles.find_one_and_update(
         {'_id': ObjectId(trainer_id)},
-        {'$set': {'isVerified': verified, 'updatedAt': datetime.utcnow()}}
+        {'$set': {'isVerified': verified, 'updatedAt': datetime.utcnow()}},
+        projection={'userId': 1}
     )
     
-    if result.modified_count == 0:
+    if profile is None:
         raise HTTPException(status_code=404, detail="Trainer not found")
+    trainer_profile_cache.invalidate(profile['userId'])
     
     return {'success': True, 'verified': verified}
 
@@ -1459,7 +1898,7 @@ async def get_all_sessions(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin access required")
     
     sessions = await db.sessions.find().sort('createdAt', -1).to_list(1000)
-    return [serialize_doc(s) for s in sessions]
+    return FastJSONResponse([serialize_doc(s) for s in sessions])
 
 @api_router.get("/admin/revenue")
 async def get_platform_revenue(current_user: dict = Depends(get_current_user)):
@@ -1481,6 +1920,49 @@ async def get_platform_revenue(current_user: dict = Depends(get_current_user)):
         'averageSessionValueCents': total_session_value // len(completed_sessions) if completed_sessions else 0
     }
 
+@api_router.post("/admin/profile")
+async def arm_profiler(arm: ProfileArmRequest, current_user: dict = Depends(get_current_user)):
+    """Admin: Profile the next N requests whose path starts with a prefix"""
+    if not current_user.get('isAdmin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    profiler.arm(arm.pathPrefix, arm.requests)
+    return {'success': True, 'armed': dict(profiler.armed)}
+
+@api_router.delete("/admin/profile")
+async def disarm_profiler(current_user: dict = Depends(get_current_user)):
+    """Admin: Stop profiling requests that have not started yet"""
+    if not current_user.get('isAdmin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    profiler.disarm()
+    return {'success': True}
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: dict = Depends(get_current_user)):
+    """Admin: List recorded request profiles, newest first"""
+    if not current_user.get('isAdmin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        'armed': dict(profiler.armed),
+        'profiles': [r.summary() for r in reversed(profiler.results)]
+    }
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = 'collapsed', current_user: dict = Depends(get_current_user)):
+    """Admin: Download a profile as collapsed stacks or speedscope JSON"""
+    if not current_user.get('isAdmin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    result = profiler.get(profile_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    if format == 'speedscope':
+        return JSONResponse(result.speedscope())
+    return PlainTextResponse(result.collapsed())
+
 
 # ============================================================================
 # TRAINER ACHIEVEMENTS & BADGES SYSTEM
@@ -2034,12 +2516,68 @@ async def health_check():
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+def _route_label(request: Request) -> str:
+    """Route template for metric labels; unmatched paths share one label to bound cardinality"""
+    route = request.scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+# Pure ASGI and added before observe_request, so it runs inside the handler's task
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Record latency, status and DB usage per route, and flag N+1 query patterns"""
+    stats = start_request_stats()
+    started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+    except Exception:
+        route = _route_label(request)
+        HTTP_ERRORS.inc(request.method, route)
+        HTTP_REQUESTS.inc(request.method, route, '500')
+        raise
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - started
+
+    route = _route_label(request)
+    HTTP_LATENCY.observe(elapsed, request.method, route)
+    HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+    if response.status_code >= 500:
+        HTTP_ERRORS.inc(request.method, route)
+    DB_QUERIES_PER_REQUEST.observe(stats.round_trips, route)
+    DB_TIME_PER_REQUEST.observe(stats.total_ms / 1000, route)
+    DB_DOCS_PER_REQUEST.observe(stats.docs_returned, route)
+
+    for shape, count in stats.repeated_shapes(N_PLUS_ONE_THRESHOLD):
+        logger.warning(f"Possible N+1 query on {request.method} {route}: {count}x {shape}")
+
+    if DEBUG:
+        response.headers['X-DB-Queries'] = str(stats.round_trips)
+        response.headers['X-DB-Time-Ms'] = f"{stats.total_ms:.1f}"
+        response.headers['X-DB-Docs-Returned'] = str(stats.docs_returned)
+    return response
+
+# Outside observe_request, so replayed responses are not counted as handled again; inside
+# compression, so stored bodies are uncompressed and each replay is encoded for its own client
+app.add_middleware(IdempotencyMiddleware, collection=lambda: db.idempotency_keys)
+
+# Compresses what observe_request measured; CORS stays outermost
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, 'Idempotent-Replayed'],
 )
 
 # Configure logging
@@ -2049,6 +2587,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    if os.environ.get('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true':
+        await ensure_indexes(db)
+
+async def invalidate_swept_trainers(trainer_ids):
+    """Swept sessions change trainer stats and free the slots of no-shows"""
+    for trainer_id in trainer_ids:
+        trainer_profile_cache.invalidate(trainer_id)
+    await sessions_changed(trainer_ids)
+
+session_sweeper = SessionSweeper(db, on_swept=invalidate_swept_trainers)
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    # Every worker starts one; the lease in scheduler_locks lets only one of them sweep
+    if os.environ.get('SESSION_SWEEPER_ENABLED', 'true').lower() == 'true':
+        session_sweeper.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await session_sweeper.stop()
     client.close()
+    bcrypt_executor.shutdown(wait=False)
@@ -0,0 +1,103 @@
+"""
+Session lifecycle for the RapidReps API.
+
+The legal transitions are declared once in ``TRANSITIONS``: the statuses an
+action may start from, the status it leads to and which participant may
+perform it.
+
+``apply_transition`` performs a transition as a single conditional
+``find_one_and_update``: the filter pins the session, the acting participant
+and the allowed source statuses, and the updated document comes back in the
+same round trip. Of two concurrent transitions only one can match, so side
+effects that callers run for the returned document (trainer stats, cache
+invalidation) happen exactly once. Only when nothing matches is the session
+read again, to tell the caller why: 404, 403 or 400.
+"""
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+
+class SessionStatus:
+    REQUESTED = "requested"
+    CONFIRMED = "confirmed"
+    DECLINED = "declined"
+    CANCELLED = "cancelled"
+    COMPLETED = "completed"
+    NO_SHOW = "no_show"
+
+
+class Transition(NamedTuple):
+    sources: Tuple[str, ...]
+    target: str
+    # Session fields naming the participants allowed to perform the transition
+    actors: Tuple[str, ...]
+
+
+TRANSITIONS: Dict[str, Transition] = {
+    'accept': Transition((SessionStatus.REQUESTED,), SessionStatus.CONFIRMED, ('trainerId',)),
+    'decline': Transition((SessionStatus.REQUESTED,), SessionStatus.DECLINED, ('trainerId',)),
+    'cancel': Transition((SessionStatus.REQUESTED, SessionStatus.CONFIRMED), SessionStatus.CANCELLED, ('traineeId',)),
+    'complete': Transition(
+        (SessionStatus.REQUESTED, SessionStatus.CONFIRMED), SessionStatus.COMPLETED, ('trainerId', 'traineeId'),
+    ),
+}
+
+# Share of the price kept when the trainee cancels a session the trainer already confirmed
+CANCELLATION_FEE_RATE = 0.20
+
+# Pipeline stages for 'cancel'. They run before the status is overwritten, so the fee is
+# computed from the status the session actually had when the update matched it.
+CANCELLATION_FEE_STAGES = [
+    {'$set': {'cancellationFeeCents': {'$cond': [
+        {'$eq': ['$status', SessionStatus.CONFIRMED]},
+        {'$toInt': {'$multiply': [{'$ifNull': ['$finalSessionPriceCents', 0]}, CANCELLATION_FEE_RATE]}},
+        0,
+    ]}}},
+    {'$set': {'refundAmountCents': {
+        '$subtract': [{'$ifNull': ['$finalSessionPriceCents', 0]}, '$cancellationFeeCents'],
+    }}},
+]
+
+
+def parse_session_id(session_id: str) -> ObjectId:
+    try:
+        return ObjectId(session_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid session ID format")
+
+
+async def apply_transition(sessions, session_id: str, action: str, actor_id: str,
+                           stages: Optional[List[dict]] = None, fields: Optional[dict] = None) -> dict:
+    """Move a session through ``action`` and return the updated document.
+
+    ``stages`` are pipeline stages run before the status changes; ``fields`` are
+    extra values set along with the new status.
+    """
+    transition = TRANSITIONS[action]
+    oid = parse_session_id(session_id)
+    query = {
+        '_id': oid,
+        'status': {'$in': list(transition.sources)},
+        '$or': [{field: actor_id} for field in transition.actors],
+    }
+    values = {'status': transition.target, 'updatedAt': datetime.utcnow(), **(fields or {})}
+    update = list(stages or []) + [{'$set': {key: {'$literal': value} for key, value in values.items()}}]
+
+    session = await sessions.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    if session is None:
+        raise await _rejection(sessions, oid, action, transition, actor_id)
+    return session
+
+
+async def _rejection(sessions, oid: ObjectId, action: str, transition: Transition, actor_id: str) -> HTTPException:
+    session = await sessions.find_one({'_id': oid}, {'status': 1, 'trainerId': 1, 'traineeId': 1})
+    if not session:
+        return HTTPException(status_code=404, detail="Session not found")
+    if actor_id not in (session.get(field) for field in transition.actors):
+        return HTTPException(status_code=403, detail=f"Not authorized to {action} this session")
+    return HTTPException(status_code=400, detail=f"Cannot {action} a session that is {session.get('status')}")
@@ -0,0 +1,915 @@
+"""
+In-memory storage backend for the RapidReps API.
+
+``MemoryClient`` mimics the subset of Motor's client, database and collection
+API that ``server.py`` uses, so handlers keep calling ``db.<collection>`` and
+run unchanged against either backend. Select it with
+``STORAGE_BACKEND=memory``; it needs no MongoDB, which makes it suitable for
+in-process benchmarks, CPU profiling of individual routes and fast tests.
+
+Supported:
+- filters: equality (with array membership), dotted paths, ``$eq $ne $gt
+  $gte $lt $lte $in $nin $all $exists $size $regex $elemMatch $not`` and
+  ``$and $or $nor``
+- updates: ``$set $unset $inc $min $max $push $addToSet $pull $setOnInsert``
+  and upserts, plus pipeline updates made of ``$set``/``$addFields`` and
+  ``$unset`` stages (expressions: field paths, ``$literal $cond $ifNull $eq
+  $ne $gt $gte $lt $lte $and $or $not $add $subtract $multiply $divide $toInt
+  $floor``)
+- cursors: ``sort``, ``skip``, ``limit``, ``to_list`` and ``async for``
+- projections that include or exclude top-level fields
+- unique indexes (including ``sparse``, ``partialFilterExpression`` and
+  case-insensitive collations), raising ``DuplicateKeyError`` like MongoDB
+
+Equality filters on the leading field of a declared index use a hash lookup;
+everything else scans the collection. The backend is meant for datasets that
+fit comfortably in memory, not as a database. Documents are copied on the way in
+and out, so callers can mutate what they get back just as with Motor.
+"""
+import math
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.regex import Regex
+from pymongo import IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+class _Missing:
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def _copy(value):
+    """Copy the mutable containers of a document; scalars (str, datetime, ObjectId) are shared"""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+# ============================================================================
+# FIELD ACCESS
+# ============================================================================
+
+def get_path(doc, path: str):
+    """Value at a dotted path, ``MISSING`` if absent.
+
+    Traversing an array of subdocuments collects the field from each element,
+    as MongoDB does, and returns them as a list.
+    """
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                index = int(part)
+                value = value[index] if index < len(value) else MISSING
+            else:
+                values = [get_path(v, part) for v in value if isinstance(v, dict)]
+                value = [v for v in values if v is not MISSING] or MISSING
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def set_path(doc: dict, path: str, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        child = doc.get(part)
+        if not isinstance(child, dict):
+            child = doc[part] = {}
+        doc = child
+    doc[parts[-1]] = value
+
+
+def unset_path(doc: dict, path: str):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+# ============================================================================
+# COMPARISON AND SORTING
+# ============================================================================
+
+def _type_rank(value) -> int:
+    """MongoDB's BSON comparison order, for the types the API stores"""
+    if value is MISSING or value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, (bytes, bytearray)):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    rank = _type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank in (4, 5):
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _compare(a, b) -> Optional[int]:
+    """-1, 0 or 1, or None when MongoDB would not compare the two values (different types)"""
+    if _type_rank(a) != _type_rank(b):
+        return None
+    key_a, key_b = sort_key(a), sort_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+def _equals(value, target) -> bool:
+    if target is None:
+        return value is MISSING or value is None
+    if value is MISSING:
+        return False
+    if isinstance(target, (re.Pattern, Regex)):
+        return _regex_matches(value, target)
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(_equals(v, target) for v in value)
+    return _type_rank(value) == _type_rank(target) and value == target
+
+
+def _regex_matches(value, pattern, options: str = '') -> bool:
+    if isinstance(pattern, Regex):
+        pattern = pattern.try_compile()
+    if not isinstance(pattern, re.Pattern):
+        flags = re.IGNORECASE if 'i' in options else 0
+        flags |= re.MULTILINE if 'm' in options else 0
+        pattern = re.compile(pattern, flags)
+    values = value if isinstance(value, list) else [value]
+    return any(isinstance(v, str) and pattern.search(v) for v in values)
+
+
+def _candidates(value) -> list:
+    """Values an operator is tested against: the value itself and, for arrays, each element"""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+# ============================================================================
+# FILTERS
+# ============================================================================
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    """Whether ``doc`` satisfies a MongoDB filter"""
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif key.startswith('$'):
+            raise OperationFailure(f'unknown top level operator: {key}')
+        elif not _field_matches(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(k.startswith('$') for k in condition)
+
+
+def _field_matches(value, condition) -> bool:
+    if not _is_operator_dict(condition):
+        return _equals(value, condition)
+    for op, target in condition.items():
+        if op == '$options':
+            continue
+        if not _operator_matches(value, op, target, condition):
+            return False
+    return True
+
+
+def _operator_matches(value, op: str, target, condition: dict) -> bool:
+    if op == '$eq':
+        return _equals(value, target)
+    if op == '$ne':
+        return not _equals(value, target)
+    if op in ('$gt', '$gte', '$lt', '$lte'):
+        if value is MISSING:
+            return target is None and op in ('$gte', '$lte')
+        for candidate in _candidates(value):
+            result = _compare(candidate, target)
+            if result is None:
+                continue
+            if (op == '$gt' and result > 0) or (op == '$gte' and result >= 0) \
+                    or (op == '$lt' and result < 0) or (op == '$lte' and result <= 0):
+                return True
+        return False
+    if op == '$in':
+        return any(_equals(value, t) for t in target)
+    if op == '$nin':
+        return not any(_equals(value, t) for t in target)
+    if op == '$all':
+        return isinstance(value, list) and all(_equals(value, t) for t in target)
+    if op == '$exists':
+        return (value is not MISSING) == bool(target)
+    if op == '$size':
+        return isinstance(value, list) and len(value) == target
+    if op == '$regex':
+        return value is not MISSING and _regex_matches(value, target, condition.get('$options', ''))
+    if op == '$elemMatch':
+        if not isinstance(value, list):
+            return False
+        if _is_operator_dict(target):
+            return any(_field_matches(v, target) for v in value)
+        return any(isinstance(v, dict) and matches(v, target) for v in value)
+    if op == '$not':
+        return not _field_matches(value, target)
+    raise OperationFailure(f'unknown operator: {op}')
+
+
+def _equality_fields(query: dict) -> dict:
+    """Plain equality conditions of a filter, which an upsert copies into the new document"""
+    fields = {}
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            for sub in condition:
+                fields.update(_equality_fields(sub))
+        elif key.startswith('$'):
+            continue
+        elif _is_operator_dict(condition):
+            if '$eq' in condition:
+                fields[key] = condition['$eq']
+        else:
+            fields[key] = condition
+    return fields
+
+
+# ============================================================================
+# UPDATES
+# ============================================================================
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    """Apply update operators to ``doc`` in place"""
+    for op, fields in update.items():
+        if op == '$setOnInsert' and not inserting:
+            continue
+        for path, value in fields.items():
+            if op in ('$set', '$setOnInsert'):
+                set_path(doc, path, _copy(value))
+            elif op == '$unset':
+                unset_path(doc, path)
+            elif op == '$inc':
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is MISSING or current is None else current) + value)
+            elif op in ('$min', '$max'):
+                current = get_path(doc, path)
+                result = None if current is MISSING else _compare(value, current)
+                if current is MISSING or (result is not None and (result < 0 if op == '$min' else result > 0)):
+                    set_path(doc, path, _copy(value))
+            elif op in ('$push', '$addToSet'):
+                current = get_path(doc, path)
+                items = current if isinstance(current, list) else []
+                if current is MISSING:
+                    set_path(doc, path, items)
+                new_items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                for item in new_items:
+                    if op == '$push' or not any(_type_rank(i) == _type_rank(item) and i == item for i in items):
+                        items.append(_copy(item))
+            elif op == '$pull':
+                current = get_path(doc, path)
+                if isinstance(current, list):
+                    if isinstance(value, dict):
+                        keep = [i for i in current if not (matches(i, value) if isinstance(i, dict) and
+                                                           not _is_operator_dict(value) else _field_matches(i, value))]
+                    else:
+                        keep = [i for i in current if not _equals(i, value)]
+                    set_path(doc, path, keep)
+            else:
+                raise OperationFailure(f'Unknown modifier: {op}')
+
+
+def _validate_update(update):
+    if isinstance(update, list):
+        if not all(isinstance(stage, dict) and len(stage) == 1 for stage in update):
+            raise ValueError('pipeline update stages must be single-key documents')
+        return
+    if not isinstance(update, dict) or not update or not all(k.startswith('$') for k in update):
+        raise ValueError('update only works with $ operators')
+
+
+def _apply(doc: dict, update, inserting: bool = False) -> dict:
+    """Apply an operator update in place, or a pipeline update returning the new document"""
+    if isinstance(update, list):
+        return apply_pipeline(doc, update)
+    apply_update(doc, update, inserting)
+    return doc
+
+
+# ============================================================================
+# AGGREGATION EXPRESSIONS
+# ============================================================================
+
+def _arithmetic(op: str, values: list):
+    if any(v is None or v is MISSING for v in values):
+        return None
+    if op == '$add':
+        result = values[0]
+        for value in values[1:]:
+            result = result + (timedelta(milliseconds=value) if isinstance(result, datetime) else value)
+        return result
+    if op == '$subtract':
+        a, b = values
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((a - b).total_seconds() * 1000)
+        return a - timedelta(milliseconds=b) if isinstance(a, datetime) else a - b
+    if op == '$multiply':
+        result = 1
+        for value in values:
+            result *= value
+        return result
+    a, b = values
+    return a / b
+
+
+_EXPRESSION_COMPARISONS = {
+    '$eq': lambda r: r == 0, '$ne': lambda r: r != 0, '$gt': lambda r: r > 0,
+    '$gte': lambda r: r >= 0, '$lt': lambda r: r < 0, '$lte': lambda r: r <= 0,
+}
+
+
+def _truthy(value) -> bool:
+    return value not in (None, False, 0, MISSING)
+
+
+def evaluate(expr, doc: dict):
+    """Evaluate an aggregation expression against ``doc``; missing fields evaluate to MISSING"""
+    if isinstance(expr, str) and expr.startswith('$'):
+        return get_path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(item, doc) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith('$'):
+        return {key: evaluate(value, doc) for key, value in expr.items()}
+
+    op, args = next(iter(expr.items()))
+    if op == '$literal':
+        return args
+    if op == '$cond':
+        if isinstance(args, dict):
+            args = [args['if'], args['then'], args['else']]
+        condition, then, otherwise = args
+        return evaluate(then if _truthy(evaluate(condition, doc)) else otherwise, doc)
+    if op == '$ifNull':
+        *candidates, fallback = args
+        for candidate in candidates:
+            value = evaluate(candidate, doc)
+            if value is not None and value is not MISSING:
+                return value
+        return evaluate(fallback, doc)
+
+    values = [evaluate(arg, doc) for arg in (args if isinstance(args, list) else [args])]
+    if op in _EXPRESSION_COMPARISONS:
+        # Expressions compare across types in BSON order, unlike query operators
+        key_a, key_b = (sort_key(None if v is MISSING else v) for v in values)
+        return _EXPRESSION_COMPARISONS[op]((key_a > key_b) - (key_a < key_b))
+    if op == '$and':
+        return all(_truthy(v) for v in values)
+    if op == '$or':
+        return any(_truthy(v) for v in values)
+    if op == '$not':
+        return not _truthy(values[0])
+    if op in ('$add', '$subtract', '$multiply', '$divide'):
+        return _arithmetic(op, values)
+    if op in ('$toInt', '$floor'):
+        value = values[0]
+        if value is None or value is MISSING:
+            return None
+        return int(value) if op == '$toInt' else math.floor(value)
+    raise OperationFailure(f'Unrecognized expression operator: {op}')
+
+
+def apply_pipeline(doc: dict, pipeline: List[dict]) -> dict:
+    """Run a pipeline update's stages over ``doc``, each stage seeing the previous stage's output"""
+    for stage in pipeline:
+        op, spec = next(iter(stage.items()))
+        if op in ('$set', '$addFields'):
+            values = {path: evaluate(expr, doc) for path, expr in spec.items()}
+            doc = _copy(doc)
+            for path, value in values.items():
+                if value is MISSING:
+                    unset_path(doc, path)
+                else:
+                    set_path(doc, path, value)
+        elif op == '$unset':
+            doc = _copy(doc)
+            for path in [spec] if isinstance(spec, str) else spec:
+                unset_path(doc, path)
+        else:
+            raise OperationFailure(f'Unsupported pipeline update stage: {op}')
+    return doc
+
+
+# ============================================================================
+# PROJECTION
+# ============================================================================
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return _copy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get('_id', 1))
+    fields = {k: v for k, v in projection.items() if k != '_id'}
+    if fields and all(fields.values()):
+        result = {k: _copy(doc[k]) for k in fields if k in doc}
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    result = {k: _copy(v) for k, v in doc.items() if k not in fields}
+    if not include_id:
+        result.pop('_id', None)
+    return result
+
+
+# ============================================================================
+# INDEXES
+# ============================================================================
+
+def _default_index_name(keys: List[Tuple[str, Any]]) -> str:
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+class _UniqueIndex:
+    """Enforces uniqueness of one index's key over a collection"""
+
+    def __init__(self, name: str, keys: List[Tuple[str, Any]], options: dict):
+        self.name = name
+        self.fields = [field for field, _ in keys]
+        self.sparse = options.get('sparse', False)
+        self.partial = options.get('partialFilterExpression')
+        collation = options.get('collation') or {}
+        self.case_insensitive = collation.get('strength', 3) <= 2
+        self.entries: Dict[Tuple, Any] = {}
+
+    def key(self, doc: dict) -> Optional[Tuple]:
+        """Index key of ``doc``, or None when the index does not cover it"""
+        if self.partial is not None and not matches(doc, self.partial):
+            return None
+        values = [get_path(doc, field) for field in self.fields]
+        if self.sparse and all(v is MISSING for v in values):
+            return None
+        return tuple(self._normalize(v) for v in values)
+
+    def _normalize(self, value):
+        if value is MISSING:
+            return None
+        if self.case_insensitive and isinstance(value, str):
+            return value.casefold()
+        if isinstance(value, (dict, list)):
+            return repr(value)
+        return value
+
+    def check(self, doc: dict, collection: str, exclude_id=MISSING):
+        key = self.key(doc)
+        if key is None:
+            return
+        owner = self.entries.get(key, MISSING)
+        if owner is not MISSING and owner != exclude_id:
+            dup = ', '.join(f'{f}: {v!r}' for f, v in zip(self.fields, key))
+            raise DuplicateKeyError(
+                f'E11000 duplicate key error collection: {collection} index: {self.name} dup key: {{ {dup} }}',
+                11000, {'index': self.name, 'keyPattern': {f: 1 for f in self.fields}, 'keyValue': dict(zip(self.fields, key))})
+
+    def add(self, doc: dict):
+        key = self.key(doc)
+        if key is not None:
+            self.entries[key] = doc['_id']
+
+    def remove(self, doc: dict):
+        key = self.key(doc)
+        if key is not None and self.entries.get(key) == doc['_id']:
+            del self.entries[key]
+
+
+def _hash_key(value):
+    """Hashable stand-in for a value that keeps MongoDB's type distinctions (1 vs True)"""
+    rank = _type_rank(value)
+    if rank == 1:
+        return (1, None)
+    if rank in (4, 5):
+        return (rank, repr(value))
+    try:
+        hash(value)
+    except TypeError:
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _lookup_target(condition):
+    """The value an equality condition compares against, or ``MISSING`` if it is not a plain equality"""
+    if _is_operator_dict(condition):
+        if len(condition) == 1 and '$eq' in condition:
+            condition = condition['$eq']
+        else:
+            return MISSING
+    if condition is MISSING or isinstance(condition, (list, dict, re.Pattern, Regex)):
+        return MISSING
+    return condition
+
+
+class _FieldLookup:
+    """Maps the values of one field to the ids of the documents holding them.
+
+    Kept for the leading field of every declared index so equality filters on
+    it skip the scan. Arrays are indexed per element, like a multikey index,
+    and missing fields under ``None`` so ``{field: None}`` still finds them.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.buckets: Dict[Any, Dict[Any, None]] = {}
+
+    def _keys(self, doc: dict) -> set:
+        value = get_path(doc, self.field)
+        if value is MISSING:
+            return {_hash_key(None)}
+        values = value if isinstance(value, list) else [value]
+        return {_hash_key(v) for v in values}
+
+    def add(self, doc: dict):
+        for key in self._keys(doc):
+            self.buckets.setdefault(key, {})[doc['_id']] = None
+
+    def remove(self, doc: dict):
+        for key in self._keys(doc):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.pop(doc['_id'], None)
+                if not bucket:
+                    del self.buckets[key]
+
+    def ids(self, target) -> Dict[Any, None]:
+        return self.buckets.get(_hash_key(target), {})
+
+
+# ============================================================================
+# CURSOR / COLLECTION / DATABASE / CLIENT
+# ============================================================================
+
+def _sorted(docs: List[dict], sort: List[Tuple[str, int]]) -> List[dict]:
+    """Sort by several keys with one stable sort per key, least significant first"""
+    for field, direction in reversed(list(sort)):
+        docs.sort(key=lambda d: sort_key(get_path(d, field)), reverse=direction == -1)
+    return docs
+
+
+class MemoryCursor:
+    def __init__(self, collection: 'MemoryCollection', query: Optional[dict], projection=None,
+                 sort=None, skip: int = 0, limit: int = 0):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = skip
+        self._limit = limit
+        if sort:
+            self.sort(sort)
+
+    def sort(self, key_or_list, direction: int = 1) -> 'MemoryCursor':
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._limit = limit
+        return self
+
+    def _results(self, length: Optional[int] = None) -> List[dict]:
+        docs = _sorted(self._collection._matching(self._query), self._sort)
+        docs = docs[self._skip:]
+        limits = [n for n in (self._limit, length) if n]
+        if limits:
+            docs = docs[:min(limits)]
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return self._results(length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self, database: 'MemoryDatabase', name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self._docs: Dict[Any, dict] = {}
+        self._indexes: Dict[str, dict] = {'_id_': {'key': [('_id', 1)], 'v': 2}}
+        self._unique: Dict[str, _UniqueIndex] = {}
+        self._lookups: Dict[str, _FieldLookup] = {}
+
+    # ---------------------------------------------------------------- internals
+
+    def _iter_matching(self, query: Optional[dict]):
+        """Stored documents (not copies) matching ``query``, using the narrowest field lookup available"""
+        query = query or {}
+        _id = query.get('_id', MISSING)
+        if _id is not MISSING and not _is_operator_dict(_id):
+            doc = self._docs.get(_id)
+            candidates = [doc] if doc is not None else []
+        else:
+            ids = None
+            for field, lookup in self._lookups.items():
+                target = _lookup_target(query.get(field, MISSING))
+                if target is not MISSING:
+                    bucket = lookup.ids(target)
+                    if ids is None or len(bucket) < len(ids):
+                        ids = bucket
+            candidates = self._docs.values() if ids is None else [self._docs[i] for i in ids]
+        for doc in candidates:
+            if matches(doc, query):
+                yield doc
+
+    def _matching(self, query: Optional[dict]) -> List[dict]:
+        return list(self._iter_matching(query))
+
+    def _first(self, query: Optional[dict], sort=None) -> Optional[dict]:
+        if sort:
+            docs = _sorted(self._matching(query), sort)
+            return docs[0] if docs else None
+        return next(self._iter_matching(query), None)
+
+    def _insert(self, document: dict) -> Any:
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        doc = _copy(document)
+        if doc['_id'] in self._docs:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {{ _id: {doc['_id']!r} }}",
+                11000, {'index': '_id_', 'keyPattern': {'_id': 1}, 'keyValue': {'_id': doc['_id']}})
+        for index in self._unique.values():
+            index.check(doc, self.full_name)
+        for index in self._unique.values():
+            index.add(doc)
+        for lookup in self._lookups.values():
+            lookup.add(doc)
+        self._docs[doc['_id']] = doc
+        return doc['_id']
+
+    def _replace(self, old: dict, new: dict):
+        """Swap a stored document for its updated version, enforcing unique indexes"""
+        if new.get('_id') != old['_id']:
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", 66)
+        for index in self._unique.values():
+            index.check(new, self.full_name, exclude_id=old['_id'])
+        for index in list(self._unique.values()) + list(self._lookups.values()):
+            index.remove(old)
+            index.add(new)
+        self._docs[old['_id']] = new
+
+    def _update_doc(self, doc: dict, update) -> Tuple[dict, bool]:
+        new = _apply(_copy(doc), update)
+        if new == doc:
+            return doc, False
+        self._replace(doc, new)
+        return new, True
+
+    def _upsert(self, query: dict, update) -> dict:
+        doc = {}
+        for path, value in _equality_fields(query).items():
+            set_path(doc, path, _copy(value))
+        doc = _apply(doc, update, inserting=True)
+        self._insert(doc)
+        return self._docs[doc['_id']]
+
+    def _delete(self, doc: dict):
+        for index in list(self._unique.values()) + list(self._lookups.values()):
+            index.remove(doc)
+        del self._docs[doc['_id']]
+
+    # ---------------------------------------------------------------- reads
+
+    def find(self, filter: Optional[dict] = None, projection=None, sort=None, skip: int = 0,
+             limit: int = 0) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection, sort, skip, limit)
+
+    async def find_one(self, filter: Optional[dict] = None, projection=None, sort=None) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        doc = self._first(filter, sort)
+        return project(doc, projection) if doc is not None else None
+
+    async def count_documents(self, filter: dict, limit: int = 0) -> int:
+        count = len(self._matching(filter))
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        values = []
+        for doc in self._matching(filter):
+            value = get_path(doc, key)
+            for v in (value if isinstance(value, list) else [value]):
+                if v is not MISSING and v not in values:
+                    values.append(v)
+        return values
+
+    # ---------------------------------------------------------------- writes
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True) -> InsertManyResult:
+        inserted, errors = [], []
+        for i, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({'index': i, 'code': 11000, 'errmsg': str(e), 'op': document, **(e.details or {})})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted),
+                'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': [],
+            })
+        return InsertManyResult(inserted, True)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        _validate_update(update)
+        doc = self._first(filter)
+        if doc is None:
+            if upsert:
+                return UpdateResult({'n': 1, 'nModified': 0, 'upserted': self._upsert(filter, update)['_id']}, True)
+            return UpdateResult({'n': 0, 'nModified': 0}, True)
+        _, modified = self._update_doc(doc, update)
+        return UpdateResult({'n': 1, 'nModified': int(modified)}, True)
+
+    async def update_many(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        _validate_update(update)
+        docs = self._matching(filter)
+        if not docs and upsert:
+            return UpdateResult({'n': 1, 'nModified': 0, 'upserted': self._upsert(filter, update)['_id']}, True)
+        modified = sum(self._update_doc(doc, update)[1] for doc in docs)
+        return UpdateResult({'n': len(docs), 'nModified': modified}, True)
+
+    async def find_one_and_update(self, filter: dict, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[dict]:
+        _validate_update(update)
+        doc = self._first(filter, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            new = self._upsert(filter, update)
+            return project(new, projection) if return_document == ReturnDocument.AFTER else None
+        new, _ = self._update_doc(doc, update)
+        return project(new if return_document == ReturnDocument.AFTER else doc, projection)
+
+    async def find_one_and_delete(self, filter: dict, projection=None, sort=None) -> Optional[dict]:
+        doc = self._first(filter, sort)
+        if doc is None:
+            return None
+        self._delete(doc)
+        return project(doc, projection)
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        doc = self._first(filter)
+        if doc is not None:
+            self._delete(doc)
+        return DeleteResult({'n': int(doc is not None)}, True)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        docs = self._matching(filter)
+        for doc in docs:
+            self._delete(doc)
+        return DeleteResult({'n': len(docs)}, True)
+
+    async def drop(self):
+        self._docs.clear()
+        self._indexes = {'_id_': {'key': [('_id', 1)], 'v': 2}}
+        self._unique.clear()
+        self._lookups.clear()
+
+    # ---------------------------------------------------------------- indexes
+
+    async def create_indexes(self, indexes: List[IndexModel]) -> List[str]:
+        names = []
+        for model in indexes:
+            spec = dict(model.document)
+            keys = list(spec.pop('key').items())
+            name = spec.pop('name', None) or _default_index_name(keys)
+            if spec.get('unique'):
+                index = _UniqueIndex(name, keys, spec)
+                for doc in self._docs.values():
+                    index.check(doc, self.full_name, exclude_id=doc['_id'])
+                    index.add(doc)
+                self._unique[name] = index
+            field = keys[0][0]
+            if field != '_id' and field not in self._lookups and keys[0][1] in (1, -1):
+                lookup = self._lookups[field] = _FieldLookup(field)
+                for doc in self._docs.values():
+                    lookup.add(doc)
+            self._indexes[name] = {'key': keys, 'v': 2, **spec}
+            names.append(name)
+        return names
+
+    async def create_index(self, keys, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def index_information(self) -> dict:
+        return {name: {**info, 'key': list(info['key'])} for name, info in self._indexes.items()}
+
+    async def drop_index(self, name: str):
+        if name not in self._indexes or name == '_id_':
+            raise OperationFailure(f'index not found with name [{name}]', 27)
+        del self._indexes[name]
+        self._unique.pop(name, None)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(name)
+        return database
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name: str):
+        self._databases.pop(name, None)
+
+    def close(self):
+        pass
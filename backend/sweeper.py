@@ -0,0 +1,198 @@
+"""
+Background session lifecycle sweeper.
+
+Sessions that are over never change status by themselves, so the sweeper
+advances them periodically:
+
+- ``confirmed`` sessions that ended more than ``SWEEPER_COMPLETE_GRACE_MINUTES``
+  ago become ``completed``, and their trainers' ``totalSessionsCompleted``
+  moves with them. The grace period leaves time to complete sessions by hand.
+- ``requested`` sessions that ended without the trainer answering become
+  ``no_show`` and release their slots.
+
+Each sweep reads up to ``SWEEPER_BATCH_SIZE`` overdue ids from the
+``(status, sessionDateTimeEnd)`` index, oldest first. It moves them with one
+``update_many`` that re-checks the status, so sessions a participant
+transitioned in the meantime are left alone. The matched sessions are tagged
+with the batch's ``sweepRunId``, and only sessions carrying that tag are
+counted towards trainer stats. Several batches run back to back until the
+backlog is drained or ``SWEEPER_MAX_BATCHES`` is reached.
+
+Only one worker sweeps at a time. Workers race for a lease document in
+``scheduler_locks`` that the holder renews on every run. If the holder dies,
+another worker takes over once the lease expires.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import SWEEPER_BATCH_SIZES, SWEEPER_IS_LEADER, SWEEPER_LAG, SWEEPER_SESSIONS
+from scheduling import release_slots
+from session_state import SessionStatus
+
+logger = logging.getLogger(__name__)
+
+SWEEPER_INTERVAL_SECONDS = float(os.environ.get('SWEEPER_INTERVAL_SECONDS', '60'))
+# A leader that misses this many seconds of renewals loses the lease to another worker
+SWEEPER_LEASE_SECONDS = float(os.environ.get('SWEEPER_LEASE_SECONDS', '180'))
+SWEEPER_BATCH_SIZE = int(os.environ.get('SWEEPER_BATCH_SIZE', '500'))
+SWEEPER_MAX_BATCHES = int(os.environ.get('SWEEPER_MAX_BATCHES', '20'))
+SWEEPER_COMPLETE_GRACE_MINUTES = int(os.environ.get('SWEEPER_COMPLETE_GRACE_MINUTES', '60'))
+
+LOCK_NAME = 'session_sweeper'
+
+
+class Sweep(NamedTuple):
+    source: str
+    target: str
+    # How long after its end a session is left in ``source``
+    grace: timedelta
+
+
+SWEEPS = (
+    Sweep(SessionStatus.CONFIRMED, SessionStatus.COMPLETED, timedelta(minutes=SWEEPER_COMPLETE_GRACE_MINUTES)),
+    Sweep(SessionStatus.REQUESTED, SessionStatus.NO_SHOW, timedelta(0)),
+)
+
+
+async def acquire_lease(locks, name: str, owner: str, lease: timedelta, now: Optional[datetime] = None) -> bool:
+    """Take or renew the lease on ``name``; False while another owner holds it"""
+    now = now or datetime.utcnow()
+    try:
+        await locks.update_one(
+            {'_id': name, '$or': [{'owner': owner}, {'expiresAt': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expiresAt': now + lease, 'renewedAt': now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The lock exists and someone else holds it, so the upsert tried to insert a second one
+        return False
+    return True
+
+
+async def release_lease(locks, name: str, owner: str):
+    await locks.delete_one({'_id': name, 'owner': owner})
+
+
+class SessionSweeper:
+    """Periodically advances overdue sessions while this worker holds the lease.
+
+    ``on_swept`` is awaited with the trainer ids whose sessions changed, so the
+    caller can drop cached profiles and calendars.
+    """
+
+    def __init__(self, db, on_swept: Optional[Callable[[Iterable[str]], Awaitable[None]]] = None,
+                 interval: float = SWEEPER_INTERVAL_SECONDS, batch_size: int = SWEEPER_BATCH_SIZE,
+                 owner: Optional[str] = None):
+        self.db = db
+        self.on_swept = on_swept
+        self.interval = interval
+        self.batch_size = batch_size
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name='session-sweeper')
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await release_lease(self.db.scheduler_locks, LOCK_NAME, self.owner)
+        SWEEPER_IS_LEADER.set(value=0)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Session sweep failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Optional[Dict[str, int]]:
+        """Sweep once if this worker holds the lease; returns sessions moved per target status"""
+        now = now or datetime.utcnow()
+        leader = await acquire_lease(
+            self.db.scheduler_locks, LOCK_NAME, self.owner, timedelta(seconds=SWEEPER_LEASE_SECONDS), now
+        )
+        SWEEPER_IS_LEADER.set(value=1 if leader else 0)
+        if not leader:
+            return None
+
+        moved = {}
+        trainers = set()
+        for sweep in SWEEPS:
+            moved[sweep.target] = 0
+            for _ in range(SWEEPER_MAX_BATCHES):
+                swept = await self._sweep_batch(sweep, now)
+                moved[sweep.target] += len(swept)
+                trainers.update(session['trainerId'] for session in swept)
+                if len(swept) < self.batch_size:
+                    break
+            await self._record_lag(sweep, now)
+
+        if trainers and self.on_swept:
+            await self.on_swept(trainers)
+        if any(moved.values()):
+            logger.info(f"Session sweep moved {moved}")
+        return moved
+
+    def _overdue(self, sweep: Sweep, now: datetime) -> dict:
+        return {'status': sweep.source, 'sessionDateTimeEnd': {'$lt': now - sweep.grace}}
+
+    async def _sweep_batch(self, sweep: Sweep, now: datetime) -> List[dict]:
+        """Move one batch of overdue sessions; returns the ones this run moved"""
+        overdue = await self.db.sessions.find(self._overdue(sweep, now), {'_id': 1}).sort(
+            'sessionDateTimeEnd', 1
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not overdue:
+            return []
+
+        run_id = uuid.uuid4().hex
+        await self.db.sessions.update_many(
+            {'_id': {'$in': [session['_id'] for session in overdue]}, 'status': sweep.source},
+            {'$set': {'status': sweep.target, 'sweepRunId': run_id, 'updatedAt': now}}
+        )
+        swept = await self.db.sessions.find({'sweepRunId': run_id}, {'trainerId': 1}).to_list(None)
+        SWEEPER_BATCH_SIZES.observe(len(swept), sweep.target)
+        SWEEPER_SESSIONS.inc(sweep.target, amount=len(swept))
+
+        if sweep.target == SessionStatus.COMPLETED:
+            await self._count_completed(swept, now)
+        else:
+            await release_slots(self.db.session_slots, [session['_id'] for session in swept])
+        return swept
+
+    async def _count_completed(self, swept: List[dict], now: datetime):
+        """Add the batch to each trainer's totalSessionsCompleted, one update per distinct increment"""
+        trainers_by_count = defaultdict(list)
+        for trainer_id, count in Counter(session['trainerId'] for session in swept).items():
+            trainers_by_count[count].append(trainer_id)
+        for count, trainer_ids in trainers_by_count.items():
+            await self.db.trainer_profiles.update_many(
+                {'userId': {'$in': trainer_ids}},
+                {'$inc': {'totalSessionsCompleted': count}, '$set': {'updatedAt': now}}
+            )
+
+    async def _record_lag(self, sweep: Sweep, now: datetime):
+        """How long the oldest session still overdue has been waiting, 0 when the backlog is drained"""
+        oldest = await self.db.sessions.find_one(
+            self._overdue(sweep, now), {'sessionDateTimeEnd': 1}, sort=[('sessionDateTimeEnd', 1)]
+        )
+        lag = (now - sweep.grace - oldest['sessionDateTimeEnd']).total_seconds() if oldest else 0
+        SWEEPER_LAG.set(sweep.target, value=lag)
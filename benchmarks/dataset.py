@@ -0,0 +1,108 @@
+"""
+Seeded dataset for the API benchmarks.
+
+Documents come from the same builders as ``backend/seed_dataset.py``. On top
+of the random marketplace, one trainer and one trainee (the "bench pair") get a
+fixed share of sessions, ratings and conversations, so the per-user endpoints
+do a realistic amount of work on every run.
+"""
+from datetime import datetime
+from typing import NamedTuple
+
+import bcrypt
+
+from seed_dataset import (
+    DatasetSpec, build_conversations, build_messages, build_session_slots, build_sessions_and_ratings,
+    build_trainee_profiles, build_trainer_profiles, build_users, user_oid,
+)
+
+PASSWORD = 'password123'
+# Documents inserted per insert_many call
+BATCH_SIZE = 5000
+
+
+class BenchPair(NamedTuple):
+    trainer_id: str
+    trainer_email: str
+    trainee_id: str
+    trainee_email: str
+    conversation_id: str
+
+
+class DatasetSize(NamedTuple):
+    trainers: int
+    trainees: int
+    sessions: int
+    conversations: int
+    messages: int
+    # Sessions and conversations reassigned to the bench pair
+    pair_sessions: int
+    pair_conversations: int
+
+
+SIZES = {
+    'small': DatasetSize(200, 500, 5000, 300, 3000, 150, 20),
+    'medium': DatasetSize(1000, 5000, 50000, 2000, 20000, 400, 40),
+    'large': DatasetSize(5000, 20000, 200000, 10000, 100000, 1000, 80),
+}
+
+
+async def _insert(collection, docs):
+    for i in range(0, len(docs), BATCH_SIZE):
+        await collection.insert_many(docs[i:i + BATCH_SIZE], ordered=False)
+
+
+async def seed(db, size: DatasetSize, seed: int = 1) -> BenchPair:
+    spec = DatasetSpec(
+        trainers=size.trainers,
+        trainees=size.trainees,
+        sessions=size.sessions,
+        conversations=size.conversations,
+        messages=size.messages,
+        seed=seed,
+        password_hash=bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        now=datetime.utcnow().replace(microsecond=0),
+    )
+    trainer_id, trainee_id = str(user_oid(0)), str(user_oid(size.trainers))
+
+    users = build_users(spec, 0, size.trainers + size.trainees)
+    # The bench trainer doubles as admin for the admin endpoints
+    users[0]['isAdmin'] = True
+    await _insert(db.users, users)
+    await _insert(db.trainer_profiles, build_trainer_profiles(spec, 0, size.trainers))
+    await _insert(db.trainee_profiles, build_trainee_profiles(spec, 0, size.trainees))
+
+    sessions, ratings = build_sessions_and_ratings(spec, 0, size.sessions)
+    pair_session_ids = set()
+    for session in sessions[:size.pair_sessions]:
+        session['trainerId'], session['traineeId'] = trainer_id, trainee_id
+        pair_session_ids.add(str(session['_id']))
+    for rating in ratings:
+        if rating['sessionId'] in pair_session_ids:
+            rating['trainerId'], rating['traineeId'] = trainer_id, trainee_id
+    await _insert(db.sessions, sessions)
+    # Built after the reassignment, so the bench trainer's bookings hold their slots
+    await _insert(db.session_slots, build_session_slots(sessions))
+    await _insert(db.ratings, ratings)
+
+    conversations = build_conversations(spec, 0, size.conversations)
+    pair_conversations = set()
+    for conversation in conversations[:size.pair_conversations]:
+        conversation['participants'] = [trainer_id, trainee_id]
+        pair_conversations.add(conversation['_id'])
+    await _insert(db.conversations, conversations)
+
+    messages = build_messages(spec, 0, size.messages)
+    for index, message in enumerate(messages):
+        if message['conversationId'] in pair_conversations:
+            message['senderId'], message['receiverId'] = \
+                (trainee_id, trainer_id) if index % 2 == 0 else (trainer_id, trainee_id)
+    await _insert(db.messages, messages)
+
+    return BenchPair(
+        trainer_id=trainer_id,
+        trainer_email=users[0]['email'],
+        trainee_id=trainee_id,
+        trainee_email=users[size.trainers]['email'],
+        conversation_id=conversations[0]['_id'] if conversations else '',
+    )
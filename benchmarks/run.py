@@ -0,0 +1,299 @@
+"""
+In-process API benchmarks for RapidReps.
+
+Calls the FastAPI app directly through httpx's ASGI transport, so no server or
+network is involved, against a seeded dataset (the in-memory storage backend
+by default, or a scratch database on a local MongoDB with ``--mongo-url``).
+Every endpoint is measured for latency, then for allocations with tracemalloc
+in a separate pass so tracing overhead does not skew the timings.
+
+    python benchmarks/run.py                        # run and compare with the baseline
+    python benchmarks/run.py --save-baseline        # record a new baseline
+    python benchmarks/run.py --only search,admin_sessions --size medium
+
+Results are written as JSON to ``--output``. When a baseline exists, each
+endpoint's p50 latency and allocation peak are compared with it and changes
+beyond ``--threshold`` are reported as regressions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import mean
+from typing import Callable, NamedTuple, Optional
+
+import httpx
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from dataset import PASSWORD, SIZES, BenchPair, seed  # noqa: E402
+from loadtest import percentile  # noqa: E402
+
+DEFAULT_BASELINE = BENCH_DIR / 'baseline.json'
+DEFAULT_OUTPUT = BENCH_DIR / 'results' / 'latest.json'
+SCRATCH_DB = 'rapidreps_bench'
+
+
+class Benchmark(NamedTuple):
+    name: str
+    method: str
+    # Each builder receives the bench pair and the iteration number
+    path: Callable[[BenchPair, int], str]
+    token: Optional[str]  # 'trainer', 'trainee' or None
+    body: Optional[Callable[[BenchPair, int], dict]] = None
+    # bcrypt-bound endpoints take ~100x longer and run fewer iterations
+    slow: bool = False
+
+
+def _booking(pair: BenchPair, i: int) -> dict:
+    # Past the seeded sessions (at most 60 days out) and one hour apart, so no booking conflicts
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(days=90, hours=i)
+    return {
+        'traineeId': pair.trainee_id, 'trainerId': pair.trainer_id, 'sessionDateTimeStart': start.isoformat(),
+        'durationMinutes': 60, 'locationType': 'gym',
+    }
+
+
+BENCHMARKS = [
+    Benchmark('signup', 'POST', lambda p, i: '/api/auth/signup', None, lambda p, i: {
+        'fullName': 'Bench User', 'email': f'bench-signup-{time.time_ns()}-{i}@example.com', 'phone': '555-0100',
+        'password': PASSWORD, 'roles': ['trainee'],
+    }, slow=True),
+    Benchmark('login', 'POST', lambda p, i: '/api/auth/login', None,
+              lambda p, i: {'email': p.trainee_email, 'password': PASSWORD}, slow=True),
+    Benchmark('me', 'GET', lambda p, i: '/api/auth/me', 'trainee'),
+    Benchmark('search', 'GET', lambda p, i: '/api/trainers/search?latitude=40.7128&longitude=-74.0060', None),
+    Benchmark('search_styles', 'GET',
+              lambda p, i: '/api/trainers/search?styles=strength,yoga&minPrice=50&maxPrice=250', None),
+    Benchmark('trainer_profile', 'GET', lambda p, i: f'/api/trainer-profiles/{p.trainer_id}', None),
+    Benchmark('conversations', 'GET', lambda p, i: '/api/conversations', 'trainee'),
+    Benchmark('messages', 'GET', lambda p, i: f'/api/conversations/{p.conversation_id}/messages', 'trainee'),
+    Benchmark('trainer_sessions', 'GET', lambda p, i: '/api/trainer/sessions', 'trainer'),
+    Benchmark('trainee_sessions', 'GET', lambda p, i: '/api/trainee/sessions', 'trainee'),
+    Benchmark('book_session', 'POST', lambda p, i: '/api/sessions', 'trainee', _booking),
+    Benchmark('trainer_ratings', 'GET', lambda p, i: f'/api/trainers/{p.trainer_id}/ratings', None),
+    Benchmark('earnings', 'GET', lambda p, i: '/api/trainer/earnings', 'trainer'),
+    Benchmark('trainer_achievements', 'GET', lambda p, i: '/api/trainer/achievements', 'trainer'),
+    Benchmark('trainee_achievements', 'GET', lambda p, i: '/api/trainee/achievements', 'trainee'),
+    Benchmark('admin_sessions', 'GET', lambda p, i: '/api/admin/sessions', 'trainer'),
+]
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+async def _call(http: httpx.AsyncClient, bench: Benchmark, pair: BenchPair, tokens: dict, i: int):
+    headers = {'Authorization': f'Bearer {tokens[bench.token]}'} if bench.token else {}
+    body = bench.body(pair, i) if bench.body else None
+    response = await http.request(bench.method, bench.path(pair, i), headers=headers, json=body)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{bench.name}: {response.status_code} {response.text[:200]}')
+    return response
+
+
+async def measure(http, bench: Benchmark, pair: BenchPair, tokens: dict, iterations: int, warmup: int,
+                  alloc_iterations: int) -> dict:
+    counter = 0
+    for _ in range(warmup):
+        await _call(http, bench, pair, tokens, counter)
+        counter += 1
+
+    latencies = []
+    response_bytes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = await _call(http, bench, pair, tokens, counter)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        response_bytes = len(response.content)
+        counter += 1
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await _call(http, bench, pair, tokens, counter)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - before) / 1024)
+            retained.append((current - before) / 1024)
+            counter += 1
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50Ms': round(percentile(latencies, 50), 3),
+        'p95Ms': round(percentile(latencies, 95), 3),
+        'p99Ms': round(percentile(latencies, 99), 3),
+        'meanMs': round(mean(latencies), 3),
+        'minMs': round(min(latencies), 3),
+        'opsPerSec': round(iterations / elapsed, 1),
+        'allocPeakKiB': round(mean(peaks), 1) if peaks else None,
+        'allocRetainedKiB': round(mean(retained), 1) if retained else None,
+        'responseBytes': response_bytes,
+    }
+
+
+# ============================================================================
+# BASELINE COMPARISON
+# ============================================================================
+
+COMPARED_METRICS = ('p50Ms', 'allocPeakKiB')
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> dict:
+    """Relative change of each compared metric; regressions exceed ``threshold``"""
+    comparison = {}
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        entry = {}
+        for metric in COMPARED_METRICS:
+            if result.get(metric) is None or not base.get(metric):
+                continue
+            change = result[metric] / base[metric] - 1
+            entry[metric] = {'baseline': base[metric], 'current': result[metric], 'change': round(change, 3),
+                             'regression': change > threshold}
+        comparison[name] = entry
+    return comparison
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: dict, comparison: dict):
+    print(f"{'endpoint':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'alloc KiB':>12}  vs baseline")
+    for name, result in results.items():
+        changes = []
+        for metric, entry in comparison.get(name, {}).items():
+            flag = ' REGRESSION' if entry['regression'] else ''
+            changes.append(f"{metric} {entry['change']:+.0%}{flag}")
+        print(f"{name:<22}{result['p50Ms']:>10.2f}{result['p95Ms']:>10.2f}{result['p99Ms']:>10.2f}"
+              f"{result['opsPerSec']:>10.0f}{result['allocPeakKiB'] or 0:>12.1f}  {', '.join(changes) or '-'}")
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+async def run(args) -> dict:
+    if args.mongo_url:
+        os.environ.setdefault('MONGO_URL', args.mongo_url)
+    else:
+        os.environ['STORAGE_BACKEND'] = 'memory'
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+
+    import server
+    from indexes import ensure_indexes
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    client = None
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        server.db = client[SCRATCH_DB]
+        await client.drop_database(SCRATCH_DB)
+
+    try:
+        size = SIZES[args.size]
+        started = time.perf_counter()
+        pair = await seed(server.db, size)
+        await ensure_indexes(server.db)
+        print(f'Seeded {args.size} dataset in {time.perf_counter() - started:.1f}s')
+
+        tokens = {
+            'trainer': server.create_access_token(pair.trainer_id, pair.trainer_email),
+            'trainee': server.create_access_token(pair.trainee_id, pair.trainee_email),
+        }
+        selected = [b for b in BENCHMARKS if not args.only or b.name in args.only.split(',')]
+
+        results = {}
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as http:
+            for bench in selected:
+                iterations = args.slow_iterations if bench.slow else args.iterations
+                results[bench.name] = await measure(
+                    http, bench, pair, tokens, iterations, args.warmup, min(args.alloc_iterations, iterations))
+        return {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'storage': 'mongo' if args.mongo_url else 'memory',
+                'dataset': {'name': args.size, **size._asdict()},
+            },
+            'results': results,
+        }
+    finally:
+        if client is not None:
+            await client.drop_database(SCRATCH_DB)
+            client.close()
+
+
+def main(args) -> int:
+    report = asyncio.run(run(args))
+
+    baseline_path = Path(args.baseline)
+    comparison = {}
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text())
+        if baseline['meta'].get('dataset', {}).get('name') != args.size:
+            print(f"Baseline was recorded on the {baseline['meta']['dataset'].get('name')} dataset; not comparing")
+        else:
+            comparison = compare(report['results'], baseline, args.threshold)
+            report['comparison'] = comparison
+
+    print_report(report['results'], comparison)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Results written to {output}')
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f'Baseline saved to {baseline_path}')
+
+    regressions = [name for name, entry in comparison.items() if any(m['regression'] for m in entry.values())]
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='In-process RapidReps API benchmarks')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small', help='seeded dataset size')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--slow-iterations', type=int, default=10, help='iterations for bcrypt-bound endpoints')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--alloc-iterations', type=int, default=20, help='iterations traced with tracemalloc')
+    parser.add_argument('--only', help='comma-separated benchmark names')
+    parser.add_argument('--mongo-url', help='benchmark against a scratch database on this MongoDB instead of memory')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit non-zero on regressions')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT))
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,32 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The API runs from backend/ with flat imports (uvicorn server:app), mirror that here
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Tests run against the in-memory backend unless a suite brings its own MongoDB
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    """A fresh in-memory database swapped in for ``server.db``"""
+    import asyncio
+
+    import cache
+    import server
+    from indexes import ensure_indexes
+    from storage import MemoryClient
+
+    database = MemoryClient()['rapidreps_test']
+    # Startup hooks do not run under ASGITransport; unique indexes back API behaviour
+    asyncio.run(ensure_indexes(database))
+    monkeypatch.setattr(server, 'db', database)
+    # Entries cached from another test's database would otherwise leak into this one
+    cache.clear_all()
+    return database
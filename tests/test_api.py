@@ -0,0 +1,741 @@
+"""
+API flows run in-process against the in-memory storage backend.
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import cache
+import idempotency
+import scheduling
+import series
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class ApiClient:
+    """Thin wrapper over an httpx client bound to the ASGI app"""
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+
+    async def request(self, method, url, token=None, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return await self.http.request(method, url, headers=headers, **kwargs)
+
+    async def signup(self, email, roles, name='Test User'):
+        response = await self.request('POST', '/api/auth/signup', json={
+            'fullName': name, 'email': email, 'phone': '555-0100', 'password': 'password123', 'roles': roles,
+        })
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return body['user']['id'], body['access_token']
+
+    async def trainer(self, email='trainer@example.com', **profile):
+        user_id, token = await self.signup(email, ['trainer'], 'Test Trainer')
+        response = await self.request('POST', '/api/trainer-profiles', token, json={
+            'userId': user_id, 'bio': 'Test trainer', 'trainingStyles': ['strength'],
+            'ratePerMinuteCents': 100, 'latitude': 39.29, 'longitude': -76.61, **profile,
+        })
+        assert response.status_code == 200, response.text
+        return user_id, token
+
+
+def api_call(scenario):
+    """Run ``scenario(api)`` against the app"""
+    async def main():
+        import server
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            return await scenario(ApiClient(http))
+
+    return run(main())
+
+
+def test_signup_login_and_duplicate_email(memory_db):
+    async def scenario(api):
+        user_id, token = await api.signup('ann@example.com', ['trainee'])
+
+        duplicate = await api.request('POST', '/api/auth/signup', json={
+            'fullName': 'Ann', 'email': 'Ann@Example.com', 'phone': '1', 'password': 'x', 'roles': ['trainee'],
+        })
+        assert duplicate.status_code == 400
+        assert duplicate.json()['detail'] == 'Email already registered'
+
+        login = await api.request('POST', '/api/auth/login', json={'email': 'ANN@example.com', 'password': 'password123'})
+        assert login.status_code == 200
+        assert login.json()['user']['id'] == user_id
+        assert login.json()['user']['email'] == 'ann@example.com'
+
+        wrong = await api.request('POST', '/api/auth/login', json={'email': 'ann@example.com', 'password': 'nope'})
+        assert wrong.status_code == 401
+
+        me = await api.request('GET', '/api/auth/me', token)
+        assert me.json()['email'] == 'ann@example.com'
+
+    api_call(scenario)
+
+
+def test_booking_flow(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+
+        start = (datetime.utcnow() + timedelta(days=2)).replace(microsecond=0)
+        booked = await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'sessionDateTimeStart': start.isoformat(),
+            'durationMinutes': 60, 'locationType': 'gym',
+        })
+        assert booked.status_code == 200, booked.text
+        session = booked.json()
+        assert session['status'] == 'requested'
+        assert session['finalSessionPriceCents'] == 6000
+
+        listed = await api.request('GET', '/api/trainer/sessions', trainer_token)
+        assert [s['id'] for s in listed.json()] == [session['id']]
+
+        accepted = await api.request('PATCH', f"/api/sessions/{session['id']}/accept", trainer_token)
+        assert accepted.json()['status'] == 'confirmed'
+
+        forbidden = await api.request('PATCH', f"/api/sessions/{session['id']}/decline", trainee_token)
+        assert forbidden.status_code == 403
+
+        # The third booking with the same trainer within 30 days is discounted; declined ones do not count
+        async def book(days):
+            response = await api.request('POST', '/api/sessions', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+                'sessionDateTimeStart': (start + timedelta(days=days)).isoformat(),
+            })
+            assert response.status_code == 200, response.text
+            return response.json()
+
+        second = await book(1)
+        assert second['discountType'] is None
+        await api.request('PATCH', f"/api/sessions/{second['id']}/decline", trainer_token)
+        assert (await book(2))['discountType'] is None
+        third = await book(3)
+        assert third['discountType'] == 'multi_session'
+        assert third['finalSessionPriceCents'] == 5700
+
+    api_call(scenario)
+
+
+def test_profile_and_ratings_conditional_get(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+
+        first = await api.request('GET', f'/api/trainer-profiles/{trainer_id}')
+        etag = first.headers['etag']
+        cached = await api.request('GET', f'/api/trainer-profiles/{trainer_id}', headers={'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert cached.content == b''
+        weak = await api.request('GET', f'/api/trainer-profiles/{trainer_id}', headers={'If-None-Match': f'W/{etag}'})
+        assert weak.status_code == 304
+
+        await api.request('PATCH', '/api/trainer-profiles/toggle-availability?isAvailable=false', trainer_token)
+        changed = await api.request('GET', f'/api/trainer-profiles/{trainer_id}', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['etag'] != etag
+        assert changed.json()['isAvailable'] is False
+
+        ratings = await api.request('GET', f'/api/trainers/{trainer_id}/ratings')
+        assert ratings.json() == []
+        ratings_etag = ratings.headers['etag']
+        assert (await api.request('GET', f'/api/trainers/{trainer_id}/ratings',
+                                  headers={'If-None-Match': ratings_etag})).status_code == 304
+
+        start = (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0)
+        session = (await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'sessionDateTimeStart': start.isoformat(),
+            'durationMinutes': 30, 'locationType': 'gym',
+        })).json()
+        await api.request('PATCH', f"/api/sessions/{session['id']}/complete", trainee_token)
+        profile_etag = (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).headers['etag']
+        rated = await api.request('POST', '/api/ratings', trainee_token, json={
+            'sessionId': session['id'], 'traineeId': trainee_id, 'trainerId': trainer_id, 'rating': 5,
+        })
+        assert rated.status_code == 200, rated.text
+
+        after = await api.request('GET', f'/api/trainers/{trainer_id}/ratings', headers={'If-None-Match': ratings_etag})
+        assert after.status_code == 200
+        assert len(after.json()) == 1
+        # The rating moved averageRating, so the profile changed too
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}',
+                                  headers={'If-None-Match': profile_etag})).status_code == 200
+
+    api_call(scenario)
+
+
+def test_ratings_are_counted_only_for_full_pages(memory_db, monkeypatch):
+    import server
+
+    counted = []
+    count_documents = memory_db.ratings.count_documents
+
+    async def counting(query, *args, **kwargs):
+        counted.append(query['trainerId'])
+        return await count_documents(query, *args, **kwargs)
+
+    monkeypatch.setattr(memory_db.ratings, 'count_documents', counting)
+    start = datetime(2026, 1, 1)
+    run(memory_db.ratings.insert_many([{
+        'sessionId': f'session-{trainer_id}-{i}', 'traineeId': 'trainee', 'trainerId': trainer_id,
+        'rating': 5, 'createdAt': start + timedelta(minutes=i),
+    } for trainer_id, ratings in (('few', 3), ('many', server.RATINGS_PAGE_SIZE + 5)) for i in range(ratings)]))
+
+    async def scenario(api):
+        few = await api.request('GET', '/api/trainers/few/ratings')
+        assert len(few.json()) == 3
+        assert counted == []
+        # The ETag of an uncounted page is the one conditional requests compute
+        assert (await api.request('GET', '/api/trainers/few/ratings',
+                                  headers={'If-None-Match': few.headers['etag']})).status_code == 304
+        assert counted == ['few']
+
+        many = await api.request('GET', '/api/trainers/many/ratings')
+        assert len(many.json()) == server.RATINGS_PAGE_SIZE
+        assert counted == ['few', 'many']
+        assert (await api.request('GET', '/api/trainers/many/ratings',
+                                  headers={'If-None-Match': many.headers['etag']})).status_code == 304
+
+    api_call(scenario)
+
+
+def test_profile_cache_is_invalidated_by_writes(memory_db):
+    async def scenario(api):
+        import server
+
+        trainer_id, trainer_token = await api.trainer()
+        admin_id, admin_token = await api.signup('admin@example.com', ['trainee'])
+        await memory_db.users.update_one({'email': 'admin@example.com'}, {'$set': {'isAdmin': True}})
+
+        first = (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()
+        hits = server.trainer_profile_cache.hits
+        await api.request('GET', f'/api/trainer-profiles/{trainer_id}')
+        assert server.trainer_profile_cache.hits == hits + 1
+
+        verified = await api.request('PATCH', f"/api/admin/trainers/{first['id']}/verify?verified=true", admin_token)
+        assert verified.status_code == 200, verified.text
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()['isVerified'] is True
+
+        etag = (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).headers['etag']
+        uploaded = await api.request('POST', '/api/trainer-profiles/upload-documents', trainer_token, json=['doc-1'])
+        assert uploaded.status_code == 200, uploaded.text
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).headers['etag'] != etag
+
+        await api.request('POST', '/api/trainer-profiles', trainer_token, json={
+            'userId': trainer_id, 'bio': 'Updated bio', 'trainingStyles': ['yoga'], 'ratePerMinuteCents': 150,
+        })
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()['bio'] == 'Updated bio'
+
+        await api.request('DELETE', '/api/auth/me', trainer_token)
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).status_code == 404
+
+    api_call(scenario)
+
+
+def test_profile_resave_keeps_stats_and_patch_is_partial(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        await memory_db.trainer_profiles.update_one(
+            {'userId': trainer_id}, {'$set': {'averageRating': 4.5, 'totalSessionsCompleted': 3, 'isVerified': True}})
+        created_at = (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()['createdAt']
+
+        resaved = await api.request('POST', '/api/trainer-profiles', trainer_token, json={
+            'userId': trainer_id, 'bio': 'New bio', 'trainingStyles': ['yoga'], 'ratePerMinuteCents': 120,
+        })
+        body = resaved.json()
+        assert body['bio'] == 'New bio'
+        assert (body['averageRating'], body['totalSessionsCompleted'], body['isVerified']) == (4.5, 3, True)
+        assert body['createdAt'] == created_at
+        assert await memory_db.trainer_profiles.count_documents({'userId': trainer_id}) == 1
+
+        patched = await api.request('PATCH', '/api/trainer-profiles/me', trainer_token, json={'ratePerMinuteCents': 200})
+        assert patched.status_code == 200, patched.text
+        assert patched.json()['ratePerMinuteCents'] == 200
+        assert patched.json()['bio'] == 'New bio'
+        assert (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()['ratePerMinuteCents'] == 200
+
+        rejected = await api.request('PATCH', '/api/trainer-profiles/me', trainer_token, json={'isAvailable': None})
+        assert rejected.status_code == 422
+
+        _, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        missing = await api.request('PATCH', '/api/trainee-profiles/me', trainee_token, json={'fitnessGoals': 'Run'})
+        assert missing.status_code == 404
+
+    api_call(scenario)
+
+
+def test_session_lists_are_paged(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        start = (datetime.utcnow() + timedelta(days=1)).replace(hour=6, minute=0, second=0, microsecond=0)
+        # Two sessions per day at 06:00 and 07:00 for ten days
+        expected = []
+        for day in range(10):
+            for hour in (0, 1):
+                booked = await api.request('POST', '/api/sessions', trainee_token, json={
+                    'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': 30, 'locationType': 'gym',
+                    'sessionDateTimeStart': (start + timedelta(days=day, hours=hour)).isoformat(),
+                })
+                expected.append(booked.json()['id'])
+        expected.reverse()
+
+        async def pages(url, token, **params):
+            ids, cursor = [], None
+            while True:
+                response = await api.request('GET', url, token, params={**params, **({'cursor': cursor} if cursor else {})})
+                assert response.status_code == 200, response.text
+                ids.extend(s['id'] for s in response.json())
+                cursor = response.headers.get('X-Next-Cursor')
+                if cursor is None:
+                    return ids
+
+        assert await pages('/api/trainer/sessions', trainer_token, limit=3) == expected
+        assert await pages('/api/trainee/sessions', trainee_token, limit=7) == expected
+        full = await api.request('GET', '/api/trainee/sessions', trainee_token)
+        assert 'X-Next-Cursor' not in full.headers
+
+        # Sessions starting within [from, to), newest first
+        week = await pages('/api/trainee/sessions', trainee_token, limit=4, **{
+            'from': start.isoformat(), 'to': (start + timedelta(days=7)).isoformat(),
+        })
+        assert week == expected[-14:]
+        # Times with an offset are converted to UTC first
+        offset = (start + timedelta(days=9, hours=-5)).isoformat() + '-05:00'
+        assert await pages('/api/trainer/sessions', trainer_token, **{'from': offset}) == expected[:2]
+
+        assert (await api.request('GET', '/api/trainer/sessions', trainer_token,
+                                  params={'cursor': 'not-a-cursor'})).status_code == 400
+        assert (await api.request('GET', '/api/trainer/sessions', trainer_token,
+                                  params={'limit': 1000})).status_code == 422
+
+    api_call(scenario)
+
+
+def test_session_transitions_are_conditional(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        _, stranger_token = await api.signup('stranger@example.com', ['trainee'])
+
+        async def book():
+            start = (datetime.utcnow() + timedelta(days=2)).replace(microsecond=0)
+            response = await api.request('POST', '/api/sessions', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id, 'sessionDateTimeStart': start.isoformat(),
+                'durationMinutes': 60, 'locationType': 'gym',
+            })
+            return response.json()['id']
+
+        pending = await book()
+        cancelled = await api.request('PATCH', f'/api/sessions/{pending}/cancel', trainee_token)
+        assert (cancelled.json()['cancellationFeeCents'], cancelled.json()['refundAmountCents']) == (0, 6000)
+
+        confirmed = await book()
+        await api.request('PATCH', f'/api/sessions/{confirmed}/accept', trainer_token)
+        cancelled = await api.request('PATCH', f'/api/sessions/{confirmed}/cancel', trainee_token)
+        assert cancelled.status_code == 200, cancelled.text
+        assert (cancelled.json()['cancellationFeeCents'], cancelled.json()['refundAmountCents']) == (1200, 4800)
+        assert cancelled.json()['session']['status'] == 'cancelled'
+        again = await api.request('PATCH', f'/api/sessions/{confirmed}/cancel', trainee_token)
+        assert again.status_code == 400
+
+        session_id = await book()
+        assert (await api.request('PATCH', f'/api/sessions/{session_id}/complete', stranger_token)).status_code == 403
+        results = await asyncio.gather(*[
+            api.request('PATCH', f'/api/sessions/{session_id}/complete', token)
+            for token in (trainer_token, trainee_token, trainer_token)
+        ])
+        assert sorted(r.status_code for r in results) == [200, 400, 400]
+        profile = (await api.request('GET', f'/api/trainer-profiles/{trainer_id}')).json()
+        assert profile['totalSessionsCompleted'] == 1
+
+        missing = await api.request('PATCH', '/api/sessions/000000000000000000000000/accept', trainer_token)
+        assert missing.status_code == 404
+        invalid = await api.request('PATCH', '/api/sessions/not-an-id/accept', trainer_token)
+        assert invalid.status_code == 400
+
+    api_call(scenario)
+
+
+def test_double_booking_is_rejected(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        start = (datetime.utcnow() + timedelta(days=3)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+        async def book(offset_minutes, duration=60):
+            return await api.request('POST', '/api/sessions', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': duration, 'locationType': 'gym',
+                'sessionDateTimeStart': (start + timedelta(minutes=offset_minutes)).isoformat(),
+            })
+
+        first = await book(0)
+        assert first.status_code == 200, first.text
+        assert (await book(30)).status_code == 409
+        assert (await book(-30)).status_code == 409
+        assert (await book(60)).status_code == 200
+        assert (await book(-60)).status_code == 200
+        assert (await book(0, duration=600)).status_code == 400
+
+        # The app sends toISOString() values, which are offset-aware; they are compared as UTC
+        zulu = await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'sessionDateTimeStart': (start + timedelta(minutes=30)).isoformat() + 'Z',
+        })
+        assert zulu.status_code == 409, zulu.text
+        stored = await memory_db.sessions.find_one({'_id': ObjectId(first.json()['id'])})
+        assert stored['sessionDateTimeStart'].tzinfo is None
+
+        # Concurrent requests for the same free slot: exactly one wins
+        results = await asyncio.gather(*[book(180) for _ in range(3)])
+        assert sorted(r.status_code for r in results) == [200, 409, 409]
+
+        # Declining frees the time again
+        await api.request('PATCH', f"/api/sessions/{first.json()['id']}/decline", trainer_token)
+        assert (await book(15, duration=30)).status_code == 200
+
+        # Two bookings that both passed the range check: the slot index lets only one through
+        later = start + timedelta(days=1)
+        await scheduling.reserve_slots(memory_db.session_slots, trainer_id,
+                                       [(ObjectId(), later, later + timedelta(minutes=45))])
+        loser = ObjectId()
+        with pytest.raises(HTTPException) as rejected:
+            await scheduling.reserve_slots(memory_db.session_slots, trainer_id,
+                                           [(loser, later - timedelta(minutes=15), later + timedelta(minutes=15))])
+        assert rejected.value.status_code == 409
+        assert await memory_db.session_slots.count_documents({'sessionId': loser}) == 0
+
+    api_call(scenario)
+
+
+def test_free_slots_follow_bookings(memory_db):
+    async def scenario(api):
+        day = (datetime.utcnow() + timedelta(days=2)).date()
+        weekday = day.strftime('%A').lower()
+        trainer_id, trainer_token = await api.trainer(
+            sessionDurationsOffered=[60], availability={weekday: [{'start': '09:00', 'end': '11:00'}]})
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+
+        async def free_starts():
+            response = await api.request('GET', f'/api/trainers/{trainer_id}/free-slots',
+                                         params={'from': day.isoformat(), 'to': day.isoformat()})
+            assert response.status_code == 200, response.text
+            return [slot['start'][11:16] for slot in response.json()['slots']['60']]
+
+        assert await free_starts() == ['09:00', '09:15', '09:30', '09:45', '10:00']
+
+        booked = await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'sessionDateTimeStart': f'{day.isoformat()}T09:30:00',
+        })
+        assert booked.status_code == 200, booked.text
+        assert await free_starts() == []
+
+        await api.request('PATCH', f"/api/sessions/{booked.json()['id']}/cancel", trainee_token)
+        assert len(await free_starts()) == 5
+
+        # Offset-aware starts, as the app sends them, are stored as naive UTC like any other
+        for start in ('09:00', '10:00'):
+            zulu = await api.request('POST', '/api/sessions', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+                'sessionDateTimeStart': f'{day.isoformat()}T{start}:00Z',
+            })
+            assert zulu.status_code == 200, zulu.text
+        assert await free_starts() == []
+
+        invalid = await api.request('PATCH', '/api/trainer-profiles/me', trainer_token,
+                                    json={'availability': {'monday': [{'start': 'noon', 'end': '13:00'}]}})
+        assert invalid.status_code == 400
+        too_long = await api.request('GET', f'/api/trainers/{trainer_id}/free-slots',
+                                     params={'from': day.isoformat(), 'to': (day + timedelta(days=60)).isoformat()})
+        assert too_long.status_code == 400
+
+    api_call(scenario)
+
+
+def test_calendar_feed(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+
+        assert (await api.request('POST', '/api/trainer/calendar-feed', trainee_token)).status_code == 403
+        created = await api.request('POST', '/api/trainer/calendar-feed', trainer_token)
+        assert created.status_code == 200, created.text
+        url = created.json()['url']
+        assert url.startswith('http://test/api/calendar/') and url.endswith('.ics')
+
+        start = (datetime.utcnow() + timedelta(days=2)).replace(microsecond=0)
+        session = (await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'sessionDateTimeStart': start.isoformat(),
+            'durationMinutes': 60, 'locationType': 'gym', 'notes': 'Legs, then core',
+        })).json()
+
+        feed = await api.request('GET', url)
+        assert feed.status_code == 200, feed.text
+        assert feed.headers['content-type'] == 'text/calendar; charset=utf-8'
+        assert feed.text.startswith('BEGIN:VCALENDAR\r\n') and feed.text.endswith('END:VCALENDAR\r\n')
+        assert f"UID:{session['id']}@rapidreps" in feed.text
+        assert f"DTSTART:{start.strftime('%Y%m%dT%H%M%SZ')}" in feed.text
+        assert 'STATUS:TENTATIVE' in feed.text
+        assert 'DESCRIPTION:Legs\\, then core' in feed.text
+
+        # Unchanged feeds are revalidated from the cached feed document alone
+        etag, last_modified = feed.headers['etag'], feed.headers['last-modified']
+        finds = []
+        original_find_one = memory_db.calendar_feeds.find_one
+
+        async def counting_find_one(*args, **kwargs):
+            finds.append(args)
+            return await original_find_one(*args, **kwargs)
+
+        memory_db.calendar_feeds.find_one = counting_find_one
+        assert (await api.request('GET', url, headers={'If-None-Match': etag})).status_code == 304
+        assert (await api.request('GET', url, headers={'If-Modified-Since': last_modified})).status_code == 304
+        assert finds == []
+
+        await api.request('PATCH', f"/api/sessions/{session['id']}/accept", trainer_token)
+        accepted = await api.request('GET', url, headers={'If-None-Match': etag})
+        assert accepted.status_code == 200
+        assert accepted.headers['etag'] != etag
+        assert 'STATUS:CONFIRMED' in accepted.text
+
+        await api.request('PATCH', f"/api/sessions/{session['id']}/cancel", trainee_token)
+        cancelled = await api.request('GET', url, headers={'If-None-Match': accepted.headers['etag']})
+        assert cancelled.status_code == 200
+        assert 'BEGIN:VEVENT' not in cancelled.text
+
+        # A series shows in full, including the occurrences beyond the booking horizon
+        created_series = await api.request('POST', '/api/session-series', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'firstSessionStart': start.isoformat(),
+            'durationMinutes': 60, 'occurrences': 10, 'locationType': 'gym',
+        })
+        assert created_series.status_code == 200, created_series.text
+        assert created_series.json()['materializedCount'] == 4
+        with_series = await api.request('GET', url, headers={'If-None-Match': cancelled.headers['etag']})
+        assert with_series.status_code == 200
+        assert with_series.text.count('BEGIN:VEVENT') == 10
+        stored = await memory_db.session_series.find_one({'_id': ObjectId(created_series.json()['id'])})
+        assert all(f'UID:{occurrence_id}@rapidreps' in with_series.text for occurrence_id in stored['occurrenceIds'])
+        assert f"DTSTART:{(start + timedelta(weeks=9)).strftime('%Y%m%dT%H%M%SZ')}" in with_series.text
+
+        # A new URL replaces the old one
+        rotated = (await api.request('POST', '/api/trainer/calendar-feed', trainer_token)).json()['url']
+        assert (await api.request('GET', url)).status_code == 404
+        assert (await api.request('GET', rotated)).status_code == 200
+        assert (await api.request('GET', f'/api/calendar/{trainer_id}.guess.ics')).status_code == 404
+        assert (await api.request('GET', '/api/calendar/garbage.ics')).status_code == 404
+
+    api_call(scenario)
+
+
+def test_session_series(memory_db):
+    async def scenario(api):
+        start = (datetime.utcnow() + timedelta(days=2)).replace(hour=9, minute=0, second=0, microsecond=0)
+        trainer_id, trainer_token = await api.trainer(
+            sessionDurationsOffered=[60],
+            availability={start.strftime('%A').lower(): [{'start': '08:00', 'end': '11:00'}]})
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        other_id, other_token = await api.signup('other@example.com', ['trainee'])
+
+        async def book_single(token, booker_id, week):
+            response = await api.request('POST', '/api/sessions', token, json={
+                'traineeId': booker_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+                'sessionDateTimeStart': (start + timedelta(weeks=week, minutes=30)).isoformat(),
+            })
+            assert response.status_code == 200, response.text
+            return response.json()['id']
+
+        async def create_series(**overrides):
+            return await api.request('POST', '/api/session-series', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id, 'firstSessionStart': start.isoformat(),
+                'durationMinutes': 60, 'occurrences': 10, 'locationType': 'gym', **overrides,
+            })
+
+        # Every occurrence is checked up front, including ones far beyond the horizon
+        clash = await book_single(other_token, other_id, 8)
+        rejected = await create_series()
+        assert rejected.status_code == 409
+        assert (start + timedelta(weeks=8)).isoformat() in rejected.json()['detail']
+        assert (await create_series(occurrences=500)).status_code == 400
+        await api.request('PATCH', f'/api/sessions/{clash}/decline', trainer_token)
+
+        created = await create_series()
+        assert created.status_code == 200, created.text
+        body = created.json()
+        assert body['timezone'] == 'UTC'
+        assert body['materializedCount'] == 4
+        booked = body['sessions']
+        assert [s['sessionDateTimeStart'] for s in booked] == [
+            (start + timedelta(weeks=week)).isoformat() for week in range(4)
+        ]
+        # Priced together: from the third session on, the multi-session discount applies
+        assert [s['discountType'] for s in booked] == [None, None, 'multi_session', 'multi_session']
+        assert await memory_db.sessions.count_documents({'seriesId': body['id']}) == 4
+
+        # The series holds the trainer's time for single bookings too
+        assert (await api.request('POST', '/api/sessions', other_token, json={
+            'traineeId': other_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'sessionDateTimeStart': (start + timedelta(weeks=1)).isoformat(),
+        })).status_code == 409
+
+        # ... including the weeks beyond the horizon that have no session document yet
+        week_six = await api.request('POST', '/api/sessions', other_token, json={
+            'traineeId': other_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'sessionDateTimeStart': (start + timedelta(weeks=6, minutes=30)).isoformat(),
+        })
+        assert week_six.status_code == 409
+        day = (start + timedelta(weeks=6)).date().isoformat()
+        free = await api.request('GET', f'/api/trainers/{trainer_id}/free-slots', params={'from': day, 'to': day})
+        assert [slot['start'][11:16] for slot in free.json()['slots']['60']] == ['08:00', '10:00']
+        overlapping = await api.request('POST', '/api/session-series', other_token, json={
+            'traineeId': other_id, 'trainerId': trainer_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'firstSessionStart': (start + timedelta(weeks=5)).isoformat(), 'occurrences': 3,
+        })
+        assert overlapping.status_code == 409
+        assert (start + timedelta(weeks=6)).isoformat() in overlapping.json()['detail']
+
+        # Later occurrences are booked once the horizon reaches them
+        later = await series.materialize_due(memory_db, {'traineeId': trainee_id},
+                                             now=datetime.utcnow() + timedelta(weeks=4))
+        assert [doc['occurrenceIndex'] for doc in later] == [4, 5, 6, 7]
+        assert all(doc['discountType'] == 'multi_session' for doc in later)
+        assert await series.materialize_due(memory_db, {'traineeId': trainee_id},
+                                            now=datetime.utcnow() + timedelta(weeks=4)) == []
+        stored = await memory_db.session_series.find_one({'traineeId': trainee_id})
+        assert stored['materializedCount'] == 8
+
+        # Listing sessions materializes whatever has become due; nothing is due yet here
+        listed = await api.request('GET', '/api/trainee/sessions', trainee_token)
+        assert len(listed.json()) == 8
+
+        # Cancelling stops the rest of the series and gives their time back
+        cancel_url = f"/api/session-series/{body['id']}/cancel"
+        assert (await api.request('PATCH', cancel_url, other_token)).status_code == 403
+        cancelled = await api.request('PATCH', cancel_url, trainee_token)
+        assert cancelled.status_code == 200, cancelled.text
+        assert cancelled.json()['cancelledBy'] == 'trainee'
+        assert (await api.request('PATCH', cancel_url, trainer_token)).status_code == 409
+        await book_single(other_token, other_id, 8)
+        assert await series.materialize_due(memory_db, {'traineeId': trainee_id},
+                                            now=datetime.utcnow() + timedelta(weeks=10)) == []
+        assert await memory_db.sessions.count_documents({'seriesId': body['id']}) == 8
+
+    api_call(scenario)
+
+
+def test_series_keeps_local_time_across_dst():
+    tz = series.ZoneInfo('America/New_York')
+    starts = series.occurrence_starts(datetime(2026, 10, 26, 13, 0), tz, 1, 3)
+    # 09:00 in New York before and after clocks go back on 1 November
+    assert starts == [datetime(2026, 10, 26, 13, 0), datetime(2026, 11, 2, 14, 0), datetime(2026, 11, 9, 14, 0)]
+
+
+def test_search_by_availability(memory_db):
+    async def scenario(api):
+        day = (datetime.utcnow() + timedelta(days=3)).date()
+        weekday = day.strftime('%A').lower()
+        mornings = {weekday: [{'start': '08:00', 'end': '12:00'}]}
+        early_id, _ = await api.trainer('early@example.com', availability=mornings)
+        booked_id, _ = await api.trainer('booked@example.com', availability=mornings)
+        await api.trainer('late@example.com', availability={weekday: [{'start': '13:00', 'end': '18:00'}]})
+        await api.trainer('unset@example.com')
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        await api.request('POST', '/api/sessions', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': booked_id, 'durationMinutes': 60, 'locationType': 'gym',
+            'sessionDateTimeStart': f'{day.isoformat()}T09:30:00',
+        })
+
+        async def search(at, minutes=60):
+            response = await api.request('GET', '/api/trainers/search', trainee_token, params={
+                'latitude': 39.29, 'longitude': -76.61, 'availableAt': at, 'availableMinutes': minutes,
+            })
+            assert response.status_code == 200, response.text
+            return {trainer['userId'] for trainer in response.json()}
+
+        assert await search(f'{day.isoformat()}T09:00:00') == {early_id}
+        assert await search(f'{day.isoformat()}T08:00:00') == {early_id, booked_id}
+        assert await search(f'{day.isoformat()}T11:00:00') == {early_id, booked_id}
+        assert await search(f'{day.isoformat()}T11:30:00', minutes=30) == {early_id, booked_id}
+        assert await search(f'{day.isoformat()}T11:30:00') == set()
+        # Times with an offset are converted to UTC first
+        assert await search(f'{day.isoformat()}T04:00:00-05:00') == {early_id}
+
+        unfiltered = await api.request('GET', '/api/trainers/search', trainee_token,
+                                       params={'latitude': 39.29, 'longitude': -76.61})
+        assert len(unfiltered.json()) == 4
+
+    api_call(scenario)
+
+
+def test_idempotency_keys_replay_responses(memory_db):
+    async def scenario(api):
+        trainer_id, trainer_token = await api.trainer()
+        trainee_id, trainee_token = await api.signup('trainee@example.com', ['trainee'])
+        start = (datetime.utcnow() + timedelta(days=2)).replace(microsecond=0)
+        booking = {
+            'traineeId': trainee_id, 'trainerId': trainer_id, 'sessionDateTimeStart': start.isoformat(),
+            'durationMinutes': 60, 'locationType': 'gym',
+        }
+
+        async def post(url, token, payload, key):
+            return await api.request('POST', url, token, json=payload, headers={'Idempotency-Key': key})
+
+        first = await post('/api/sessions', trainee_token, booking, 'booking-1')
+        assert first.status_code == 200, first.text
+        retry = await post('/api/sessions', trainee_token, booking, 'booking-1')
+        assert retry.status_code == 200
+        assert retry.json() == first.json()
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert await memory_db.sessions.count_documents({}) == 1
+
+        # Replays survive the in-process cache (another worker, or after a restart)
+        cache.clear_all()
+        assert (await post('/api/sessions', trainee_token, booking, 'booking-1')).json() == first.json()
+
+        # The same key with a different payload is refused; another caller's key is independent
+        changed = await post('/api/sessions', trainee_token, {**booking, 'durationMinutes': 30}, 'booking-1')
+        assert changed.status_code == 422
+        message = {'receiverId': trainee_id, 'content': 'See you then'}
+        sent = await post('/api/messages', trainer_token, message, 'booking-1')
+        assert sent.status_code == 200, sent.text
+        assert 'Idempotent-Replayed' not in sent.headers
+        assert (await post('/api/messages', trainer_token, message, 'booking-1')).json() == sent.json()
+        assert await memory_db.messages.count_documents({}) == 1
+
+        # A retry that arrives while the original is still running is told to wait
+        headers = [(b'authorization', f'Bearer {trainee_token}'.encode())]
+        record_id = idempotency.scoped_key(headers, 'POST', '/api/sessions', b'booking-2')
+        await memory_db.idempotency_keys.insert_one({
+            '_id': record_id, 'state': 'pending', 'fingerprint': hashlib.sha256(b'').hexdigest(),
+            'createdAt': datetime.utcnow(),
+            'lockedUntil': datetime.utcnow() + timedelta(minutes=1), 'expiresAt': datetime.utcnow() + timedelta(days=1),
+        })
+        in_progress = await api.request('POST', '/api/sessions', trainee_token, content=b'',
+                                        headers={'Idempotency-Key': 'booking-2'})
+        assert in_progress.status_code == 409
+        # ...unless its worker died and the lock ran out
+        await memory_db.idempotency_keys.update_one(
+            {'_id': record_id}, {'$set': {'lockedUntil': datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        later = {**booking, 'sessionDateTimeStart': (start + timedelta(days=1)).isoformat()}
+        taken_over = await post('/api/sessions', trainee_token, later, 'booking-2')
+        assert taken_over.status_code == 200, taken_over.text
+
+        # Without a key, nothing changes
+        again = await api.request('POST', '/api/sessions', trainee_token, json=booking)
+        assert again.status_code == 409
+
+    api_call(scenario)
@@ -0,0 +1,74 @@
+"""
+Weekly templates, day bitmaps and free-slot search.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from availability import (
+    Calendar, InvalidTemplate, build_calendar, decode_masks, encode_masks, free_slots, range_mask, required_buckets,
+    weekly_masks,
+)
+from storage import MemoryClient
+
+# A Monday
+MONDAY = date(2030, 1, 7)
+
+
+def test_template_becomes_weekday_masks():
+    masks = weekly_masks({'monday': [{'start': '09:00', 'end': '10:00'}, {'start': '12:10', 'end': '13:20'}]})
+    # 12:10 rounds up and 13:20 down, so the window never grows
+    assert masks[0] == range_mask(36, 40) | range_mask(49, 53)
+    assert masks[1:] == [0] * 6
+    assert weekly_masks({'sunday': [{'start': '00:00', 'end': '24:00'}]})[6] == range_mask(0, 96)
+
+    for bad in ({'funday': []}, {'monday': [{'start': '9am', 'end': '10:00'}]}, {'monday': {'start': '09:00'}}):
+        with pytest.raises(InvalidTemplate):
+            weekly_masks(bad)
+
+
+def test_free_slots_fit_each_duration():
+    calendar = Calendar('UTC', MONDAY, [range_mask(36, 40)])
+    slots = free_slots(calendar, [30, 60, 90], datetime(2030, 1, 1))
+    nine = datetime(2030, 1, 7, 9)
+    assert [start for start, _ in slots[30]] == [nine + timedelta(minutes=m) for m in (0, 15, 30)]
+    assert slots[60] == [(nine, nine + timedelta(minutes=60))]
+    assert slots[90] == []
+
+    later = free_slots(calendar, [30], nine + timedelta(minutes=20))
+    assert [start for start, _ in later[30]] == [nine + timedelta(minutes=30)]
+
+
+def test_calendar_clears_active_sessions_in_local_time():
+    async def scenario():
+        sessions = MemoryClient()['availability_test'].sessions
+        # 14:00-15:00 UTC is 09:00-10:00 in New York in January
+        await sessions.insert_many([
+            {'trainerId': 't', 'status': 'confirmed', 'sessionDateTimeStart': datetime(2030, 1, 7, 14),
+             'sessionDateTimeEnd': datetime(2030, 1, 7, 15)},
+            {'trainerId': 't', 'status': 'cancelled', 'sessionDateTimeStart': datetime(2030, 1, 7, 16),
+             'sessionDateTimeEnd': datetime(2030, 1, 7, 17)},
+        ])
+        template = {'timezone': 'America/New_York', 'monday': [{'start': '08:00', 'end': '12:00'}]}
+        calendar = await build_calendar(sessions, 't', template, MONDAY, 7)
+        assert calendar.masks[0] == range_mask(32, 36) | range_mask(40, 48)
+        assert calendar.masks[1:] == [0] * 6
+
+        slots = free_slots(calendar, [60], datetime(2030, 1, 1))
+        # Slots come back in UTC
+        assert [start.hour for start, _ in slots[60]] == [13, 15, 15, 15, 15, 16]
+
+    asyncio.run(scenario())
+
+
+def test_search_masks_round_trip_and_cover_midnight():
+    masks = weekly_masks({'monday': [{'start': '22:00', 'end': '24:00'}], 'tuesday': [{'start': '00:00', 'end': '01:00'}]})
+    assert decode_masks(encode_masks(masks)) == masks
+    assert len(encode_masks(masks)) == 7 * 12
+
+    # Monday 23:30 UTC for an hour needs the last two buckets of Monday and the first two of Tuesday
+    required = required_buckets(datetime(2030, 1, 7, 23, 30), datetime(2030, 1, 8, 0, 30), ZoneInfo('UTC'))
+    assert required == {0: range_mask(94, 96), 1: range_mask(0, 2)}
+    assert all(masks[weekday] & needed == needed for weekday, needed in required.items())
@@ -0,0 +1,55 @@
+"""
+TTL/LRU behaviour of the read-through cache and its invalidation bus.
+"""
+from cache import LocalInvalidationBus, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(maxsize=3, ttl=10, bus=None):
+    clock = FakeClock()
+    return TTLCache('test_cache', maxsize, ttl, bus=bus or LocalInvalidationBus(), clock=clock), clock
+
+
+def test_entries_expire_after_ttl():
+    cache, clock = make_cache()
+    cache.set('a', 1)
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, _ = make_cache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_invalidation_reaches_every_subscriber_and_discards_racing_fills():
+    bus = LocalInvalidationBus()
+    worker_a, _ = make_cache(bus=bus)
+    worker_b, _ = make_cache(bus=bus)
+    worker_a.set('a', 1)
+    worker_b.set('a', 1)
+
+    version = worker_b.version
+    worker_a.invalidate('a')
+    assert worker_a.get('a') is None and worker_b.get('a') is None
+
+    # A read that started before the write must not repopulate the stale value
+    worker_b.set('a', 'stale', version)
+    assert worker_b.get('a') is None
@@ -0,0 +1,93 @@
+"""
+Compression middleware: negotiation, thresholds and streaming.
+"""
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+
+from compression import CompressionMiddleware, negotiate_encoding
+from metrics import COMPRESSION_BYTES_IN, COMPRESSION_BYTES_OUT
+
+LARGE = {'items': [{'id': i, 'name': f'Trainer {i}', 'bio': 'Certified personal trainer'} for i in range(200)]}
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.get('/large')
+    async def large():
+        return LARGE
+
+    @app.get('/small')
+    async def small():
+        return {'ok': True}
+
+    @app.get('/image')
+    async def image():
+        return Response(b'\x89PNG' * 1000, media_type='image/png')
+
+    @app.get('/stream')
+    async def stream():
+        async def lines():
+            for i in range(50):
+                yield f'line {i} ' * 20 + '\n'
+        return StreamingResponse(lines(), media_type='text/plain')
+
+    @app.get('/etag')
+    async def etag():
+        return PlainTextResponse('x' * 5000, headers={'ETag': '"abc"'})
+
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+    return app
+
+
+def get(path, accept_encoding='gzip'):
+    async def main():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            return await http.get(path, headers={'Accept-Encoding': accept_encoding})
+
+    return asyncio.run(main())
+
+
+def test_negotiation():
+    assert negotiate_encoding('gzip, deflate, br', brotli_available=True) == 'br'
+    assert negotiate_encoding('gzip, deflate, br', brotli_available=False) == 'gzip'
+    assert negotiate_encoding('br;q=0.5, gzip;q=0.8', brotli_available=True) == 'gzip'
+    assert negotiate_encoding('gzip;q=0, identity') is None
+    assert negotiate_encoding('*', brotli_available=False) == 'gzip'
+
+
+def test_large_json_is_compressed_and_metered():
+    bytes_in = COMPRESSION_BYTES_IN.value('gzip')
+    bytes_out = COMPRESSION_BYTES_OUT.value('gzip')
+
+    response = get('/large')
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.json() == LARGE
+    assert int(response.headers['content-length']) < len(response.content)
+
+    assert COMPRESSION_BYTES_IN.value('gzip') - bytes_in == len(response.content)
+    assert COMPRESSION_BYTES_OUT.value('gzip') - bytes_out == int(response.headers['content-length'])
+
+
+def test_small_binary_and_unaccepted_responses_pass_through():
+    assert 'content-encoding' not in get('/small').headers
+    assert 'content-encoding' not in get('/image').headers
+    assert 'content-encoding' not in get('/large', accept_encoding='identity').headers
+
+
+def test_streaming_response_is_compressed_incrementally():
+    response = get('/stream')
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'content-length' not in response.headers
+    assert response.text == ''.join(f'line {i} ' * 20 + '\n' for i in range(50))
+
+
+def test_strong_etag_is_weakened_when_compressed():
+    response = get('/etag')
+    assert response.headers['etag'] == 'W/"abc"'
+    assert response.text == 'x' * 5000
@@ -0,0 +1,126 @@
+"""
+Per-request DB stats: query shapes, the N+1 threshold and the debug headers.
+"""
+import asyncio
+import itertools
+import logging
+from types import SimpleNamespace
+
+import httpx
+
+from db_monitor import RequestQueryStats, RequestStatsListener, documents_returned, query_shape
+
+
+class MonitoredCollection:
+    """Reports each ``find_one`` to a command listener the way the driver does"""
+
+    def __init__(self, collection, listener):
+        self.collection = collection
+        self.listener = listener
+        self.request_ids = itertools.count(1)
+
+    async def find_one(self, query):
+        doc = await self.collection.find_one(query)
+        event = SimpleNamespace(
+            command_name='find', request_id=next(self.request_ids), duration_micros=1500,
+            command={'find': self.collection.name, 'filter': query, 'limit': 1},
+            reply={'cursor': {'firstBatch': [doc] if doc else []}},
+        )
+        self.listener.started(event)
+        self.listener.succeeded(event)
+        return doc
+
+
+def lookups_route(server, lookups):
+    """Route on the real app that looks up a profile per id, one query each"""
+    profiles = MonitoredCollection(server.db.trainer_profiles, RequestStatsListener())
+
+    async def handler():
+        for index in range(lookups):
+            await profiles.find_one({'userId': f'trainer-{index}'})
+        return {'lookups': lookups}
+
+    server.app.add_api_route('/test/lookups', handler)
+    return server.app.router.routes[-1]
+
+
+def get_lookups(memory_db, lookups):
+    import server
+
+    async def main():
+        await memory_db.trainer_profiles.insert_one({'userId': 'trainer-0'})
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            return await http.get('/test/lookups')
+
+    route = lookups_route(server, lookups)
+    try:
+        return asyncio.run(main())
+    finally:
+        server.app.router.routes.remove(route)
+
+
+def test_query_shape_ignores_values():
+    first = query_shape('find', {'find': 'sessions', 'filter': {'trainerId': 'a', 'status': 'confirmed'}})
+    second = query_shape('find', {'find': 'sessions', 'filter': {'status': 'declined', 'trainerId': 'b'}})
+    assert first == second == ('find', 'sessions', ('status', 'trainerId'))
+    assert query_shape('find', {'find': 'sessions', 'filter': {'traineeId': 'a'}}) != first
+    assert query_shape('count', {'count': 'ratings', 'query': {'trainerId': 'a'}}) == ('count', 'ratings', ('trainerId',))
+    assert query_shape('getMore', {'getMore': 123, 'collection': 'messages'}) == ('getMore', 'messages')
+
+
+def test_query_shape_of_updates_and_deletes():
+    update = {'update': 'sessions', 'updates': [{'q': {'_id': 1, 'status': 'requested'}, 'u': {'$set': {}}}]}
+    delete = {'delete': 'session_slots', 'deletes': [{'q': {'sessionId': {'$in': [1, 2]}}, 'limit': 0}]}
+    assert query_shape('update', update) == ('update', 'sessions', ('_id', 'status'))
+    assert query_shape('delete', delete) == ('delete', 'session_slots', ('sessionId',))
+    assert query_shape('insert', {'insert': 'sessions', 'documents': [{}]}) == ('insert', 'sessions', ())
+
+
+def test_documents_returned():
+    assert documents_returned('find', {'cursor': {'firstBatch': [{}, {}]}}) == 2
+    assert documents_returned('getMore', {'cursor': {'nextBatch': [{}]}}) == 1
+    assert documents_returned('findAndModify', {'value': None}) == 0
+    assert documents_returned('insert', {'n': 3}) == 0
+
+
+def test_repeated_shapes_threshold():
+    stats = RequestQueryStats()
+    lookup, listing = ('find', 'trainer_profiles', ('userId',)), ('find', 'sessions', ('trainerId',))
+    for _ in range(3):
+        stats.record(lookup, 2.0, 1)
+    stats.record(listing, 5.0, 20)
+    assert (stats.round_trips, stats.total_ms, stats.docs_returned) == (4, 11.0, 23)
+    assert stats.repeated_shapes(3) == []
+    assert stats.repeated_shapes(2) == [(lookup, 3)]
+    assert stats.repeated_shapes(0) == [(lookup, 3), (listing, 1)]
+
+
+def test_n_plus_one_route_is_counted_and_flagged(memory_db, monkeypatch, caplog):
+    import server
+
+    monkeypatch.setattr(server, 'DEBUG', True)
+    lookups = server.N_PLUS_ONE_THRESHOLD + 2
+    with caplog.at_level(logging.WARNING, logger='server'):
+        response = get_lookups(memory_db, lookups)
+
+    assert response.status_code == 200
+    assert response.headers['X-DB-Queries'] == str(lookups)
+    assert response.headers['X-DB-Time-Ms'] == f'{lookups * 1.5:.1f}'
+    assert response.headers['X-DB-Docs-Returned'] == '1'
+    warnings = [record.getMessage() for record in caplog.records if 'Possible N+1' in record.getMessage()]
+    assert warnings == [
+        f"Possible N+1 query on GET /test/lookups: {lookups}x ('find', 'trainer_profiles', ('userId',))"
+    ]
+
+
+def test_route_under_threshold_is_not_flagged(memory_db, monkeypatch, caplog):
+    import server
+
+    monkeypatch.setattr(server, 'DEBUG', False)
+    with caplog.at_level(logging.WARNING, logger='server'):
+        response = get_lookups(memory_db, server.N_PLUS_ONE_THRESHOLD)
+
+    assert response.status_code == 200
+    assert 'X-DB-Queries' not in response.headers
+    assert not [record for record in caplog.records if 'Possible N+1' in record.getMessage()]
@@ -0,0 +1,83 @@
+"""
+Prometheus exposition: histogram buckets, label escaping and route labels.
+"""
+import asyncio
+
+import httpx
+
+from metrics import HTTP_LATENCY, HTTP_REQUESTS, Counter, Histogram, MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('rr_latency_seconds', 'Latency', ('route',), buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.7, 2.5):
+        histogram.observe(value, '/api/sessions')
+
+    assert histogram.render() == [
+        '# HELP rr_latency_seconds Latency',
+        '# TYPE rr_latency_seconds histogram',
+        'rr_latency_seconds_bucket{route="/api/sessions",le="0.1"} 2',
+        'rr_latency_seconds_bucket{route="/api/sessions",le="0.5"} 3',
+        'rr_latency_seconds_bucket{route="/api/sessions",le="1"} 4',
+        'rr_latency_seconds_bucket{route="/api/sessions",le="+Inf"} 5',
+        'rr_latency_seconds_sum{route="/api/sessions"} 3.65',
+        'rr_latency_seconds_count{route="/api/sessions"} 5',
+    ]
+    assert histogram.snapshot('/api/sessions')['buckets'] == {0.1: 2, 0.5: 1, 1.0: 1, float('inf'): 1}
+    assert histogram.snapshot('/api/other') == {
+        'buckets': {0.1: 0, 0.5: 0, 1.0: 0, float('inf'): 0}, 'sum': 0.0, 'count': 0,
+    }
+
+
+def test_histogram_sum_and_count_per_label_set():
+    histogram = Histogram('rr_queries', 'Queries', ('route',), buckets=(1, 5))
+    for value in (1, 3, 8):
+        histogram.observe(value, 'b')
+    histogram.observe(2, 'a')
+
+    lines = histogram.render()
+    assert 'rr_queries_sum{route="a"} 2' in lines
+    assert 'rr_queries_count{route="a"} 1' in lines
+    assert 'rr_queries_sum{route="b"} 12' in lines
+    assert 'rr_queries_count{route="b"} 3' in lines
+    # Label sets render in sorted order
+    assert lines.index('rr_queries_count{route="a"} 1') < lines.index('rr_queries_bucket{route="b",le="1"} 1')
+
+
+def test_label_values_are_escaped():
+    counter = Counter('rr_errors_total', 'Errors', ('reason',))
+    counter.inc('say "hi"\\now\nthen', amount=2)
+    assert counter.render()[-1] == 'rr_errors_total{reason="say \\"hi\\"\\\\now\\nthen"} 2'
+
+
+def test_registry_renders_metrics_then_collectors():
+    registry = MetricsRegistry()
+    registry.gauge('rr_in_flight', 'In flight').set(value=3)
+
+    def collect():
+        collected = Counter('rr_collected_total', 'Collected', ('cache',))
+        collected.inc('profiles', amount=0.5)
+        return [collected]
+
+    registry.register_collector(collect)
+    assert registry.render().splitlines()[2::3] == ['rr_in_flight 3', 'rr_collected_total{cache="profiles"} 0.5']
+    assert registry.render().endswith('\n')
+
+
+def test_route_labels_use_templates_and_bound_unmatched_paths(memory_db):
+    import server
+
+    async def main():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            await http.get('/api/no-such-route-7f3a')
+            await http.get('/api/trainers/trainer-7f3a/ratings')
+
+    unmatched = HTTP_REQUESTS.value('GET', 'unmatched', '404')
+    ratings = HTTP_LATENCY.snapshot('GET', '/api/trainers/{trainer_id}/ratings')['count']
+    asyncio.run(main())
+
+    assert HTTP_REQUESTS.value('GET', 'unmatched', '404') == unmatched + 1
+    assert HTTP_LATENCY.snapshot('GET', '/api/trainers/{trainer_id}/ratings')['count'] == ratings + 1
+    exposition = server.REGISTRY.render()
+    assert '7f3a' not in exposition
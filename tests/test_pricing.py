@@ -0,0 +1,68 @@
+"""
+Session price math and the per-pair counters behind the multi-session discount.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pricing
+from storage import MemoryClient
+
+
+def test_quote():
+    assert pricing.quote(100, 6000) == {
+        'basePricePerMinuteCents': 100, 'baseSessionPriceCents': 6000, 'discountType': None,
+        'discountAmountCents': 0, 'finalSessionPriceCents': 6000, 'platformFeePercent': 10,
+        'platformFeeCents': 600, 'trainerEarningsCents': 5400,
+    }
+    discounted = pricing.quote(100, 6000, discounted=True)
+    assert discounted['discountType'] == 'multi_session'
+    assert discounted['finalSessionPriceCents'] == 5700
+    assert discounted['platformFeeCents'] + discounted['trainerEarningsCents'] == 5700
+    assert pricing.virtual_quote()['finalSessionPriceCents'] == pricing.VIRTUAL_SESSION_PRICE_CENTS
+
+
+def test_pair_counter_window():
+    async def scenario():
+        counters = MemoryClient()['pricing_test'].pair_counters
+        now = datetime(2026, 3, 1, 12)
+        old = now - timedelta(days=40)
+
+        counter = await pricing.load_pair_counter(counters, 'trainee', 'trainer')
+        assert counter.recent(now) == 0 and not counter.discounted(now)
+        await pricing.record_sessions(counters, counter, 2, old)
+        counter = await pricing.load_pair_counter(counters, 'trainee', 'trainer')
+        # Sessions from before the window do not count, and are dropped on the next booking
+        assert counter.recent(now) == 0
+        assert counter.discounted(now, booked_before=2)
+        await pricing.record_sessions(counters, counter, 2, now)
+        counter = await pricing.load_pair_counter(counters, 'trainee', 'trainer')
+        assert counter.days == {'2026-03-01': 2}
+        assert counter.discounted(now)
+
+        # Declines are forgotten on the day the session was created, unless it already left the window
+        await pricing.forget_session(counters, {'traineeId': 'trainee', 'trainerId': 'trainer', 'createdAt': now}, now)
+        await pricing.forget_session(counters, {'traineeId': 'trainee', 'trainerId': 'trainer', 'createdAt': old}, now)
+        counter = await pricing.load_pair_counter(counters, 'trainee', 'trainer')
+        assert counter.recent(now) == 1 and not counter.discounted(now)
+        assert (await pricing.load_pair_counter(counters, 'trainer', 'trainee')).recent(now) == 0
+
+    asyncio.run(scenario())
+
+
+def test_backfill_pair_counters():
+    async def scenario():
+        db = MemoryClient()['pricing_test']
+        now = datetime(2026, 3, 1, 12)
+        await db.sessions.insert_many([
+            {'traineeId': 'a', 'trainerId': 't', 'status': 'completed', 'createdAt': now - timedelta(days=3)},
+            {'traineeId': 'a', 'trainerId': 't', 'status': 'requested', 'createdAt': now},
+            {'traineeId': 'a', 'trainerId': 't', 'status': 'declined', 'createdAt': now},
+            {'traineeId': 'a', 'trainerId': 't', 'status': 'completed', 'createdAt': now - timedelta(days=45)},
+            {'traineeId': 'b', 'trainerId': 't', 'status': 'confirmed', 'createdAt': now},
+        ])
+        assert await pricing.backfill_pair_counters(db, now) == 2
+        counter = await pricing.load_pair_counter(db.pair_counters, 'a', 't')
+        assert counter.recent(now) == 2 and counter.discounted(now)
+        assert (await pricing.load_pair_counter(db.pair_counters, 'b', 't')).recent(now) == 1
+
+    asyncio.run(scenario())
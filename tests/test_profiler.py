@@ -0,0 +1,90 @@
+"""
+Request profiler: arming, result formats and the pass-through middleware.
+"""
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from profiler import AWAIT_FRAME, ProfileResult, ProfilerMiddleware, RequestProfiler
+
+
+def make_app(profiler):
+    app = FastAPI()
+
+    @app.get('/slow')
+    async def slow():
+        await asyncio.sleep(0.02)
+        return {'ok': True}
+
+    @app.get('/fast')
+    async def fast():
+        return {'ok': True}
+
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+    return app
+
+
+def get(profiler, *paths):
+    async def main():
+        transport = httpx.ASGITransport(app=make_app(profiler))
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+            return [await http.get(path) for path in paths]
+
+    return asyncio.run(main())
+
+
+def test_claim_counts_down_and_disarms():
+    profiler = RequestProfiler()
+    profiler.arm('/api/trainers', requests=2)
+    assert not profiler.claim('/api/sessions')
+    assert profiler.claim('/api/trainers/search')
+    assert profiler.armed == {'/api/trainers': 1}
+    assert profiler.claim('/api/trainers/abc')
+    assert profiler.armed == {}
+    assert not profiler.claim('/api/trainers/search')
+
+    profiler.arm('/api/', requests=5)
+    profiler.disarm()
+    assert not profiler.claim('/api/health')
+
+
+def test_result_formats():
+    result = ProfileResult('GET /api/health', interval_ms=2)
+    result.samples[('handler (server.py:1)', 'serialize (server.py:9)')] += 3
+    result.samples[('handler (server.py:1)', AWAIT_FRAME)] += 1
+
+    assert result.collapsed() == (
+        'handler (server.py:1);serialize (server.py:9) 3\n'
+        f'handler (server.py:1);{AWAIT_FRAME} 1\n'
+    )
+
+    document = result.speedscope()
+    frames = [frame['name'] for frame in document['shared']['frames']]
+    assert frames == ['handler (server.py:1)', 'serialize (server.py:9)', AWAIT_FRAME]
+    [profile] = document['profiles']
+    assert profile['type'] == 'sampled'
+    assert profile['unit'] == 'milliseconds'
+    assert profile['samples'] == [[0, 1], [0, 2]]
+    assert profile['weights'] == [6, 2]
+    assert profile['endValue'] == 8
+    assert result.summary()['sampleCount'] == 4
+
+
+def test_middleware_passes_through_when_disarmed():
+    profiler = RequestProfiler()
+    responses = get(profiler, '/fast', '/slow')
+    assert [r.json() for r in responses] == [{'ok': True}, {'ok': True}]
+    assert list(profiler.results) == []
+
+
+def test_middleware_profiles_armed_requests():
+    profiler = RequestProfiler(interval_ms=1)
+    profiler.arm('/slow', requests=1)
+    responses = get(profiler, '/fast', '/slow', '/slow')
+    assert all(r.status_code == 200 for r in responses)
+    [result] = profiler.results
+    assert result.label == 'GET /slow'
+    assert result.duration_ms >= 20
+    assert sum(result.samples.values()) > 0
+    assert profiler.armed == {}
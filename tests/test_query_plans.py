@@ -0,0 +1,434 @@
+"""
+Query-plan regression suite.
+
+Runs every route in ``server.py`` against a seeded local MongoDB, captures the
+commands each route issues through PyMongo command monitoring and explains
+them. The suite fails when a query plan is a collection scan or examines far
+more documents than it returns.
+
+Needs a reachable MongoDB (``QUERY_PLAN_MONGO_URL``, default
+``mongodb://localhost:27017``) and is skipped otherwise. It works in a scratch
+database that is dropped afterwards. Per-route query counts and docs-examined
+ratios are written to ``QUERY_PLAN_REPORT`` (default
+``tests/reports/query_plans.json``) as a baseline artifact.
+"""
+import asyncio
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+MONGO_URL = os.environ.get('QUERY_PLAN_MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = 'rapidreps_query_plans'
+REPORT_PATH = Path(os.environ.get('QUERY_PLAN_REPORT', Path(__file__).parent / 'reports' / 'query_plans.json'))
+
+# A query may examine up to this many documents per document it returns...
+MAX_DOCS_EXAMINED_RATIO = 10
+# ...but small absolute numbers are never worth flagging
+DOCS_EXAMINED_SLACK = 50
+
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Full scans accepted on purpose, keyed by (route, collection)
+ALLOWED_COLLECTION_SCANS = {
+    ('GET /api/admin/trainers', 'trainer_profiles'): 'admin listing returns every trainer',
+    ('GET /api/admin/revenue', 'sessions'): 'admin report over all completed sessions',
+    ('GET /api/trainers/nearby-trainees', 'trainee_profiles'): 'distance is filtered in Python, no geo index yet',
+}
+
+# Baltimore area, where the seeded marketplace lives
+CENTER_LAT, CENTER_LON = 39.2904, -76.6122
+
+
+def _mongo_available() -> bool:
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000).admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _mongo_available(), reason=f'MongoDB not reachable at {MONGO_URL}')
+
+
+# ============================================================================
+# SEED DATA
+# ============================================================================
+
+async def seed_background_data(db, trainers=200, trainees=200, sessions=2000, conversations=100):
+    """Insert enough unrelated documents that a missing index shows up as a scan"""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    trainer_ids = [f'seed-trainer-{i}' for i in range(trainers)]
+    trainee_ids = [f'seed-trainee-{i}' for i in range(trainees)]
+
+    await db.trainer_profiles.insert_many([{
+        'userId': user_id,
+        'bio': 'Seeded trainer',
+        'trainingStyles': rng.sample(['strength', 'yoga', 'hiit', 'boxing', 'mobility'], 2),
+        'offersInPerson': True,
+        'offersVirtual': rng.random() < 0.3,
+        'isVirtualTrainingAvailable': rng.random() < 0.3,
+        'isAvailable': rng.random() < 0.5,
+        'sessionDurationsOffered': [30, 45, 60],
+        'ratePerMinuteCents': rng.randint(50, 250),
+        'latitude': CENTER_LAT + rng.uniform(-1, 1),
+        'longitude': CENTER_LON + rng.uniform(-1, 1),
+        'averageRating': round(rng.uniform(3, 5), 2),
+        'totalSessionsCompleted': rng.randint(0, 50),
+        'isVerified': False,
+        'createdAt': now,
+        'updatedAt': now,
+    } for user_id in trainer_ids])
+
+    await db.trainee_profiles.insert_many([{
+        'userId': user_id,
+        'currentFitnessLevel': 'beginner',
+        'latitude': CENTER_LAT + rng.uniform(-1, 1),
+        'longitude': CENTER_LON + rng.uniform(-1, 1),
+        'createdAt': now,
+        'updatedAt': now,
+    } for user_id in trainee_ids])
+
+    statuses = ['requested', 'confirmed', 'declined', 'cancelled', 'completed']
+    session_docs = []
+    for _ in range(sessions):
+        start = now + timedelta(hours=rng.randint(-24 * 60, 24 * 30))
+        session_docs.append({
+            'traineeId': rng.choice(trainee_ids),
+            'trainerId': rng.choice(trainer_ids),
+            'status': rng.choice(statuses),
+            'sessionDateTimeStart': start,
+            'sessionDateTimeEnd': start + timedelta(minutes=60),
+            'durationMinutes': 60,
+            'basePricePerMinuteCents': 100,
+            'baseSessionPriceCents': 6000,
+            'discountType': None,
+            'discountAmountCents': 0,
+            'finalSessionPriceCents': 6000,
+            'platformFeePercent': 10,
+            'platformFeeCents': 600,
+            'trainerEarningsCents': 5400,
+            'locationType': 'gym',
+            'createdAt': start - timedelta(days=2),
+            'updatedAt': start - timedelta(days=2),
+        })
+    result = await db.sessions.insert_many(session_docs)
+
+    await db.ratings.insert_many([{
+        'sessionId': str(session_id),
+        'traineeId': rng.choice(trainee_ids),
+        'trainerId': rng.choice(trainer_ids),
+        'rating': rng.randint(1, 5),
+        'createdAt': now,
+    } for session_id in result.inserted_ids[:300]])
+
+    conversation_docs, message_docs = [], []
+    for i in range(conversations):
+        participants = [rng.choice(trainer_ids), rng.choice(trainee_ids)]
+        conversation_docs.append({
+            '_id': f'seed-conversation-{i}',
+            'participants': participants,
+            'createdAt': now,
+            'updatedAt': now,
+        })
+        for j in range(10):
+            message_docs.append({
+                '_id': f'seed-message-{i}-{j}',
+                'conversationId': f'seed-conversation-{i}',
+                'senderId': participants[j % 2],
+                'receiverId': participants[(j + 1) % 2],
+                'content': 'hello',
+                'isRead': False,
+                'createdAt': now + timedelta(seconds=j),
+            })
+    await db.conversations.insert_many(conversation_docs)
+    await db.messages.insert_many(message_docs)
+
+
+# ============================================================================
+# ROUTE SCENARIO
+# ============================================================================
+
+async def run_routes(server, recorder):
+    """Drive every route once, returning ``[(route, status_code, commands)]``"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+    calls = []
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+        async def call(route, url, token=None, **kwargs):
+            method = route.split(' ', 1)[0]
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+            recorder.start()
+            response = await http.request(method, url, headers=headers, **kwargs)
+            calls.append((route, response.status_code, recorder.stop()))
+            return response
+
+        async def signup(name, email, roles):
+            response = await call('POST /api/auth/signup', '/api/auth/signup', json={
+                'fullName': name, 'email': email, 'phone': '555-0100', 'password': 'password123', 'roles': roles,
+            })
+            body = response.json()
+            return body['user']['id'], body['access_token']
+
+        trainer_id, trainer_token = await signup('Plan Trainer', 'plan-trainer@example.com', ['trainer'])
+        trainee_id, trainee_token = await signup('Plan Trainee', 'plan-trainee@example.com', ['trainee'])
+        admin_id, admin_token = await signup('Plan Admin', 'plan-admin@example.com', ['trainer', 'trainee'])
+        await server.db.users.update_one({'email': 'plan-admin@example.com'}, {'$set': {'isAdmin': True}})
+
+        await call('POST /api/auth/login', '/api/auth/login',
+                   json={'email': 'plan-trainee@example.com', 'password': 'password123'})
+        await call('GET /api/auth/me', '/api/auth/me', trainee_token)
+
+        # Profiles
+        profile = await call('POST /api/trainer-profiles', '/api/trainer-profiles', trainer_token, json={
+            'userId': trainer_id, 'bio': 'Plan trainer', 'trainingStyles': ['strength'],
+            'offersVirtual': True, 'isVirtualTrainingAvailable': True,
+            'latitude': CENTER_LAT, 'longitude': CENTER_LON,
+        })
+        trainer_profile_id = profile.json()['id']
+        await call('GET /api/trainer-profiles/{user_id}', f'/api/trainer-profiles/{trainer_id}')
+        await call('POST /api/trainee-profiles', '/api/trainee-profiles', trainee_token, json={
+            'userId': trainee_id, 'latitude': CENTER_LAT, 'longitude': CENTER_LON,
+        })
+        await call('GET /api/trainee-profiles/{user_id}', f'/api/trainee-profiles/{trainee_id}')
+        await call('PATCH /api/trainer-profiles/me', '/api/trainer-profiles/me', trainer_token,
+                   json={'ratePerMinuteCents': 100})
+        await call('PATCH /api/trainee-profiles/me', '/api/trainee-profiles/me', trainee_token,
+                   json={'fitnessGoals': 'Get stronger'})
+        await call('POST /api/trainer-profiles/upload-documents', '/api/trainer-profiles/upload-documents',
+                   trainer_token, json=['ZG9jdW1lbnQ='])
+        await call('GET /api/trainer-profiles/my-documents', '/api/trainer-profiles/my-documents', trainer_token)
+        await call('PATCH /api/trainer-profiles/toggle-availability', '/api/trainer-profiles/toggle-availability',
+                   trainer_token, params={'isAvailable': True})
+
+        # Discovery
+        await call('GET /api/trainers/search', '/api/trainers/search', trainee_token,
+                   params={'latitude': CENTER_LAT, 'longitude': CENTER_LON, 'wantsVirtual': True})
+        await call('GET /api/trainers/search', '/api/trainers/search', trainee_token,
+                   params={'styles': 'strength,yoga', 'minPrice': 50, 'maxPrice': 150})
+        await call('GET /api/trainers/search', '/api/trainers/search', trainee_token,
+                   params={'latitude': CENTER_LAT, 'longitude': CENTER_LON,
+                           'availableAt': (datetime.utcnow() + timedelta(days=1)).isoformat()})
+        await call('GET /api/trainers/nearby-trainees', '/api/trainers/nearby-trainees', trainer_token)
+        await call('GET /api/trainers/{trainer_id}/free-slots', f'/api/trainers/{trainer_id}/free-slots')
+
+        # Sessions
+        session_ids = []
+        for days in (1, 2, 3):
+            response = await call('POST /api/sessions', '/api/sessions', trainee_token, json={
+                'traineeId': trainee_id, 'trainerId': trainer_id,
+                'sessionDateTimeStart': (datetime.utcnow() + timedelta(days=days)).isoformat(),
+                'durationMinutes': 60, 'locationType': 'gym',
+            })
+            session_ids.append(response.json()['id'])
+        series = await call('POST /api/session-series', '/api/session-series', trainee_token, json={
+            'traineeId': trainee_id, 'trainerId': trainer_id,
+            'firstSessionStart': (datetime.utcnow() + timedelta(days=4)).isoformat(),
+            'durationMinutes': 60, 'occurrences': 8, 'locationType': 'gym',
+        })
+        await call('GET /api/sessions/{session_id}', f'/api/sessions/{session_ids[0]}')
+        await call('GET /api/trainer/sessions', '/api/trainer/sessions', trainer_token)
+        await call('GET /api/trainer/sessions', '/api/trainer/sessions', trainer_token, params={'status': 'requested'})
+        await call('GET /api/trainee/sessions', '/api/trainee/sessions', trainee_token)
+        first_page = await call('GET /api/trainee/sessions', '/api/trainee/sessions', trainee_token, params={
+            'from': datetime.utcnow().isoformat(), 'to': (datetime.utcnow() + timedelta(days=7)).isoformat(),
+            'limit': 2,
+        })
+        await call('GET /api/trainee/sessions', '/api/trainee/sessions', trainee_token,
+                   params={'limit': 2, 'cursor': first_page.headers['X-Next-Cursor']})
+        feed = await call('POST /api/trainer/calendar-feed', '/api/trainer/calendar-feed', trainer_token)
+        await call('GET /api/calendar/{token}.ics', feed.json()['url'])
+        await call('PATCH /api/session-series/{series_id}/cancel', f"/api/session-series/{series.json()['id']}/cancel",
+                   trainee_token)
+        await call('PATCH /api/sessions/{session_id}/accept', f'/api/sessions/{session_ids[0]}/accept', trainer_token)
+        await call('PATCH /api/sessions/{session_id}/decline', f'/api/sessions/{session_ids[1]}/decline', trainer_token)
+        await call('PATCH /api/sessions/{session_id}/cancel', f'/api/sessions/{session_ids[2]}/cancel', trainee_token)
+        await call('PATCH /api/sessions/{session_id}/complete', f'/api/sessions/{session_ids[0]}/complete',
+                   trainer_token)
+        await call('POST /api/virtual-sessions/request', '/api/virtual-sessions/request', trainee_token,
+                   json={'traineeId': trainee_id})
+
+        # Ratings and earnings
+        await call('POST /api/ratings', '/api/ratings', trainee_token, json={
+            'sessionId': session_ids[0], 'traineeId': trainee_id, 'trainerId': trainer_id, 'rating': 5,
+        })
+        await call('GET /api/trainers/{trainer_id}/ratings', f'/api/trainers/{trainer_id}/ratings')
+        await call('GET /api/trainer/earnings', '/api/trainer/earnings', trainer_token)
+
+        # Chat
+        message = await call('POST /api/messages', '/api/messages', trainee_token,
+                             json={'receiverId': trainer_id, 'content': 'See you tomorrow'})
+        conversation_id = message.json()['conversationId']
+        await call('GET /api/conversations', '/api/conversations', trainer_token)
+        await call('GET /api/conversations/{conversation_id}/messages',
+                   f'/api/conversations/{conversation_id}/messages', trainer_token)
+        await call('POST /api/conversations', '/api/conversations', trainee_token, params={'receiver_id': admin_id})
+
+        # Safety
+        await call('POST /api/safety/report', '/api/safety/report', trainee_token,
+                   json={'reportedUserId': admin_id, 'reason': 'spam'})
+        await call('POST /api/safety/block/{blocked_user_id}', f'/api/safety/block/{admin_id}', trainee_token)
+        await call('GET /api/safety/blocks', '/api/safety/blocks', trainee_token)
+        await call('DELETE /api/safety/block/{blocked_user_id}', f'/api/safety/block/{admin_id}', trainee_token)
+
+        # Achievements
+        await call('GET /api/trainer/achievements', '/api/trainer/achievements', trainer_token)
+        await call('POST /api/trainer/check-badges', '/api/trainer/check-badges', trainer_token)
+        await call('GET /api/trainee/achievements', '/api/trainee/achievements', trainee_token)
+        await call('POST /api/trainee/check-badges', '/api/trainee/check-badges', trainee_token)
+
+        # Admin
+        await call('GET /api/admin/trainers', '/api/admin/trainers', admin_token)
+        await call('PATCH /api/admin/trainers/{trainer_id}/verify', f'/api/admin/trainers/{trainer_profile_id}/verify',
+                   admin_token, params={'verified': True})
+        await call('GET /api/admin/sessions', '/api/admin/sessions', admin_token)
+        await call('GET /api/admin/revenue', '/api/admin/revenue', admin_token)
+        await call('POST /api/admin/profile', '/api/admin/profile', admin_token,
+                   json={'pathPrefix': '/api/health', 'requests': 1})
+        await call('GET /api/health', '/api/health')
+        profiles = await call('GET /api/admin/profiles', '/api/admin/profiles', admin_token)
+        profile_id = profiles.json()['profiles'][0]['id']
+        await call('GET /api/admin/profiles/{profile_id}', f'/api/admin/profiles/{profile_id}', admin_token)
+        await call('GET /api/admin/profiles/{profile_id}', f'/api/admin/profiles/{profile_id}', admin_token,
+                   params={'format': 'speedscope'})
+        await call('DELETE /api/admin/profile', '/api/admin/profile', admin_token)
+
+        await call('GET /api/', '/api/')
+        await call('GET /api/health', '/api/health')
+        await call('DELETE /api/auth/me', '/api/auth/me', trainee_token)
+
+    return calls
+
+
+# ============================================================================
+# PLAN ANALYSIS
+# ============================================================================
+
+def _find_key(node, key):
+    """Yield every value stored under ``key`` anywhere in a nested explain document"""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                yield v
+            else:
+                yield from _find_key(v, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _find_key(item, key)
+
+
+async def explain_command(db, command: dict) -> dict:
+    """Explain a captured command and summarise the plan it gets"""
+    from indexes import winning_plan_stages
+
+    explain = await db.command({'explain': command['body'], 'verbosity': 'executionStats'})
+
+    stages = []
+    for planner in _find_key(explain, 'queryPlanner'):
+        stages.extend(winning_plan_stages({'queryPlanner': planner}))
+    stats = list(_find_key(explain, 'executionStats'))
+
+    return {
+        'collection': command['collection'],
+        'command': command['command'],
+        'indexes': [s['indexName'] for s in stages if s.get('stage') == 'IXSCAN'],
+        'collectionScan': any(s.get('stage') == 'COLLSCAN' for s in stages),
+        'docsExamined': sum(s.get('totalDocsExamined', 0) for s in stats),
+        'nReturned': sum(s.get('nReturned', 0) for s in stats),
+        'durationMs': command['durationMs'],
+    }
+
+
+def plan_problems(route: str, plan: dict) -> list:
+    if (route, plan['collection']) in ALLOWED_COLLECTION_SCANS:
+        return []
+    problems = []
+    if plan['collectionScan']:
+        problems.append('COLLSCAN')
+    if plan['docsExamined'] > max(MAX_DOCS_EXAMINED_RATIO * max(plan['nReturned'], 1), DOCS_EXAMINED_SLACK):
+        problems.append(f"examined {plan['docsExamined']} docs for {plan['nReturned']} returned")
+    return problems
+
+
+async def analyse(server, recorder) -> dict:
+    calls = await run_routes(server, recorder)
+
+    report = {}
+    for route, status_code, commands in calls:
+        entry = report.setdefault(route, {
+            'calls': 0, 'statusCodes': [], 'queryCount': 0,
+            'docsExamined': 0, 'docsReturned': 0, 'plans': [], 'problems': [],
+        })
+        entry['calls'] += 1
+        entry['statusCodes'].append(status_code)
+        entry['queryCount'] += len(commands)
+        for command in commands:
+            entry['docsReturned'] += command['docsReturned']
+            if command['command'] not in EXPLAINABLE_COMMANDS or command.get('failure'):
+                continue
+            plan = await explain_command(server.db, command)
+            entry['docsExamined'] += plan['docsExamined']
+            entry['plans'].append(plan)
+            for problem in plan_problems(route, plan):
+                entry['problems'].append(f"{plan['command']} {plan['collection']}: {problem}")
+
+    for entry in report.values():
+        entry['docsExaminedRatio'] = round(entry['docsExamined'] / max(entry['docsReturned'], 1), 2)
+    return report
+
+
+@pytest.fixture(scope='module')
+def query_plan_report():
+    os.environ.setdefault('MONGO_URL', MONGO_URL)
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from db_monitor import CommandRecorder
+    from indexes import ensure_indexes
+    import server
+
+    async def run():
+        recorder = CommandRecorder()
+        client = AsyncIOMotorClient(MONGO_URL, event_listeners=[recorder])
+        original_db = server.db
+        server.db = client[DB_NAME]
+        try:
+            await client.drop_database(DB_NAME)
+            await seed_background_data(server.db)
+            await ensure_indexes(server.db)
+            return await analyse(server, recorder)
+        finally:
+            await client.drop_database(DB_NAME)
+            server.db = original_db
+            client.close()
+
+    report = asyncio.run(run())
+
+    REPORT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    REPORT_PATH.write_text(json.dumps(report, indent=2, default=str))
+    return report
+
+
+def test_every_route_was_exercised(query_plan_report):
+    import server
+
+    exercised = set(query_plan_report)
+    for route in server.api_router.routes:
+        for method in route.methods:
+            assert f'{method} {route.path}' in exercised, f'{method} {route.path} is not covered by the scenario'
+
+
+def test_no_unindexed_queries(query_plan_report):
+    problems = [
+        f'{route}: {problem}'
+        for route, entry in query_plan_report.items()
+        for problem in entry['problems']
+    ]
+    assert not problems, 'Query plan regressions:\n' + '\n'.join(problems)
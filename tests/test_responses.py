@@ -0,0 +1,35 @@
+"""
+The fast response path must produce the same JSON as FastAPI's validated one.
+"""
+import json
+from datetime import datetime
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from responses import FastJSONResponse, model_list_response
+
+
+def test_fast_json_encodes_objectids_and_datetimes():
+    oid = ObjectId()
+    body = FastJSONResponse({'_id': oid, 'at': datetime(2024, 5, 1, 9, 30, 0, 250)}).body
+    assert json.loads(body) == {'_id': str(oid), 'at': '2024-05-01T09:30:00.000250'}
+
+
+def test_model_list_response_matches_validated_output():
+    import server
+
+    docs = [{
+        'id': str(ObjectId()), 'traineeId': 't', 'trainerId': 'r', 'status': 'requested',
+        'sessionDateTimeStart': datetime(2024, 5, 1, 9), 'sessionDateTimeEnd': datetime(2024, 5, 1, 10),
+        'durationMinutes': 60, 'basePricePerMinuteCents': 100, 'baseSessionPriceCents': 6000,
+        'finalSessionPriceCents': 6000, 'platformFeeCents': 600, 'trainerEarningsCents': 5400,
+        'locationType': 'gym', 'createdAt': datetime(2024, 4, 1), 'paymentIntentId': None,
+    }]
+    validated = TypeAdapter(List[server.SessionResponse]).dump_json(
+        [server.SessionResponse(**doc) for doc in docs])
+
+    response = model_list_response(server.SessionResponse, docs)
+    assert response.body == validated
+    assert 'paymentIntentId' not in json.loads(response.body)[0]
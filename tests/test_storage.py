@@ -0,0 +1,173 @@
+"""
+Behaviour of the in-memory storage backend that the API relies on.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from storage import MemoryClient
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db():
+    return MemoryClient()['storage_test']
+
+
+def test_insert_assigns_id_and_returns_copies(db):
+    async def scenario():
+        doc = {'name': 'a', 'tags': ['x']}
+        result = await db.things.insert_one(doc)
+        assert doc['_id'] == result.inserted_id
+
+        found = await db.things.find_one({'_id': result.inserted_id})
+        found['tags'].append('y')
+        assert (await db.things.find_one({}))['tags'] == ['x']
+
+    run(scenario())
+
+
+def test_filters(db):
+    async def scenario():
+        now = datetime.utcnow()
+        await db.sessions.insert_many([
+            {'trainerId': 't1', 'status': 'requested', 'start': now, 'tags': ['a', 'b']},
+            {'trainerId': 't1', 'status': 'declined', 'start': now - timedelta(days=40), 'tags': ['b']},
+            {'trainerId': 't2', 'status': 'confirmed', 'start': now + timedelta(days=1), 'note': None},
+        ])
+
+        async def count(query):
+            return await db.sessions.count_documents(query)
+
+        assert await count({'trainerId': 't1'}) == 2
+        assert await count({'trainerId': 't1', 'status': {'$ne': 'declined'}}) == 1
+        assert await count({'start': {'$gte': now - timedelta(days=30)}}) == 2
+        assert await count({'tags': 'a'}) == 1
+        assert await count({'tags': {'$in': ['b', 'z']}}) == 2
+        assert await count({'tags': {'$all': ['a', 'b']}}) == 1
+        assert await count({'$or': [{'status': 'confirmed'}, {'tags': 'a'}]}) == 2
+        assert await count({'note': None}) == 3
+        assert await count({'note': {'$exists': True}}) == 1
+        assert await count({'status': {'$regex': '^con'}}) == 1
+        # Values of different types never compare
+        assert await count({'start': {'$gte': 5}}) == 0
+
+    run(scenario())
+
+
+def test_sort_skip_limit_and_projection(db):
+    async def scenario():
+        await db.items.insert_many([{'group': i % 2, 'rank': i, 'extra': 'x'} for i in range(6)])
+
+        docs = await db.items.find({}, {'rank': 1, '_id': 0}).sort(
+            [('group', ASCENDING), ('rank', DESCENDING)]).skip(1).limit(3).to_list(None)
+        assert docs == [{'rank': 2}, {'rank': 0}, {'rank': 5}]
+
+        ranks = [doc['rank'] async for doc in db.items.find({'group': 1}).sort('rank', -1)]
+        assert ranks == [5, 3, 1]
+
+    run(scenario())
+
+
+def test_update_operators_and_upsert(db):
+    async def scenario():
+        await db.profiles.insert_one({'userId': 'u1', 'count': 1, 'tags': ['a']})
+
+        result = await db.profiles.update_one({'userId': 'u1'}, {
+            '$set': {'stats.rating': 4.5}, '$inc': {'count': 2}, '$addToSet': {'tags': 'a'}, '$push': {'log': 1},
+        })
+        assert (result.matched_count, result.modified_count) == (1, 1)
+        doc = await db.profiles.find_one({'userId': 'u1'}, {'_id': 0})
+        assert doc == {'userId': 'u1', 'count': 3, 'tags': ['a'], 'stats': {'rating': 4.5}, 'log': [1]}
+
+        unchanged = await db.profiles.update_one({'userId': 'u1'}, {'$set': {'count': 3}})
+        assert unchanged.modified_count == 0
+
+        created = await db.profiles.find_one_and_update(
+            {'userId': 'u2'}, {'$set': {'bio': 'new'}, '$setOnInsert': {'count': 0}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        assert (created['userId'], created['bio'], created['count']) == ('u2', 'new', 0)
+
+        again = await db.profiles.find_one_and_update(
+            {'userId': 'u2'}, {'$set': {'bio': 'newer'}, '$setOnInsert': {'count': 99}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        assert (again['bio'], again['count']) == ('newer', 0)
+
+    run(scenario())
+
+
+def test_pipeline_updates(db):
+    async def scenario():
+        await db.sessions.insert_many([
+            {'_id': 1, 'status': 'confirmed', 'price': 6000, 'note': 'x'},
+            {'_id': 2, 'status': 'requested', 'price': 6000},
+        ])
+        pipeline = [
+            {'$set': {'fee': {'$cond': [{'$eq': ['$status', 'confirmed']},
+                                        {'$toInt': {'$multiply': ['$price', 0.2]}}, 0]}}},
+            {'$set': {'refund': {'$subtract': [{'$ifNull': ['$price', 0]}, '$fee']},
+                      'status': {'$literal': '$cancelled'}}},
+            {'$unset': 'note'},
+        ]
+        result = await db.sessions.update_many({}, pipeline)
+        assert result.modified_count == 2
+
+        docs = await db.sessions.find({}, {'_id': 0}).sort('_id', 1).to_list(None)
+        assert docs == [
+            {'status': '$cancelled', 'price': 6000, 'fee': 1200, 'refund': 4800},
+            {'status': '$cancelled', 'price': 6000, 'fee': 0, 'refund': 6000},
+        ]
+
+    run(scenario())
+
+
+def test_unique_indexes(db):
+    async def scenario():
+        await db.users.create_indexes([
+            IndexModel([('email', ASCENDING)], name='email_ci', unique=True,
+                       collation={'locale': 'en', 'strength': 2}),
+        ])
+        await db.users.insert_one({'email': 'Ann@example.com'})
+        with pytest.raises(DuplicateKeyError):
+            await db.users.insert_one({'email': 'ann@EXAMPLE.com'})
+
+        bob = await db.users.insert_one({'email': 'bob@example.com'})
+        with pytest.raises(DuplicateKeyError):
+            await db.users.update_one({'_id': bob.inserted_id}, {'$set': {'email': 'ANN@example.com'}})
+
+        with pytest.raises(BulkWriteError) as excinfo:
+            await db.users.insert_many([{'email': 'ann@example.com'}, {'email': 'cat@example.com'}], ordered=False)
+        assert excinfo.value.details['nInserted'] == 1
+
+        await db.users.delete_one({'email': 'bob@example.com'})
+        await db.users.insert_one({'email': 'BOB@example.com'})
+        assert 'email_ci' in await db.users.index_information()
+
+    run(scenario())
+
+
+def test_indexed_lookups_follow_writes(db):
+    async def scenario():
+        await db.conversations.create_indexes([IndexModel([('participants', ASCENDING), ('updatedAt', DESCENDING)])])
+        first = await db.conversations.insert_one({'participants': ['a', 'b'], 'n': 1})
+        await db.conversations.insert_one({'participants': ['a', 'c'], 'n': True})
+
+        assert await db.conversations.count_documents({'participants': 'a'}) == 2
+        assert await db.conversations.count_documents({'participants': 'a', 'n': 1}) == 1
+        assert await db.conversations.count_documents({'participants': {'$eq': 'c'}}) == 1
+
+        await db.conversations.update_one({'_id': first.inserted_id}, {'$set': {'participants': ['b', 'd']}})
+        assert await db.conversations.count_documents({'participants': 'a'}) == 1
+        assert await db.conversations.count_documents({'participants': 'd'}) == 1
+
+        await db.conversations.delete_many({'participants': 'b'})
+        assert await db.conversations.count_documents({'participants': 'd'}) == 0
+        assert await db.conversations.count_documents({'missing': None}) == 1
+
+    run(scenario())
@@ -0,0 +1,86 @@
+"""
+Session sweeper: overdue sessions advance in batches, and only the lease holder sweeps.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import scheduling
+import sweeper
+from metrics import SWEEPER_LAG
+
+
+def session(trainer_id, status, ended_minutes_ago, now):
+    end = now - timedelta(minutes=ended_minutes_ago)
+    return {
+        '_id': ObjectId(), 'trainerId': trainer_id, 'traineeId': 'trainee', 'status': status,
+        'sessionDateTimeStart': end - timedelta(minutes=60), 'sessionDateTimeEnd': end,
+    }
+
+
+def test_sweep_moves_overdue_sessions(memory_db):
+    async def scenario():
+        now = datetime(2026, 3, 1, 12)
+        await memory_db.trainer_profiles.insert_many([
+            {'userId': 'busy', 'totalSessionsCompleted': 10}, {'userId': 'quiet', 'totalSessionsCompleted': 0},
+        ])
+        done = [session('busy', 'confirmed', 120 + i, now) for i in range(5)] + [session('quiet', 'confirmed', 90, now)]
+        grace = session('busy', 'confirmed', 10, now)
+        unanswered = session('quiet', 'requested', 5, now)
+        upcoming = session('busy', 'requested', -120, now)
+        cancelled = session('busy', 'cancelled', 300, now)
+        await memory_db.sessions.insert_many(done + [grace, unanswered, upcoming, cancelled])
+        await scheduling.reserve_slots(memory_db.session_slots, 'quiet', [
+            (unanswered['_id'], unanswered['sessionDateTimeStart'], unanswered['sessionDateTimeEnd']),
+        ])
+
+        notified = []
+
+        async def on_swept(trainer_ids):
+            notified.extend(trainer_ids)
+
+        worker = sweeper.SessionSweeper(memory_db, on_swept=on_swept, batch_size=2, owner='worker-a')
+        assert await worker.run_once(now) == {'completed': 6, 'no_show': 1}
+
+        async def status(doc):
+            return (await memory_db.sessions.find_one({'_id': doc['_id']}))['status']
+
+        assert [await status(doc) for doc in done] == ['completed'] * 6
+        assert await status(grace) == 'confirmed'
+        assert await status(unanswered) == 'no_show'
+        assert await status(upcoming) == 'requested'
+        assert await status(cancelled) == 'cancelled'
+        assert await memory_db.session_slots.count_documents({'sessionId': unanswered['_id']}) == 0
+        stats = {p['userId']: p['totalSessionsCompleted'] async for p in memory_db.trainer_profiles.find({})}
+        assert stats == {'busy': 15, 'quiet': 1}
+        assert sorted(set(notified)) == ['busy', 'quiet']
+        assert SWEEPER_LAG.value('completed') == 0
+
+        # Nothing left to do; the grace-period session is picked up once it has passed
+        assert await worker.run_once(now) == {'completed': 0, 'no_show': 0}
+        assert await worker.run_once(now + timedelta(hours=1)) == {'completed': 1, 'no_show': 0}
+
+    asyncio.run(scenario())
+
+
+def test_only_the_lease_holder_sweeps(memory_db):
+    async def scenario():
+        now = datetime(2026, 3, 1, 12)
+        lease = timedelta(seconds=sweeper.SWEEPER_LEASE_SECONDS)
+        first = sweeper.SessionSweeper(memory_db, owner='worker-a')
+        second = sweeper.SessionSweeper(memory_db, owner='worker-b')
+
+        assert await first.run_once(now) is not None
+        assert await second.run_once(now) is None
+        # The holder renews its lease on every run
+        assert await first.run_once(now + lease / 2) is not None
+        assert await second.run_once(now + lease) is None
+        # A holder that stops renewing loses the lease once it expires
+        assert await second.run_once(now + lease * 2) is not None
+        assert await first.run_once(now + lease * 2) is None
+
+        await sweeper.release_lease(memory_db.scheduler_locks, sweeper.LOCK_NAME, 'worker-b')
+        assert await first.run_once(now + lease * 2) is not None
+
+    asyncio.run(scenario())